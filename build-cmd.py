@@ -108,7 +108,9 @@ def main():
     os.mkdir(stage_VMP)
     pyinstaller(mainfile=os.path.join(src, "SLVersionChecker.py"),
                 dstdir=stage_VMP,
-                icon=icon)
+                icon=icon,
+                # read at runtime: see gpu_rules.py
+                data=[os.path.join(src, 'gpu_rules.json')])
 
     #best effort cleanup after pyinstaller
     rmtree(build, ignore_errors=True)
@@ -120,7 +122,7 @@ def main():
 
     print("Build Succeeded")
 
-def pyinstaller(mainfile, dstdir, icon, manifest_from_build=None):
+def pyinstaller(mainfile, dstdir, icon, manifest_from_build=None, data=()):
     basename = os.path.basename(mainfile)
     print((" %s " % basename).center(72, '='))
     print("target %r exists: %s" % (mainfile, os.path.exists(mainfile)))
@@ -141,6 +143,9 @@ def pyinstaller(mainfile, dstdir, icon, manifest_from_build=None):
         # where to put the generated executable
         "--distpath", dstdir,
         mainfile]
+    for datafile in data:
+        # bundle it alongside the modules, where sys._MEIPASS points at runtime
+        command[-1:-1] = ["--add-data", datafile + os.pathsep + "."]
     # Also note, in case of need:
     # --debug: produce runtime startup messages about imports and such (may
     #          need --console rather than -w?)
@@ -53,6 +53,12 @@ eventlet.monkey_patch(os=(platform.system() != 'Windows'),
                       builtins=True, subprocess=True)
 
 import apply_update
+import chunk_manifest
+import download_scheduler
+import download_worker
+import lan_cache
+import mirrors
+import task_graph
 from runner import Runner, PopenRunner
 from InstallerUserMessage import safe_status_message
 from InstallerUserMessage import basic_message
@@ -199,6 +205,29 @@ def delete_wrapper(desc, path):
         # we actually deleted something -- log it for forensic purposes
         log.info("Deleted %s at '%s'", desc, path)
 
+def check_for_update(install_key, channel, testok, width):
+    """
+    Ask the update service about this viewer, with leap_body()'s parameters.
+    Return (install_mode, platdata, result from query_vvm()).
+
+    The independent steps run concurrently, as greenthreads: see task_graph,
+    and mind what it says about what the steps may call.
+    """
+    platform_key = Application.platform_key()
+    steps = task_graph.run(dict(
+        install_mode=(lambda: update_manager.decode_install_mode(install_key), ()),
+        # Adjust the target platform as needed before querying the VVM
+        platdata=(lambda: update_manager.pick_target_platform(width), ()),
+        vvm_id=(lambda: update_manager.make_VVM_UUID_hash(platform_key), ()),
+        result=(lambda platdata, vvm_id:
+                update_manager.query_vvm(platform_data=platdata,
+                                         channel=channel,
+                                         UpdaterWillingToTest=testok,
+                                         vvm_id=vvm_id),
+                ('platdata', 'vvm_id')),
+    ))
+    return tuple(steps[name] for name in ('install_mode', 'platdata', 'result'))
+
 def leap_body(install_key, channel, testok, width):
     """
     Pass:
@@ -238,14 +267,7 @@ def leap_body(install_key, channel, testok, width):
     # with its index. We need a lookup in the other direction: name->index.
     STARTUP_STATES = {name: index for index, name in enumerate(table)}
 
-    install_mode = update_manager.decode_install_mode(install_key)
-
-    # Adjust the target platform as needed before querying the VVM
-    platdata = update_manager.pick_target_platform(width)
-
-    result = update_manager.query_vvm(platform_data=platdata,
-                                      channel=channel,
-                                      UpdaterWillingToTest=testok)
+    install_mode, platdata, result = check_for_update(install_key, channel, testok, width)
     if not result:
         log.info("No update.")
         post_guessed_relnotes(viewer)
@@ -283,9 +305,12 @@ def leap_body(install_key, channel, testok, width):
         if catch_viewer_before_login(viewer, result, "PauseForUpdate"):
             viewer.shutdown()
             # TODO: Is this correct?? Shouldn't we check for partial download?
-            if downloaded is None:
+            if downloaded is None or \
+               (downloaded == 'skip' and update_manager.download_in_progress(download_dir)):
                 # We haven't yet downloaded the required update -- do so right
-                # now, in the foreground, with a progress bar.
+                # now, in the foreground, with a progress bar. If another
+                # process is downloading it, download() waits for that and
+                # checks the result.
                 installer = download(
                     which="required", download_dir=download_dir, result=result, ui=True)
             else:
@@ -311,8 +336,17 @@ def leap_body(install_key, channel, testok, width):
         log.info("not installing optional update per UpdaterServiceSetting")
         return
 
-    # Yes the user is willing to accept optional updates. Have we already
-    # prompted? Did the user direct us to skip this particular version?
+    # Yes the user is willing to accept optional updates. Is a background
+    # downloader already working on it?
+    status = download_worker.read_status(download_dir)
+    if downloaded == 'skip' and status and status.get('state') == 'downloading':
+        log.info("Background downloader %s has %s of %s bytes of version %s",
+                 status.get('pid'), status.get('completed'), status.get('size'),
+                 result['version'])
+        return
+
+    # Have we already prompted? Did the user direct us to skip this
+    # particular version?
     if downloaded == 'skip':
         log.info("Skipping this update per previous choice. "
                  "Delete the .skip file in %s to change this.", download_dir)
@@ -519,12 +553,18 @@ def process_optional_update(log, viewer, installer, result, install_mode, platfo
 def download(log, which, download_dir, result, ui=True):
     log.info("Found %s update to version %s. Downloading%s to: %s",
              which, result['version'], ("" if ui else " in background"), download_dir)
-    return update_manager.download(url=result['url'],
-                                   version=result['version'],
-                                   download_dir=download_dir,
-                                   hash=result['hash'],
-                                   size=result['size'],
-                                   ui=ui)
+    # only optional updates yield bandwidth to the viewer, or to a required download
+    priority = (download_scheduler.REQUIRED if which == "required"
+                else download_scheduler.OPTIONAL)
+    return download_scheduler.run(priority, download_dir, update_manager.download,
+                                  url=result['url'],
+                                  version=result['version'],
+                                  hash=result['hash'],
+                                  size=result['size'],
+                                  ui=ui,
+                                  manifest=chunk_manifest.from_result(result),
+                                  delta=result.get('delta'),
+                                  mirror_urls=mirrors.from_result(result))
 
 # ****************************************************************************
 #   install()
@@ -644,6 +684,29 @@ def main(*raw_args):
                          help='ForceAddressSize setting')
     subleap.set_defaults(func=leap)
 
+    # download subcommand
+    subdownload = subparsers.add_parser('download',
+        help="""Download an optional update in the background, reporting
+        progress in a status file next to the job file""")
+    subdownload.add_argument('job',
+                             help='job file written by the launcher')
+    subdownload.set_defaults(func=download_worker.run)
+
+    # serve subcommand
+    subserve = subparsers.add_parser('serve',
+        help="""Run a caching proxy for the update service, so that the
+        viewers on a LAN fetch each installer from the CDN only once. Point
+        them at it with SL_UPDATE_SERVICE=http://thishost:PORT""")
+    subserve.add_argument('--port', type=int, default=lan_cache.DEFAULT_PORT,
+                          help='port to listen on (default %(default)s)')
+    subserve.add_argument('--bind', default='',
+                          help='address to listen on (default all)')
+    subserve.add_argument('--cache',
+                          help='directory in which to keep installers')
+    subserve.add_argument('--upstream',
+                          help='update service URL (default as for update checks)')
+    subserve.set_defaults(func=lan_cache.serve)
+
     # Parse the command line and invoke appropriate subcommand.
     args = parser.parse_args(raw_args)
     argvars = vars(args)
@@ -46,6 +46,7 @@ from pathlib import Path
 import plistlib
 from runner import Runner, ExecRunner
 import shutil
+import stream_extract
 import subprocess
 import tarfile
 import tempfile
@@ -139,10 +140,14 @@ def apply_linux_update(runner, installable):
     #which install the updater is run from
     install_dir = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
     try:
-        #untar to tmpdir
-        tmpdir = tempfile.mkdtemp()
-        tar = tarfile.open(name = installable, mode="r:bz2")
-        tar.extractall(path = tmpdir)
+        tmpdir = stream_extract.staged_tree(installable)
+        if tmpdir:
+            log.info("installing tree unpacked during download: %s", tmpdir)
+        else:
+            #untar to tmpdir
+            tmpdir = tempfile.mkdtemp()
+            tar = tarfile.open(name = installable, mode="r:bz2")
+            tar.extractall(path = tmpdir)
         #rename current install dir
         shutil.move(install_dir,install_dir + ".bak")
         #mv new to current
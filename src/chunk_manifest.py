@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""\
+@file   chunk_manifest.py
+@brief  Per-chunk digests for an installer, so that a corrupted download can
+        be caught early and repaired by re-fetching only the bad chunks.
+
+The VVM platform result (or a sidecar URL it names) may describe the
+installer as a list of fixed-size chunk digests:
+
+    'manifest': {'chunk_size': 4194304,
+                 'algorithm':  'md5',
+                 'chunks':     ['<hexdigest of chunk 0>', ...],
+                 'root':       '<optional Merkle root of chunks>'}
+
+or
+    'manifest_url': 'https://.../Second_Life_Setup.exe.manifest.json'
+
+If 'root' is present, the chunk list itself is checked against it: the root
+is computed by hashing the concatenated binary digests of each pair of nodes,
+level by level, carrying an odd node up unchanged, until one remains.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+import hashlib
+import requests
+from util import pass_logger
+
+class ManifestError(Exception):
+    pass
+
+class BadChunk(Exception):
+    def __init__(self, index, start, end):
+        super(BadChunk, self).__init__("chunk %s (bytes %s-%s) failed verification" %
+                                       (index, start, end - 1))
+        self.index = index
+        self.start = start
+        self.end = end
+
+def merkle_root(hexdigests, algorithm='md5'):
+    """Return the Merkle root (hex) of the passed leaf hexdigests"""
+    level = [bytes.fromhex(d) for d in hexdigests]
+    if not level:
+        return hashlib.new(algorithm).hexdigest()
+    while len(level) > 1:
+        paired = [hashlib.new(algorithm, level[i] + level[i+1]).digest()
+                  for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0].hex()
+
+class ChunkManifest(object):
+    def __init__(self, size, chunk_size, chunks, algorithm='md5', root=None):
+        try:
+            self.size = int(size)
+            self.chunk_size = int(chunk_size)
+            hashlib.new(algorithm)
+        except (TypeError, ValueError) as err:
+            raise ManifestError("invalid manifest: %s" % err)
+        if self.chunk_size <= 0:
+            raise ManifestError("invalid manifest chunk_size %r" % chunk_size)
+        expected = -(-self.size // self.chunk_size)
+        if len(chunks) != expected:
+            raise ManifestError("manifest lists %s chunks, %s bytes needs %s" %
+                                (len(chunks), self.size, expected))
+        if root is not None and merkle_root(chunks, algorithm) != root:
+            raise ManifestError("manifest chunks don't match Merkle root %s" % root)
+        self.chunks = [c.lower() for c in chunks]
+        self.algorithm = algorithm
+
+    @classmethod
+    def from_dict(cls, size, data):
+        try:
+            return cls(size, data['chunk_size'], data['chunks'],
+                       algorithm=data.get('algorithm', 'md5'), root=data.get('root'))
+        except (KeyError, TypeError, AttributeError) as err:
+            raise ManifestError("invalid manifest: %s: %s" % (type(err).__name__, err))
+
+    def chunk_range(self, index):
+        start = index * self.chunk_size
+        return start, min(start + self.chunk_size, self.size)
+
+    def chunks_within(self, start, end):
+        """indexes of the chunks lying entirely within bytes [start, end)"""
+        first = -(-start // self.chunk_size)
+        return range(first, end // self.chunk_size if end < self.size else len(self.chunks))
+
+    def verify_file(self, filename):
+        """Return a list of the indexes of chunks of 'filename' that don't match"""
+        bad = []
+        with open(filename, 'rb') as f:
+            for index, expected in enumerate(self.chunks):
+                start, end = self.chunk_range(index)
+                f.seek(start)
+                if hashlib.new(self.algorithm, f.read(end - start)).hexdigest() != expected:
+                    bad.append(index)
+        return bad
+
+class ChunkVerifier(object):
+    """
+    Verify the chunks of one segment [start, end) of a download as its bytes
+    arrive in order. Chunks straddling the segment's edges are left to the
+    whole-file hash: another segment is writing their other part.
+    """
+    def __init__(self, manifest, filename, start, pos, end):
+        self.manifest = manifest
+        self.indexes = manifest.chunks_within(start, end)
+        self.hash = None
+        self.index = None
+        self._begin(pos // manifest.chunk_size)
+        chunk_start, chunk_end = manifest.chunk_range(self.index)
+        if self.hash is not None and pos > chunk_start:
+            # resuming partway through a chunk: catch up on what's on disk
+            with open(filename, 'rb') as f:
+                f.seek(chunk_start)
+                self.hash.update(f.read(pos - chunk_start))
+
+    def _begin(self, index):
+        self.index = index
+        self.hash = hashlib.new(self.manifest.algorithm) if index in self.indexes else None
+
+    def update(self, pos, data):
+        """
+        'data' was just written at offset 'pos'. Raise BadChunk if it
+        completes a chunk that doesn't match the manifest.
+        """
+        view = memoryview(data)
+        while view:
+            chunk_start, chunk_end = self.manifest.chunk_range(self.index)
+            take = view[:chunk_end - pos]
+            if self.hash is not None:
+                self.hash.update(take)
+            pos += len(take)
+            view = view[len(take):]
+            if pos == chunk_end:
+                if self.hash is not None and \
+                   self.hash.hexdigest() != self.manifest.chunks[self.index]:
+                    raise BadChunk(self.index, chunk_start, chunk_end)
+                self._begin(self.index + 1)
+
+@pass_logger
+def from_result(log, result):
+    """
+    Return the ChunkManifest described by a chosen VVM result, or None if
+    there isn't one or it can't be used. This is an optimization: failure to
+    get a manifest is never fatal.
+    """
+    data = result.get('manifest')
+    try:
+        if data is None and result.get('manifest_url'):
+            log.debug("fetching chunk manifest from %s", result['manifest_url'])
+            response = requests.get(result['manifest_url'], timeout=30)
+            response.raise_for_status()
+            data = response.json()
+        if data is None:
+            return None
+        manifest = ChunkManifest.from_dict(result['size'], data)
+    except (ManifestError, KeyError, ValueError, requests.RequestException) as err:
+        log.warning("Ignoring chunk manifest: %s: %s", type(err).__name__, err)
+        return None
+    log.info("verifying download against %s-byte chunk manifest (%s chunks)",
+             manifest.chunk_size, len(manifest.chunks))
+    return manifest
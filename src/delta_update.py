@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""\
+@file   delta_update.py
+@brief  Reconstruct a new installer from the one we installed last time plus
+        a binary patch, instead of downloading the whole thing.
+
+The VVM platform result may offer a delta alongside the full installer:
+
+    'delta': {'url':          'https://.../Second_Life_7_1_3_to_7_1_4.exe.zst',
+              'hash':         '<md5 of the patch file>',
+              'size':         <bytes in the patch file>,
+              'base_version': '7.1.3.123456',
+              'format':       'zstd'}
+
+'format' names the patch encoding: 'zstd' (zstd --patch-from) or 'bsdiff4'.
+Each needs its Python module; if that isn't available, if we don't have the
+base installer, or if anything at all goes wrong, the caller just downloads
+the full installer as usual.
+
+To have a base, install() retains a hard link (or copy) of each installer
+it applies under downloads/base/<version>/.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+import apply_update
+from contextlib import suppress
+import download_update
+import hashing
+import os
+import shutil
+import tempfile
+from util import Application, BuildData, pass_logger
+
+class DeltaError(Exception):
+    pass
+
+def base_dir():
+    return os.path.join(Application.userpath(), "downloads", "base")
+
+@pass_logger
+def retain(log, installer, version):
+    """
+    Keep a copy of 'installer' for 'version' as the base for the next delta,
+    discarding any older base. Best effort: failure only costs bandwidth.
+    """
+    dest_dir = os.path.join(base_dir(), version)
+    try:
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        os.makedirs(dest_dir)
+        dest = os.path.join(dest_dir, os.path.basename(installer))
+        try:
+            # installing may consume the original; a link costs no space
+            os.link(installer, dest)
+        except OSError:
+            shutil.copy2(installer, dest)
+        for old in os.listdir(base_dir()):
+            if old != version:
+                shutil.rmtree(os.path.join(base_dir(), old), ignore_errors=True)
+    except Exception as e:
+        log.warning("Couldn't retain %s as delta base: %s: %s", installer, type(e).__name__, e)
+    else:
+        log.debug("retained %s as delta base for version %s", dest, version)
+
+def base_installer(version):
+    """path to the retained installer for 'version', or None"""
+    dest_dir = os.path.join(base_dir(), version)
+    if not os.path.isdir(dest_dir):
+        return None
+    return apply_update.get_filename(dest_dir)
+
+def _apply_zstd(base, patch, output):
+    import zstandard
+    with open(base, 'rb') as f:
+        dictionary = zstandard.ZstdCompressionDict(f.read(),
+                                                   dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+    # --patch-from needs a window as big as the base installer
+    decompressor = zstandard.ZstdDecompressor(dict_data=dictionary,
+                                              max_window_size=2**31)
+    with open(patch, 'rb') as ifh, open(output, 'wb') as ofh:
+        decompressor.copy_stream(ifh, ofh)
+
+def _apply_bsdiff4(base, patch, output):
+    import bsdiff4
+    bsdiff4.file_patch(base, output, patch)
+
+# format name: function(base, patch, output)
+APPLIERS = dict(
+    zstd=_apply_zstd,
+    bsdiff4=_apply_bsdiff4,
+    )
+
+@pass_logger
+def try_delta(log, delta, url, download_dir, hash, ui, rate_limit=None):
+    """
+    If 'delta' (from the VVM result) applies to our installed version and we
+    can handle it, download the patch and build the installer for 'url' in
+    'download_dir'. Return its pathname, or None to mean: download it in full.
+    The patch download honors 'rate_limit' just as download_update() would.
+    """
+    try:
+        return _try_delta(log, delta, url, download_dir, hash, ui, rate_limit)
+    except Exception as e:
+        log.warning("Delta update failed, falling back to full download: %s: %s",
+                    type(e).__name__, e)
+        return None
+
+def _try_delta(log, delta, url, download_dir, hash, ui, rate_limit):
+    version = BuildData.get('Version')
+    if delta.get('base_version') != version:
+        log.info("delta is from version %s, we have %s",
+                 delta.get('base_version'), version)
+        return None
+    base = base_installer(version)
+    if not base:
+        log.info("no retained installer for version %s to patch", version)
+        return None
+    fmt = delta.get('format', 'zstd')
+    try:
+        applier = APPLIERS[fmt]
+    except KeyError:
+        log.info("unknown delta format %r", fmt)
+        return None
+
+    # a sibling of download_dir, so apply_update.get_filename() never sees
+    # the patch -- and so it ages out with the version directories
+    patch_dir = download_dir + ".delta"
+    os.makedirs(patch_dir, exist_ok=True)
+    try:
+        log.info("downloading %s delta from version %s", fmt, version)
+        patch, patch_hash = download_update.download_update(
+            url=delta['url'], download_dir=patch_dir, size=delta.get('size'), progressbar=ui,
+            rate_limit=rate_limit)
+        if patch_hash is None:
+            patch_hash = hashing.hash_file(patch)['md5']
+        if patch_hash != delta.get('hash'):
+            raise DeltaError("patch hash mismatch: expected %s, received %s" %
+                             (delta.get('hash'), patch_hash))
+
+        installer = os.path.join(download_dir, url.split('/')[-1])
+        try:
+            applier(base, patch, installer)
+            installer_hash = hashing.hash_file(installer)['md5']
+            if installer_hash != hash:
+                raise DeltaError("patched installer hash mismatch: expected %s, received %s" %
+                                 (hash, installer_hash))
+        except BaseException:
+            # don't leave half an installer where check_for_completed_download() looks
+            with suppress(FileNotFoundError):
+                os.remove(installer)
+            raise
+    finally:
+        shutil.rmtree(patch_dir, ignore_errors=True)
+
+    # same marker download_update() leaves for a finished download
+    os.close(tempfile.mkstemp(suffix=".done", dir=download_dir)[0])
+    log.info("rebuilt %s from delta", installer)
+    return installer
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""\
+@file   download_lock.py
+@brief  Make sure only one process at a time downloads into a given
+        directory, and let the others see how it's going.
+
+download_update() holds an OS file lock on <download_dir>/download.lock for
+the whole download: flock() on POSIX, msvcrt.locking() on Windows. Either
+way the OS drops it if the process dies, so a lock that's held means a
+download that's really in progress -- no guessing from file sizes.
+
+While it holds the lock, the downloader keeps <download_dir>/download.owner
+up to date:
+
+    {'pid': ..., 'host': ..., 'user': ..., 'started': <time.time()>,
+     'updated': <time.time()>, 'completed': <bytes>, 'size': <bytes>}
+
+Other processes use holder() to ask whether anyone is downloading there,
+and wait() to wait for them to finish.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from contextlib import suppress
+import getpass
+import json
+import os
+import platform
+import shutil
+import time
+from util import SL_Logging
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+LOCK_FILE = 'download.lock'
+OWNER_FILE = 'download.owner'
+# how often (seconds) the owner record is rewritten with progress
+UPDATE_INTERVAL = 2
+# how often (seconds) acquire() and wait() poll the lock
+POLL = 0.1
+
+class LockHeld(Exception):
+    """Another process is downloading here: 'owner' is its record (maybe {})"""
+    def __init__(self, download_dir, owner):
+        super(LockHeld, self).__init__(
+            "download to %s in progress in process %s on %s: %s of %s bytes" %
+            (download_dir, owner.get('pid'), owner.get('host'),
+             owner.get('completed'), owner.get('size')))
+        self.owner = owner
+
+def _lock(fd):
+    # raises OSError if somebody else has it
+    if msvcrt is not None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+def _unlock(fd):
+    if msvcrt is not None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+def read_owner(download_dir):
+    """the owner record in 'download_dir', or {} if there isn't a readable one"""
+    try:
+        with open(os.path.join(download_dir, OWNER_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+class DownloadLock(object):
+    def __init__(self, download_dir):
+        self.download_dir = download_dir
+        self.fd = None
+        self.owner = None
+        self.next_update = 0
+
+    def acquire(self, timeout=0):
+        """
+        Take the lock, trying for up to 'timeout' seconds. Raise LockHeld if
+        another process still has it.
+        """
+        fd = os.open(os.path.join(self.download_dir, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o666)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                _lock(fd)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    raise LockHeld(self.download_dir, read_owner(self.download_dir))
+                time.sleep(POLL)
+        self.fd = fd
+        now = time.time()
+        self.owner = dict(pid=os.getpid(), host=platform.node(), user=_user(),
+                          started=now, completed=0, size=None)
+        self.update(0, None)
+        return self
+
+    def update(self, completed, size):
+        """record progress (at most every UPDATE_INTERVAL seconds)"""
+        now = time.time()
+        self.owner.update(completed=completed, size=size)
+        if now < self.next_update:
+            return
+        self.next_update = now + UPDATE_INTERVAL
+        self.owner['updated'] = now
+        path = os.path.join(self.download_dir, OWNER_FILE)
+        with suppress(OSError):
+            # write-then-rename so a reader never sees half a record
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.owner, f)
+            os.replace(path + '.tmp', path)
+
+    def reporter(self, status=None):
+        """a download_update() status callable that also calls 'status'"""
+        def report(completed, size):
+            self.update(completed, size)
+            if status is not None:
+                status(completed, size)
+        return report
+
+    def release(self):
+        if self.fd is None:
+            return
+        with suppress(FileNotFoundError):
+            os.remove(os.path.join(self.download_dir, OWNER_FILE))
+        # Leave the lock file: removing it would race with whoever's next.
+        with suppress(OSError):
+            _unlock(self.fd)
+        os.close(self.fd)
+        self.fd = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+def _user():
+    try:
+        return getpass.getuser()
+    except Exception:
+        return None
+
+def holder(download_dir):
+    """
+    If some process holds the lock on 'download_dir', return its owner
+    record (possibly {} if it hasn't written one yet); otherwise None.
+    """
+    try:
+        fd = os.open(os.path.join(download_dir, LOCK_FILE), os.O_RDWR)
+    except FileNotFoundError:
+        # nobody ever downloaded here
+        return None
+    try:
+        _lock(fd)
+    except OSError:
+        return read_owner(download_dir)
+    else:
+        _unlock(fd)
+        return None
+    finally:
+        os.close(fd)
+
+def clear(download_dir):
+    """
+    Remove everything in 'download_dir' but the lock file, e.g. to start a
+    download over. Removing the lock file too would race with whoever's
+    next: they could end up locking different files.
+    """
+    with os.scandir(download_dir) as it:
+        for entry in it:
+            if entry.name == LOCK_FILE:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                with suppress(FileNotFoundError):
+                    os.remove(entry.path)
+
+def wait(download_dir, progress=None, poll=1):
+    """
+    Wait for whoever holds the lock on 'download_dir' to finish, calling
+    progress(owner record) every 'poll' seconds meanwhile.
+    """
+    log=SL_Logging.getLogger('download_lock')
+    while True:
+        owner = holder(download_dir)
+        if owner is None:
+            return
+        log.debug("waiting for download to %s by process %s: %s of %s bytes", download_dir,
+                  owner.get('pid'), owner.get('completed'), owner.get('size'))
+        if progress is not None:
+            progress(owner)
+        time.sleep(poll)
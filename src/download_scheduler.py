@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""\
+@file   download_scheduler.py
+@brief  Coordinate concurrent update downloads by priority.
+
+Every download goes through run(), with a priority:
+
+    REQUIRED  -- the viewer can't run without it; never throttled or paused
+    OPTIONAL  -- an optional update, fetched in the background
+    PREFETCH  -- speculative: anything we might want later
+
+A download is paused (between chunks) while one of higher priority is in
+progress, and resumes once it's done. A required download in another
+process -- the launcher versus SLVersionChecker's LEAP side, or the
+detached download_worker -- announces itself with a heartbeat file in the
+downloads directory, which pauses background downloads here too.
+
+Background downloads in a process share one bandwidth budget (see
+rate_limit), however many of them there are.
+
+Asking for a download that's already in progress in this process waits
+for it, promoting it to the higher of the two priorities.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from contextlib import suppress
+import download_update
+import os
+import threading
+import time
+from util import SL_Logging
+
+REQUIRED, OPTIONAL, PREFETCH = range(3)
+PRIORITY_NAMES = {REQUIRED: 'required', OPTIONAL: 'optional', PREFETCH: 'prefetch'}
+
+# a required download in progress keeps this file fresh in the downloads directory
+PREEMPT_FILE = 'required.active'
+# how often (seconds) to refresh it...
+HEARTBEAT = 5
+# ...and how old it can get before we decide its process has died
+PREEMPT_STALE = 30
+# how often (seconds) a paused download checks whether it may resume
+PAUSE_POLL = 1
+
+class Job(object):
+    def __init__(self, priority, download_dir):
+        self.priority = priority
+        self.download_dir = download_dir
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.paused = False
+
+    def __str__(self):
+        return "%s download to %s" % (PRIORITY_NAMES[self.priority], self.download_dir)
+
+class Gate(object):
+    """
+    The rate_limit-style limiter a background job downloads through: it
+    holds the job while a higher-priority download runs, then charges the
+    shared budget.
+    """
+    def __init__(self, scheduler, job):
+        self.scheduler = scheduler
+        self.job = job
+
+    @property
+    def throttled(self):
+        # with no budget, download_update() needn't keep reads small
+        return self.scheduler.budget is not None
+
+    def consume(self, nbytes):
+        self.scheduler.wait_turn(self.job)
+        budget = self.scheduler.budget
+        # a job promoted to required mid-download runs flat out
+        if budget is not None and self.job.priority != REQUIRED:
+            budget.consume(nbytes)
+
+class Scheduler(object):
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.lock = threading.Condition()
+        # download_dir: Job
+        self.jobs = {}
+        # limiter shared by all background jobs, set by the first one
+        self.budget = None
+        self.heartbeat = None
+        # downloads directories where we've written PREEMPT_FILE
+        self.marked = set()
+        # cache of the foreign preempt check, which costs a stat()
+        self.checked = {}
+
+    def run(self, priority, download_dir, func, rate_limit=None, **kwds):
+        """
+        Call func(download_dir=download_dir, rate_limit=..., **kwds) as a
+        'priority' download and return its result. 'rate_limit' (see
+        rate_limit.limiter()) becomes the budget for background downloads,
+        unless some earlier one already set it.
+        """
+        log=SL_Logging.getLogger('download_scheduler')
+        with self.lock:
+            job = self.jobs.get(download_dir)
+            if job is None:
+                job = self.jobs[download_dir] = Job(priority, download_dir)
+                owner = True
+                if priority != REQUIRED and self.budget is None:
+                    self.budget = download_update.config_rate_limit(rate_limit)
+            else:
+                owner = False
+                if priority < job.priority:
+                    log.info("promoting %s to %s", job, PRIORITY_NAMES[priority])
+                    job.priority = priority
+                    self.lock.notify_all()
+            self._start_heartbeat()
+
+        if not owner:
+            log.info("waiting for %s already in progress", job)
+            job.done.wait()
+            if job.error is not None:
+                raise job.error
+            return job.result
+
+        log.info("starting %s", job)
+        try:
+            job.result = func(download_dir=download_dir,
+                              rate_limit=(0 if priority == REQUIRED else Gate(self, job)),
+                              **kwds)
+        except BaseException as err:
+            job.error = err
+            raise
+        finally:
+            with self.lock:
+                del self.jobs[download_dir]
+                self._update_preempt_files()
+                # lower-priority jobs may go again
+                self.lock.notify_all()
+            job.done.set()
+        return job.result
+
+    def wait_turn(self, job):
+        """block while 'job' is preempted"""
+        log=SL_Logging.getLogger('download_scheduler')
+        with self.lock:
+            while self._preempted(job):
+                if not job.paused:
+                    log.info("pausing %s for a higher-priority download", job)
+                    job.paused = True
+                self.lock.wait(PAUSE_POLL)
+            if job.paused:
+                log.info("resuming %s", job)
+                job.paused = False
+
+    def _preempted(self, job):
+        if any(other.priority < job.priority for other in self.jobs.values()):
+            return True
+        return job.priority != REQUIRED and \
+               self._foreign_required(os.path.dirname(job.download_dir))
+
+    def _foreign_required(self, root):
+        """is some other process downloading a required update into 'root'?"""
+        now = self.clock()
+        checked, answer = self.checked.get(root, (None, False))
+        if checked is not None and now < checked + PAUSE_POLL:
+            return answer
+        answer = False
+        try:
+            marker = os.path.join(root, PREEMPT_FILE)
+            fresh = now - os.path.getmtime(marker) < PREEMPT_STALE
+            with open(marker) as f:
+                answer = fresh and f.read().strip() != str(os.getpid())
+        except (OSError, ValueError):
+            pass
+        self.checked[root] = (now, answer)
+        return answer
+
+    def _required_roots(self):
+        return {os.path.dirname(job.download_dir)
+                for job in self.jobs.values() if job.priority == REQUIRED}
+
+    def _update_preempt_files(self):
+        # call with self.lock held
+        roots = self._required_roots()
+        for root in roots:
+            with suppress(OSError):
+                with open(os.path.join(root, PREEMPT_FILE), 'w') as f:
+                    f.write(str(os.getpid()))
+        for root in self.marked - roots:
+            with suppress(OSError):
+                os.remove(os.path.join(root, PREEMPT_FILE))
+        self.marked = roots
+        return roots
+
+    def _start_heartbeat(self):
+        # call with self.lock held
+        if self._required_roots() and self.heartbeat is None:
+            self.heartbeat = threading.Thread(name="download-heartbeat", target=self._beat,
+                                              daemon=True)
+            self.heartbeat.start()
+
+    def _beat(self):
+        with self.lock:
+            while self._update_preempt_files():
+                self.lock.wait(HEARTBEAT)
+            self.heartbeat = None
+
+_scheduler = Scheduler()
+
+def run(priority, download_dir, func, rate_limit=None, **kwds):
+    """Scheduler.run() on the process-wide scheduler"""
+    return _scheduler.run(priority, download_dir, func, rate_limit=rate_limit, **kwds)
@@ -35,23 +35,81 @@ call it with subprocess.
 """
 import os
 from contextlib import suppress
+import platform
+import shutil
 import errno
+import chunk_manifest
+import collections
+import download_lock
 import glob
+import hashing
 import InstallerUserMessage as IUM
+import json
+import mirrors
 import os.path
+import rate_limit
 import requests
 #silences InsecurePlatformWarning
 # http://stackoverflow.com/questions/29099404/ssl-insecureplatform-error-when-using-requests-package 
 import requests.packages.urllib3
 requests.packages.urllib3.disable_warnings()
+import stream_extract
 import tempfile
 import time
-from util import SL_Logging, Application
+import urllib.parse
+import urllib.request
+from util import SL_Logging, config_int, hub_queue, hub_threading
 
 #module default
 # MAINT-8082: empirically, if this isn't big enough, it can actually slow
-# downloads on the Mac
+# downloads on the Mac. It's only where AdaptiveChunkSize starts, though,
+# unless the caller or SL_DOWNLOAD_CHUNK_SIZE fixes the size.
 CHUNK_SIZE = 1024*1024
+# bounds for AdaptiveChunkSize
+MIN_CHUNK_SIZE = 64*1024
+MAX_CHUNK_SIZE = 16*1024*1024
+# A chunk that takes longer than this to arrive stalls the progress bar.
+CHUNK_LATENCY = 0.5
+# Number of concurrent HTTP Range requests across which to split a single
+# download. 1 means the traditional single stream. Can be overridden by the
+# SL_DOWNLOAD_SEGMENTS environment variable or the caller.
+SEGMENTS = 1
+# Splitting a small file into segments costs more in round trips than it
+# could possibly gain in throughput.
+MIN_SEGMENT_SIZE = 8*CHUNK_SIZE
+# read size for throttled downloads
+THROTTLED_CHUNK_SIZE = 64*1024
+# How many times to re-fetch a chunk that fails manifest verification
+CHUNK_RETRIES = 3
+# Stall detection, all overridable by environment variables of the same
+# name prefixed with SL_DOWNLOAD_: seconds to establish a connection...
+CONNECT_TIMEOUT = 30
+# ...seconds to wait for any single read...
+READ_TIMEOUT = 60
+# ...and the slowest trickle (bytes/sec, averaged over STALL_WINDOW seconds)
+# we'll put up with before giving up on a connection.
+MIN_THROUGHPUT = 1024
+STALL_WINDOW = 60
+# How many times fetch_segment() reconnects after a stall before giving up
+RECONNECTS = 5
+# how much copy_local() copies between progress bar updates
+LOCAL_COPY_STEP = 64*1024*1024
+# Spare room to leave on the disk beyond what the download itself needs
+DISK_HEADROOM = 100*1024*1024
+# apply_linux_update() unpacks the tarball into a temp directory: allow for
+# that at this multiple of the download size.
+LINUX_EXTRACT_RATIO = 3
+# Most bytes (beyond a single chunk) the network reader may get ahead of the
+# disk writer; see WriteBehind. 0 means: read and write on the same thread.
+# Overridable by SL_DOWNLOAD_WRITE_BUFFER.
+WRITE_BUFFER = 32*1024*1024
+# If nonzero, fsync the download at most this often (seconds) and when done,
+# bounding what a power cut can lose. 0 leaves it to the OS. Overridable by
+# SL_DOWNLOAD_FSYNC_INTERVAL.
+FSYNC_INTERVAL = 0
+# How long (seconds) to keep trying for the download lock: long enough to
+# ride out another process's download_lock.holder() probe.
+LOCK_WAIT = 1
 
 class DummyProgressBar(object):
     def set_message(self, message):
@@ -66,18 +124,41 @@ class DummyProgressBar(object):
 class FileInUseExcption(Exception):
     pass
 
+class SegmentError(Exception):
+    pass
+
+class DownloadStalled(Exception):
+    pass
+
+class InsufficientSpaceError(Exception):
+    pass
+
 #Note: No exception handling here! Response to exceptions is the responsibility of the caller
-def download_update(url, download_dir, size, progressbar = False, chunk_size = CHUNK_SIZE):
+def download_update(url, download_dir, size, progressbar = False, chunk_size = None,
+                    segments = None, manifest = None, rate_limit = None, mirror_urls = None,
+                    status = None, extract = False):
     #url to download from
     #download_dir to download to
     #total size (for progressbar) of download
     #progressbar: whether to display one (not used for background downloads)
-    #chunk_size is in bytes, amount to download at once
+    #chunk_size is in bytes, amount to download at once; None means SL_DOWNLOAD_CHUNK_SIZE,
+    #else adapt it to the link as we go
+    #segments: how many concurrent Range requests to use; None means SL_DOWNLOAD_SEGMENTS
+    #manifest: optional chunk_manifest.ChunkManifest against which to verify chunks as they land
+    #rate_limit: bandwidth cap for downloads without a progressbar, e.g. '500K' or '25%';
+    #None means SL_DOWNLOAD_RATE_LIMIT. Downloads with a progressbar are never throttled.
+    #mirror_urls: other URLs serving the same file; we start on the fastest and fail over
+    #url may also be file://, or be mapped to a local file by SL_DOWNLOAD_LOCAL_MIRROR
+    #status: optional callable(completed, size) told about progress, e.g. for a status file;
+    #for a single stream, bytes [0, completed) are already flushed to the file
+    #extract: unpack a .tar.bz2 as it streams in, for stream_extract.commit() to bless
+    #returns (filename, md5 hexdigest), where the digest is None unless the
+    #whole file streamed in order, e.g. not segmented or resumed
 
     log=SL_Logging.getLogger('download_update')
     log.info("Downloading new viewer from %r to %r" % (url, download_dir))
-    log.debug(" url %s, download_dir %s, size %s, progressbar %s, chunk_size %s",
-              url, download_dir, size, progressbar, chunk_size)
+    log.debug(" url %s, download_dir %s, size %s, progressbar %s, chunk_size %s, segments %s",
+              url, download_dir, size, progressbar, chunk_size, segments)
     with suppress(FileExistsError):
         os.makedirs(download_dir)
     #the url split provides the basename of the filename
@@ -89,21 +170,86 @@ def download_update(url, download_dir, size, progressbar = False, chunk_size = C
 ##      basename = 'SLNextViewer.exe'
     filename = os.path.join(download_dir, basename)
 
-    if os.path.exists(filename):
-        # workaround untill python 3 gets around
-        # try to rename file
-        # file is in use if rename fails
-        # (might be a better idea to have a lock file)
-        try:
-            os.rename(filename, filename+".temp")
-            log.info("resuming interrupted download")
-            os.rename(filename+".temp", filename)
-        except OSError:
-            log.info("failed to access file %s" % filename)
-            raise FileInUseExcption
+    # one downloader per directory, host-wide
+    lock = download_lock.DownloadLock(download_dir)
+    try:
+        lock.acquire(timeout=LOCK_WAIT)
+    except download_lock.LockHeld as held:
+        log.info("%s", held)
+        raise FileInUseExcption(str(held))
+    try:
+        return _download_update(log, url, download_dir, filename, size, progressbar,
+                                chunk_size, segments, manifest, rate_limit, mirror_urls,
+                                lock.reporter(status), extract)
+    finally:
+        lock.release()
+
+def _download_update(log, url, download_dir, filename, size, progressbar, chunk_size,
+                     segments, manifest, rate_limit, mirror_urls, status, extract):
+    source = local_source(url)
+    if source is not None:
+        copy_local(source, filename, size, progressbar, status)
+        mark_done(download_dir)
+        # the bytes never passed through us, so the caller hashes the file
+        return filename, None
+
+    state = ResumeState.load(filename, url, size)
+    if state is None:
+        state = ResumeState.fresh(filename, url, size,
+                                  config_int(segments, 'SL_DOWNLOAD_SEGMENTS', SEGMENTS),
+                                  align=(manifest.chunk_size if manifest else 1))
+    else:
+        log.info("resuming interrupted download: %s of %s bytes already present",
+                 state.completed(), size)
 
     log.info("downloading to: %s" % filename)
-    req = requests.get(url, stream=True)
+    pending = state.pending()
+    if pending:
+        # fail now, not after fetching most of the installer
+        check_free_space(filename, size, extract)
+    sources = mirrors.MirrorList(mirrors.rank([url] + list(mirror_urls))
+                                 if pending and mirror_urls else [url])
+    if pending:
+        # If the server ignores the Range header, or If-Range tells it the
+        # file has changed since our partial download, what we get back is
+        # the whole file -- so start over and use that response as a single
+        # stream.
+        req = requests.get(sources.current(), stream=True, timeout=timeouts(),
+                           headers=state.request_headers(pending[0], sources.current()))
+        if state.ranged(pending[0]) and req.status_code == 200:
+            log.info("server sent entire file; starting from scratch")
+            state.restart()
+            pending = state.pending()
+        elif req.status_code != (206 if state.ranged(pending[0]) else 200):
+            # e.g. a transient 503: keep what we have for next time, and
+            # don't mistake an error page for the installer
+            req.close()
+            raise SegmentError("%s answered %s with status %s" %
+                               (sources.current(),
+                                state.request_headers(pending[0]).get('Range', 'GET'),
+                                req.status_code))
+        state.record_validators(req.headers, sources.current())
+        if state.completed() == 0:
+            # From here on, a full-size file doesn't mean a finished one: say
+            # so first, so that neither a crash nor a sidecar we can't write
+            # leaves a zero-padded installer that looks complete.
+            try:
+                state.save(strict=True)
+            except OSError:
+                req.close()
+                raise
+            # Never truncate a file we share with installer_store: replace it.
+            with suppress(FileNotFoundError):
+                if os.stat(filename).st_nlink > 1:
+                    os.remove(filename)
+            # Preallocate the whole file, so that each segment can write at
+            # its own offset and the file isn't fragmented.
+            with open(filename, 'wb') as fd:
+                if size:
+                    preallocate(fd, size)
+    else:
+        # we crashed between writing the last byte and cleaning up
+        log.info("all %s bytes already present", size)
 
     message = "Download Progress"
     if progressbar:
@@ -115,62 +261,868 @@ def download_update(url, download_dir, size, progressbar = False, chunk_size = C
 
     # ensure that we clean up the progress bar, no matter how we leave
     try:
-        start = time.time()
-        completed = 0
-        log_interval = 60
-        log_next = start + log_interval
-        with open(filename, 'wb') as fd:
-            #keep downloading until we run out of chunks
-            for chunk in req.iter_content(chunk_size):
-                fd.write(chunk)
-                completed += len(chunk)
-
-                # once we've downloaded even the first chunk, we can
-                # start to make wild guesses about completion
-                fraction = float(completed)/size
-                percent  = int(100*fraction)
-                now = time.time()
-                elapsed = now - start
-                # completed/size predicts elapsed/totaltime
-                # totaltime * (completed/size) = elapsed
-                # totaltime = elapsed / (completed / size)
-                totaltime = elapsed / fraction
-                eta = start + totaltime
-                timeleft = int(eta - now)
-                mins,  secs = divmod(timeleft, 60)
-                hours, mins = divmod(mins, 60)
-                timeleft = "%2d:%02d:%02d" % (hours, mins, secs)
-
-                #increment the progress bar by len(chunk)/size units
-                progress.step(len(chunk),
-                              message="%s: %s%%, %s left" % (message, percent, timeleft))
-
-                # Add periodic download log messages. When we start a background
-                # download on a separate thread, the main thread might complete --
-                # and produce log output to that effect -- yet the process lives
-                # on. Occasional log messages help the curious user remember that.
-                if now >= log_next:
-                    log_next = now + log_interval
-                    # For logging, use gmtime and the same time format as
-                    # SL_Logging.Formatter.sl_format. We're likely to be
-                    # looking at logs after the fact, so timeleft isn't as
-                    # interesting as our ETA prediction converging.
-                    eta = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(eta))
-                    log.info("downloaded %s bytes; %s%% complete; ETA %s",
-                             completed, percent, eta)
+        reporter = ProgressReporter(progress, message, size, log, completed=state.completed(),
+                                    status=status)
+        # If the whole file streams in order from byte 0, hash it on the fly
+        # rather than reading it all back from disk afterwards.
+        digest = hashing.MultiHash() if len(pending) == 1 and not state.ranged(pending[0]) else None
+        # Likewise, unpack a Linux tarball as it arrives rather than afterwards.
+        extractor = None
+        sink = digest
+        if extract and digest is not None and filename.endswith('.bz2'):
+            extractor = stream_extract.StreamingExtractor(filename)
+            sink = stream_extract.Tee(digest, extractor)
+        # Somebody is waiting on a progress bar: don't make them wait longer.
+        throttle = None if progressbar else config_rate_limit(rate_limit)
+        if throttle is not None and getattr(throttle, 'throttled', True):
+            # smaller reads keep a throttled download from arriving in bursts
+            chunk_size = min(chunk_size or THROTTLED_CHUNK_SIZE, THROTTLED_CHUNK_SIZE)
+        else:
+            chunk_size = config_int(chunk_size, 'SL_DOWNLOAD_CHUNK_SIZE', None)
+        try:
+            if len(pending) == 1:
+                # plain single stream: no need for any other threads
+                def step(nbytes):
+                    reporter.step(nbytes)
+                    state.maybe_save()
+                if fetch_segment(sources, filename, pending[0], req, chunk_size, state, step,
+                                 digest=sink, manifest=manifest, throttle=throttle):
+                    # re-fetched some chunk(s): the running digest is garbage,
+                    # and so is anything unpacked from the same bytes
+                    digest = None
+                    if extractor is not None:
+                        extractor.abort()
+                        extractor = None
+                start, pos, end = pending[0]
+                if end is not None and pos < end:
+                    # a whole-file stream ended early: the server's idea of
+                    # the size wins over the preallocated tail
+                    os.truncate(filename, pos)
+            elif pending:
+                download_segments(sources, filename, pending, req, chunk_size, state, reporter,
+                                  manifest=manifest, throttle=throttle)
+        except BaseException:
+            # whatever went wrong, what we have so far is good
+            state.save()
+            if extractor is not None:
+                extractor.abort()
+            raise
+        if extractor is not None:
+            extractor.finish()
+        state.remove()
     finally:
         progress.progress_done()
         progress.set_message("Download Complete")
 
+    mark_done(download_dir)
+    log.info("Download finished.")
+    # show caller the pathname of the file we downloaded, and its hash if we
+    # already know it
+    return filename, (digest.hexdigests()['md5'] if digest else None)
+
+def mark_done(download_dir):
     #on success remove .next file if any
     for fname in glob.glob(os.path.join(download_dir, "*" + '.next')):
         os.remove(fname)
     # and mark done
     # mkstemp() returns (OS file handle, absolute pathname)
     os.close(tempfile.mkstemp(suffix=".done", dir=download_dir)[0])
-    log.info("Download finished.")
-    # show caller the pathname of the file we downloaded
-    return filename
+
+def local_source(url):
+    """
+    Return the local pathname to copy instead of downloading 'url', or None.
+    That's the file a file:// URL names, or else the file at the same path
+    under the directory named by SL_DOWNLOAD_LOCAL_MIRROR, if there is one.
+    """
+    log=SL_Logging.getLogger('local_source')
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == 'file':
+        # file://server/share/... is a UNC path on Windows
+        path = urllib.request.url2pathname(
+            ('//' + parsed.netloc + parsed.path) if parsed.netloc else parsed.path)
+        return path
+    root = os.getenv('SL_DOWNLOAD_LOCAL_MIRROR')
+    if not root:
+        return None
+    path = os.path.join(root, *urllib.parse.unquote(parsed.path).split('/'))
+    if os.path.isfile(path):
+        return path
+    log.info("%s not in local mirror %s; downloading", url, root)
+    return None
+
+def copy_local(source, filename, size, progressbar, status=None):
+    """
+    Copy 'source' to 'filename' inside the kernel where we can, reporting
+    progress the same way a download does.
+    """
+    log=SL_Logging.getLogger('copy_local')
+    message = "Download Progress"
+    with open(source, 'rb') as src:
+        actual = os.fstat(src.fileno()).st_size
+        if size and size != actual:
+            log.warning("%s is %s bytes, expected %s", source, actual, size)
+        check_free_space(filename, actual)
+        if progressbar:
+            # will raise an exception if user closes this
+            progress = IUM.root()
+            progress.progress_bar(message=message, size = actual)
+        else:
+            progress = DummyProgressBar()
+        try:
+            log.info("copying %s from %s", filename, source)
+            reporter = ProgressReporter(progress, message, actual, log, status=status)
+            # Copy-then-rename: never truncate a file we share with
+            # installer_store, nor leave a half-copied installer in its place.
+            temp = filename + '.copying'
+            try:
+                with open(temp, 'wb') as dst:
+                    for nbytes in zero_copy(src, dst, actual):
+                        reporter.step(nbytes)
+                os.replace(temp, filename)
+            except BaseException:
+                with suppress(OSError):
+                    os.remove(temp)
+                raise
+        finally:
+            progress.progress_done()
+            progress.set_message("Download Complete")
+    # no resume state applies to a copy
+    with suppress(FileNotFoundError):
+        os.remove(filename + ResumeState.SUFFIX)
+
+def zero_copy(src, dst, count, step=LOCAL_COPY_STEP):
+    """
+    Copy 'count' bytes from open file 'src' to 'dst', yielding the byte
+    count of each step. Use copy_file_range() (which can even share blocks
+    on filesystems that support it) or sendfile() if the OS offers them,
+    else an ordinary copy.
+    """
+    infd, outfd = src.fileno(), dst.fileno()
+    kernel_copies = dict(
+        copy_file_range=lambda offset, n: os.copy_file_range(infd, outfd, n, offset, offset),
+        sendfile=lambda offset, n: os.sendfile(outfd, infd, offset, n))
+    copied = 0
+    for name, kernel_copy in kernel_copies.items():
+        if not hasattr(os, name):
+            continue
+        try:
+            # sendfile() writes at the output file's position
+            dst.seek(copied)
+            while copied < count:
+                sent = kernel_copy(copied, min(step, count - copied))
+                if not sent:
+                    break
+                copied += sent
+                yield sent
+            return
+        except OSError as err:
+            # e.g. EXDEV across filesystems on older kernels, or macOS
+            # sendfile(), which only writes to sockets: try the next way
+            if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                 errno.EOPNOTSUPP, errno.ENOTSOCK, errno.EBADF):
+                raise
+    src.seek(copied)
+    dst.seek(copied)
+    buffer = bytearray(min(step, hashing.BUFFER_SIZE))
+    while copied < count:
+        nbytes = src.readinto(buffer)
+        if not nbytes:
+            break
+        dst.write(memoryview(buffer)[:nbytes])
+        # as with a download, report only what's in the file
+        dst.flush()
+        copied += nbytes
+        yield nbytes
+
+def config_rate_limit(value):
+    """
+    Return a rate_limit limiter for 'value' if the caller passed one, else for
+    environment variable SL_DOWNLOAD_RATE_LIMIT, else None. Garbage in either
+    place is logged and ignored. A 'value' that's already a limiter (anything
+    with a consume() method) is returned as is.
+    """
+    log=SL_Logging.getLogger('config_rate_limit')
+    if hasattr(value, 'consume'):
+        return value
+    for source, candidate in (('argument', value),
+                              ('SL_DOWNLOAD_RATE_LIMIT', os.getenv('SL_DOWNLOAD_RATE_LIMIT'))):
+        if candidate is None or candidate == '':
+            continue
+        try:
+            throttle = rate_limit.limiter(candidate)
+        except (TypeError, ValueError):
+            log.warning("Ignoring invalid %s value %r", source, candidate)
+            continue
+        if throttle is not None:
+            log.info("limiting download bandwidth to %s per %s", candidate, source)
+        return throttle
+    return None
+
+def check_free_space(filename, size, extract=False):
+    """
+    Raise InsufficientSpaceError unless there's room to finish downloading
+    'size' bytes into 'filename' (plus, on Linux, to unpack it: alongside,
+    if 'extract', else in the temp directory).
+    """
+    log=SL_Logging.getLogger('check_free_space')
+    if not size:
+        return
+    # a file of that name already occupies some of the room we need
+    try:
+        existing = os.path.getsize(filename)
+    except OSError:
+        existing = 0
+    needs = {os.path.dirname(filename): max(0, size - existing)}
+    if platform.system() == 'Linux':
+        tmpdir = os.path.dirname(filename) if extract else tempfile.gettempdir()
+        needs[tmpdir] = needs.get(tmpdir, 0) + size * LINUX_EXTRACT_RATIO
+    # directories on the same filesystem draw on the same free space
+    by_device = {}
+    for directory, nbytes in needs.items():
+        device = os.stat(directory).st_dev
+        dirs, total = by_device.get(device, ([], 0))
+        by_device[device] = (dirs + [directory], total + nbytes)
+    for dirs, nbytes in by_device.values():
+        free = shutil.disk_usage(dirs[0]).free
+        log.debug("%s needs %s bytes, has %s free", ', '.join(dirs), nbytes, free)
+        if free < nbytes + DISK_HEADROOM:
+            raise InsufficientSpaceError(
+                "Not enough disk space to download the update: it needs %s MB in %s, "
+                "but only %s MB are free" %
+                ((nbytes + DISK_HEADROOM) // 2**20, ' and '.join(dirs), free // 2**20))
+
+def preallocate(fd, size):
+    """
+    Reserve 'size' bytes on disk for the open file 'fd', really allocating
+    them where the platform supports that.
+    """
+    try:
+        os.posix_fallocate(fd.fileno(), 0, size)
+    except AttributeError:
+        # not POSIX (Windows): extending the file is the best we can do
+        fd.seek(size - 1)
+        fd.write(b'\0')
+    except OSError as err:
+        if err.errno == errno.ENOSPC:
+            raise InsufficientSpaceError("Not enough disk space to download the update (%s MB)"
+                                         % (size // 2**20))
+        # e.g. EOPNOTSUPP on some filesystems
+        fd.truncate(size)
+
+def split_ranges(size, segments, align=1):
+    """
+    Return a list of (start, end) byte offsets, end exclusive, dividing 'size'
+    bytes into at most 'segments' pieces of nearly equal length, each
+    boundary a multiple of 'align'. A single (0, size) tuple means: don't
+    bother with Range requests.
+    """
+    if not size or segments <= 1:
+        return [(0, size)]
+    segments = max(1, min(segments, size // MIN_SEGMENT_SIZE))
+    bounds = sorted(set([0] + [size * n // segments // align * align
+                               for n in range(1, segments)] + [size]))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+class ResumeState(object):
+    """
+    Track how much of each segment of a download has been written to the
+    file (flushed to the OS, though not necessarily fsynced: see
+    FSYNC_INTERVAL), persisted in a small JSON sidecar next to the partial file. A
+    sidecar thus also means: this installer is incomplete, whatever its size.
+
+    Each segment is a [start, pos, end] list: bytes [start, pos) are on disk,
+    bytes [pos, end) are still wanted. For a single stream of unknown size,
+    end is None.
+    """
+    SUFFIX = '.resume'
+    # Save at least this often (seconds) so that even a hard crash loses
+    # little.
+    SAVE_INTERVAL = 5
+
+    def __init__(self, filename, url, size, segments, etag=None, last_modified=None,
+                 origin=None):
+        self.filename = filename
+        self.url = url
+        self.size = size
+        self.segments = segments
+        self.etag = etag
+        self.last_modified = last_modified
+        # the mirror whose validators those are
+        self.origin = origin or url
+        self.saved = time.time()
+
+    @classmethod
+    def fresh(cls, filename, url, size, segments, align=1):
+        return cls(filename, url, size,
+                   [[start, start, end] for start, end in split_ranges(size, segments, align)])
+
+    @classmethod
+    def load(cls, filename, url, size):
+        """
+        Return the ResumeState for a previous attempt to download 'url' into
+        'filename', or None if there's nothing usable to resume.
+        """
+        log=SL_Logging.getLogger('ResumeState')
+        try:
+            with open(filename + cls.SUFFIX) as f:
+                data = json.load(f)
+            state = cls(filename, url, size, data['segments'],
+                        etag=data.get('etag'), last_modified=data.get('last_modified'),
+                        origin=data.get('origin'))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            log.warning("Ignoring unreadable resume state for %s: %s: %s",
+                        filename, type(err).__name__, err)
+            return None
+        if (data.get('url'), data.get('size')) != (url, size):
+            log.info("Resume state for %s describes a different download", filename)
+            return None
+        if not (state.etag or state.last_modified):
+            # without a validator, we can't be sure the bytes we have match
+            log.info("Resume state for %s has no validator", filename)
+            return None
+        if not os.path.exists(filename):
+            return None
+        return state
+
+    @staticmethod
+    def completed_for(filename):
+        """
+        Return the number of bytes recorded as downloaded for the partial
+        'filename', or None if it has no resume state.
+        """
+        try:
+            with open(filename + ResumeState.SUFFIX) as f:
+                return sum(pos - start for start, pos, end in json.load(f)['segments'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def completed(self):
+        return sum(pos - start for start, pos, end in self.segments)
+
+    def pending(self):
+        return [seg for seg in self.segments if seg[2] is None or seg[1] < seg[2]]
+
+    def restart(self):
+        self.segments = [[0, 0, self.size]]
+        self.etag = self.last_modified = None
+        self.origin = self.url
+
+    def ranged(self, segment):
+        """Do we need a Range header to fetch this segment?"""
+        start, pos, end = segment
+        return pos > 0 or (end is not None and end != self.size)
+
+    def request_headers(self, segment, source=None):
+        if not self.ranged(segment):
+            return {}
+        start, pos, end = segment
+        headers = {'Range': 'bytes=%s-%s' % (pos, '' if end is None else end - 1)}
+        # Only trust a 206 if the file hasn't changed since we started. A
+        # different mirror's validators needn't match, though: there we rely
+        # on the final hash check.
+        validator = self.etag or self.last_modified
+        if validator and pos > start and source in (None, self.origin):
+            headers['If-Range'] = validator
+        return headers
+
+    def record_validators(self, headers, source=None):
+        if not (self.etag or self.last_modified):
+            self.etag = headers.get('ETag')
+            self.last_modified = headers.get('Last-Modified')
+            self.origin = source or self.url
+
+    def maybe_save(self):
+        if time.time() >= self.saved + self.SAVE_INTERVAL:
+            self.save()
+
+    def save(self, strict=False):
+        """
+        Write the sidecar. A failure is only logged -- resuming is a bonus --
+        unless 'strict', when the OSError propagates.
+        """
+        log=SL_Logging.getLogger('ResumeState')
+        self.saved = time.time()
+        # Even with nothing load() would resume, the sidecar's existence
+        # says: this file is incomplete.
+        data = dict(url=self.url, size=self.size, segments=self.segments,
+                    etag=self.etag, last_modified=self.last_modified, origin=self.origin)
+        try:
+            # write-then-rename so a crash never leaves a torn sidecar
+            with open(self.filename + self.SUFFIX + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(self.filename + self.SUFFIX + '.tmp', self.filename + self.SUFFIX)
+        except OSError as err:
+            if strict:
+                raise
+            log.warning("Can't save resume state for %s: %s", self.filename, err)
+
+    def remove(self):
+        with suppress(FileNotFoundError):
+            os.remove(self.filename + self.SUFFIX)
+
+def fetch_segment(url, filename, segment, req, chunk_size, state, step, cancel=None,
+                  digest=None, manifest=None, throttle=None):
+    """
+    Download the rest of 'segment' ([start, pos, end]) of 'url' (or of
+    whichever mirror in the mirrors.MirrorList 'url' is current) into
+    'filename', advancing segment[1] as each chunk reaches the file and
+    calling step(nbytes). Pass req=None to issue a new Range request. If
+    'digest' is passed, every chunk is also fed to digest.update().
+
+    'chunk_size' None means: use an AdaptiveChunkSize.
+
+    With a 'manifest', each manifest chunk is verified as soon as its last
+    byte lands; a bad one is fetched again (up to CHUNK_RETRIES times) from
+    where it starts. Returns the number of such re-fetches.
+
+    A 'throttle' (see rate_limit) is charged for every chunk received.
+
+    Reading the response and writing the file happen on separate threads
+    (see WriteBehind), so that 'step' and the disk don't hold up the socket.
+
+    If the connection times out, fails, or slows below MIN_THROUGHPUT, we
+    reconnect (up to RECONNECTS times), to the next mirror if there is one,
+    and carry on from the last byte written.
+    """
+    log=SL_Logging.getLogger('fetch_segment')
+    sources = url if isinstance(url, mirrors.MirrorList) else mirrors.MirrorList([url])
+    source = sources.current()
+    # A plain whole-file stream ends wherever the server says it ends.
+    ranged = state.ranged(segment)
+    verifier = None
+    if manifest is not None:
+        verifier = chunk_manifest.ChunkVerifier(manifest, filename, *segment)
+    adaptive = None if chunk_size else AdaptiveChunkSize(log)
+    # A throttled download is slow on purpose: leave it to the read timeout.
+    watchdog = StallWatchdog(floor=(0 if throttle is not None else None))
+    def received(nbytes):
+        # network-side accounting, on WriteBehind's reader thread
+        watchdog.check(nbytes)
+        if throttle is not None:
+            throttle.consume(nbytes)
+    fsync_interval = config_int(None, 'SL_DOWNLOAD_FSYNC_INTERVAL', FSYNC_INTERVAL)
+    synced = time.monotonic()
+    refetches = 0
+    reconnects = 0
+    # when the current stall was detected
+    stalled = None
+    while True:
+        if cancel is not None and cancel.is_set():
+            return refetches
+        if req is None:
+            try:
+                req = requests.get(source, stream=True, timeout=timeouts(),
+                                   headers=state.request_headers(segment, source))
+            except requests.RequestException as err:
+                reconnects, stalled = reconnect(log, err, segment, reconnects, stalled,
+                                                watchdog.idle())
+                source = sources.failover(source)
+                continue
+            # (re-fetching the very first chunk of a whole-file stream isn't ranged)
+            if req.status_code != (206 if state.ranged(segment) else 200):
+                raise SegmentError("%s answered Range %s with status %s" %
+                                   (source, state.request_headers(segment).get('Range'),
+                                    req.status_code))
+        watchdog.reset()
+        try:
+            with req, open(filename, 'r+b') as fd:
+                fd.seek(segment[1])
+                #keep downloading until we run out of chunks
+                chunks = adaptive.iter_content(req) if adaptive else req.iter_content(chunk_size)
+                with WriteBehind(chunks, received) as pipe:
+                    for chunk in pipe:
+                        if cancel is not None and cancel.is_set():
+                            return refetches
+                        if stalled is not None:
+                            log.warning("recovered from stall at byte %s after %.1fs",
+                                        segment[1], time.monotonic() - stalled)
+                            stalled = None
+                        fd.write(chunk)
+                        # segment[1] (and the ResumeState saved from it,
+                        # and whoever reads the file as it grows) must
+                        # never run ahead of what's in the file
+                        fd.flush()
+                        if digest is not None:
+                            digest.update(chunk)
+                        pos = segment[1]
+                        segment[1] += len(chunk)
+                        step(len(chunk))
+                        if verifier is not None:
+                            verifier.update(pos, chunk)
+                        if fsync_interval and time.monotonic() >= synced + fsync_interval:
+                            fd.flush()
+                            os.fsync(fd.fileno())
+                            synced = time.monotonic()
+                    pipe.report(log)
+                if fsync_interval:
+                    fd.flush()
+                    os.fsync(fd.fileno())
+        except chunk_manifest.BadChunk as bad:
+            refetches += 1
+            if refetches > CHUNK_RETRIES:
+                raise SegmentError("%s, even after %s retries" % (bad, CHUNK_RETRIES))
+            log.warning("%s; re-fetching from byte %s", bad, bad.start)
+            # the progress bar overshoots by the bad chunk; harmless
+            segment[1] = bad.start
+            verifier = chunk_manifest.ChunkVerifier(manifest, filename, *segment)
+            req = None
+            ranged = True
+            continue
+        except (DownloadStalled, requests.RequestException,
+                requests.packages.urllib3.exceptions.HTTPError) as err:
+            reconnects, stalled = reconnect(log, err, segment, reconnects, stalled,
+                                            watchdog.idle())
+            source = sources.failover(source)
+            req = None
+            ranged = True
+            continue
+        break
+    if adaptive:
+        adaptive.report()
+    start, pos, end = segment
+    if ranged and end is not None and pos != end:
+        raise SegmentError("segment %s-%s stopped at %s" % (start, end - 1, pos))
+    return refetches
+
+def reconnect(log, err, segment, reconnects, stalled, idle):
+    """
+    Account for one more failed connection for 'segment', raising
+    SegmentError once there have been too many. Returns the updated
+    (reconnects, stalled) pair for fetch_segment().
+    """
+    reconnects += 1
+    if reconnects > RECONNECTS:
+        raise SegmentError("%s: %s, even after %s reconnects" %
+                           (type(err).__name__, err, RECONNECTS))
+    log.warning("%s after %.1fs without data: %s; reconnecting (%s of %s) from byte %s",
+                type(err).__name__, idle, err, reconnects, RECONNECTS, segment[1])
+    # recovery time counts from the first failure
+    return reconnects, (time.monotonic() if stalled is None else stalled)
+
+def timeouts():
+    """(connect, read) timeouts for requests.get()"""
+    return (config_int(None, 'SL_DOWNLOAD_CONNECT_TIMEOUT', CONNECT_TIMEOUT),
+            config_int(None, 'SL_DOWNLOAD_READ_TIMEOUT', READ_TIMEOUT))
+
+class StallWatchdog(object):
+    """
+    Raise DownloadStalled if the bytes passed to check() average less than
+    MIN_THROUGHPUT per second over STALL_WINDOW seconds. (A connection that
+    delivers nothing at all is caught by the read timeout instead.)
+    """
+    def __init__(self, floor=None, clock=time.monotonic):
+        self.clock = clock
+        self.floor = config_int(floor, 'SL_DOWNLOAD_MIN_THROUGHPUT', MIN_THROUGHPUT)
+        self.window = config_int(None, 'SL_DOWNLOAD_STALL_WINDOW', STALL_WINDOW)
+        self.reset()
+
+    def reset(self):
+        self.start = self.last = self.clock()
+        self.count = 0
+
+    def idle(self):
+        """seconds since check() last saw any data"""
+        return self.clock() - self.last
+
+    def check(self, nbytes):
+        self.last = self.clock()
+        self.count += nbytes
+        elapsed = self.clock() - self.start
+        if elapsed < self.window:
+            return
+        if self.count < self.floor * elapsed:
+            raise DownloadStalled("only %s bytes in %.1fs, below %s bytes/sec" %
+                                  (self.count, elapsed, self.floor))
+        self.reset()
+
+def refetch_chunks(url, filename, manifest, indexes):
+    """
+    Overwrite the listed chunks of the completed download 'filename' with
+    fresh copies, e.g. once manifest.verify_file() has found them corrupt.
+    """
+    log=SL_Logging.getLogger('refetch_chunks')
+    for index in indexes:
+        start, end = manifest.chunk_range(index)
+        log.info("re-fetching chunk %s (bytes %s-%s) of %s", index, start, end - 1, url)
+        req = requests.get(url, stream=True, headers={'Range': 'bytes=%s-%s' % (start, end - 1)},
+                           timeout=timeouts())
+        if req.status_code != 206:
+            raise SegmentError("server answered Range %s-%s with status %s" %
+                               (start, end - 1, req.status_code))
+        with req, open(filename, 'r+b') as fd:
+            fd.seek(start)
+            data = req.content
+            if len(data) != end - start:
+                raise SegmentError("chunk %s: received %s bytes, expected %s" %
+                                   (index, len(data), end - start))
+            fd.write(data)
+
+def download_segments(url, filename, segments, first, chunk_size, state, reporter,
+                      manifest=None, throttle=None):
+    """
+    Fetch each of the [start, pos, end] 'segments' of 'url' (or a
+    mirrors.MirrorList) concurrently into
+    'filename'. 'first' is the already-open response for segments[0].
+
+    Only the calling thread touches 'reporter' and 'state', since the
+    progress bar is a Tkinter widget: the segment threads post byte counts to
+    a queue instead. On the eventlet hub's thread the segment threads are
+    greenthreads, and the queue green: see util.hub_threading().
+    """
+    log=SL_Logging.getLogger('download_segments')
+    log.info("downloading %s bytes in %s segments", state.size - state.completed(), len(segments))
+
+    threads = hub_threading()
+    events = hub_queue().Queue()
+    cancel = threads.Event()
+
+    def fetch(segment, req):
+        try:
+            fetch_segment(url, filename, segment, req, chunk_size, state,
+                          lambda nbytes: events.put(('chunk', nbytes)), cancel,
+                          manifest=manifest, throttle=throttle)
+        except Exception as err:
+            events.put(('error', err))
+        else:
+            events.put(('done', None))
+
+    for n, segment in enumerate(segments):
+        threads.Thread(name="download-segment-%s" % n, target=fetch, daemon=True,
+                       args=(segment, (first if n == 0 else None))).start()
+
+    pending = len(segments)
+    try:
+        while pending:
+            kind, value = events.get()
+            if kind == 'chunk':
+                reporter.step(value)
+                state.maybe_save()
+            elif kind == 'done':
+                pending -= 1
+            else:
+                raise value
+    finally:
+        # On any exit, abandon the other segments: the caller decides
+        # whether to retry, and will resume from what's on disk.
+        cancel.set()
+
+class WriteBehind(object):
+    """
+    Decouple reading a response from writing it to disk: a reader thread
+    pulls 'chunks' off the socket into a buffer of at most WRITE_BUFFER
+    bytes (beyond a single chunk), while the caller iterates over this
+    object to write them out. A slow disk or a busy progress bar then stalls
+    the TCP receive window only once the buffer fills.
+
+    'received(nbytes)', if passed, is called on the reader thread as each
+    chunk arrives: the place for network-side accounting such as stall
+    detection and throttling. An exception on the reader thread is raised
+    to the caller once the chunks that preceded it have been consumed.
+
+    On the eventlet hub's thread (see util.hub_threading()) the reader is a
+    greenthread, and both sides' waits yield, so that a download inline in
+    SLVersionChecker's LEAP code doesn't freeze the rest of it.
+    """
+    def __init__(self, chunks, received=None, limit=None, clock=time.monotonic):
+        self.chunks = chunks
+        self.received = received
+        self.limit = config_int(limit, 'SL_DOWNLOAD_WRITE_BUFFER', WRITE_BUFFER)
+        self.clock = clock
+        self.threads = hub_threading()
+        self.cond = self.threads.Condition()
+        self.buffer = collections.deque()
+        self.buffered = 0
+        self.peak = 0
+        self.finished = False
+        self.error = None
+        # the caller has stopped listening
+        self.abandoned = False
+        # seconds the reader spent waiting on the writer, and vice versa
+        self.reader_waited = 0.0
+        self.writer_waited = 0.0
+        self.thread = None
+
+    def __enter__(self):
+        if self.limit > 0:
+            self.thread = self.threads.Thread(name="download-reader", target=self._read,
+                                              daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        # Don't wait for the reader: it may be blocked on the socket until
+        # the caller closes the response.
+        with self.cond:
+            self.abandoned = True
+            self.cond.notify_all()
+
+    def _read(self):
+        error = None
+        try:
+            for chunk in self.chunks:
+                if self.received is not None:
+                    self.received(len(chunk))
+                with self.cond:
+                    start = self.clock()
+                    while self.buffered and self.buffered + len(chunk) > self.limit \
+                          and not self.abandoned:
+                        self.cond.wait()
+                    self.reader_waited += self.clock() - start
+                    if self.abandoned:
+                        return
+                    self.buffer.append(chunk)
+                    self.buffered += len(chunk)
+                    self.peak = max(self.peak, self.buffered)
+                    self.cond.notify_all()
+        except Exception as err:
+            error = err
+        with self.cond:
+            self.finished = True
+            self.error = error
+            self.cond.notify_all()
+
+    def __iter__(self):
+        if self.thread is None:
+            # no buffer: plain read-then-write on the caller's thread
+            for chunk in self.chunks:
+                if self.received is not None:
+                    self.received(len(chunk))
+                yield chunk
+            return
+        while True:
+            with self.cond:
+                start = self.clock()
+                while not (self.buffer or self.finished):
+                    self.cond.wait()
+                self.writer_waited += self.clock() - start
+                if not self.buffer:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                chunk = self.buffer.popleft()
+                self.buffered -= len(chunk)
+                self.cond.notify_all()
+            yield chunk
+
+    def report(self, log):
+        if self.thread is not None:
+            log.info("network waited %.1fs on the disk, disk waited %.1fs on the network; "
+                     "at most %s bytes buffered", self.reader_waited, self.writer_waited,
+                     self.peak)
+
+class AdaptiveChunkSize(object):
+    """
+    Read a response in chunks whose size follows the link: keep doubling
+    while throughput keeps rising, halve whenever a single chunk takes longer
+    than CHUNK_LATENCY to arrive (leaving the progress bar stuck).
+    """
+    def __init__(self, log, size=CHUNK_SIZE, clock=time.monotonic):
+        self.log = log
+        self.size = size
+        self.clock = clock
+        self.best = 0
+        self.sizes = collections.Counter()
+
+    def record(self, nbytes, elapsed):
+        self.sizes[self.size] += 1
+        if elapsed > CHUNK_LATENCY:
+            if self.size > MIN_CHUNK_SIZE:
+                self.size = max(MIN_CHUNK_SIZE, self.size // 2)
+                self.log.debug("chunk took %.2fs, shrinking chunk size to %s",
+                               elapsed, self.size)
+                # throughput at the new size starts from scratch
+                self.best = 0
+            return
+        if nbytes < self.size:
+            # short read at the end of the body tells us nothing
+            return
+        throughput = nbytes / max(elapsed, 1e-6)
+        # grow only on a real (not noise-level) improvement
+        if throughput > self.best * 1.1 and self.size < MAX_CHUNK_SIZE:
+            self.best = throughput
+            self.size = min(MAX_CHUNK_SIZE, self.size * 2)
+            self.log.debug("throughput %.0f bytes/s, growing chunk size to %s",
+                           throughput, self.size)
+
+    def iter_content(self, req):
+        """like req.iter_content(), but with the chunk size adapting as we go"""
+        while True:
+            start = self.clock()
+            chunk = req.raw.read(self.size, decode_content=True)
+            if not chunk:
+                break
+            self.record(len(chunk), self.clock() - start)
+            yield chunk
+
+    def report(self):
+        if self.sizes:
+            self.log.info("adaptive chunk size settled at %s (chunks by size: %s)",
+                          self.size, dict(sorted(self.sizes.items())))
+
+class ProgressReporter(object):
+    """
+    Translate downloaded byte counts into progress bar steps with a running
+    percentage and ETA, plus a periodic log message, and pass the running
+    byte count to the optional 'status' callable.
+    """
+    def __init__(self, progress, message, size, log, log_interval=60, completed=0,
+                 status=None):
+        self.progress = progress
+        self.status = status
+        self.message = message
+        self.size = size
+        self.log = log
+        self.log_interval = log_interval
+        self.start = time.time()
+        self.log_next = self.start + log_interval
+        # bytes already on disk from an interrupted download
+        self.base = self.completed = completed
+        if completed:
+            self.progress.step(completed)
+        if status is not None:
+            status(completed, size)
+
+    def step(self, nbytes):
+        self.completed += nbytes
+        if self.status is not None:
+            self.status(self.completed, self.size)
+
+        # once we've downloaded even the first chunk, we can
+        # start to make wild guesses about completion
+        fraction = float(self.completed)/self.size
+        percent  = int(100*fraction)
+        now = time.time()
+        elapsed = now - self.start
+        # Only the bytes fetched this time around say anything about speed.
+        # completed/size predicts elapsed/totaltime
+        # totaltime * (completed/size) = elapsed
+        # totaltime = elapsed / (completed / size)
+        totaltime = elapsed / (float(self.completed - self.base)/(self.size - self.base))
+        eta = self.start + totaltime
+        timeleft = int(eta - now)
+        mins,  secs = divmod(timeleft, 60)
+        hours, mins = divmod(mins, 60)
+        timeleft = "%2d:%02d:%02d" % (hours, mins, secs)
+
+        #increment the progress bar by nbytes/size units
+        self.progress.step(nbytes,
+                           message="%s: %s%%, %s left" % (self.message, percent, timeleft))
+
+        # Add periodic download log messages. When we start a background
+        # download on a separate thread, the main thread might complete --
+        # and produce log output to that effect -- yet the process lives
+        # on. Occasional log messages help the curious user remember that.
+        if now >= self.log_next:
+            self.log_next = now + self.log_interval
+            # For logging, use gmtime and the same time format as
+            # SL_Logging.Formatter.sl_format. We're likely to be
+            # looking at logs after the fact, so timeleft isn't as
+            # interesting as our ETA prediction converging.
+            eta = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(eta))
+            self.log.info("downloaded %s bytes; %s%% complete; ETA %s",
+                          self.completed, percent, eta)
 
 def main():
     import argparse
@@ -178,15 +1130,21 @@ def main():
     parser.add_argument('--url', dest='url', help='URL of file to be downloaded', required=True)
     parser.add_argument('--dir', dest='download_dir', help='directory to be downloaded to', required=True)
     parser.add_argument('--pb', dest='progressbar', help='whether or not to show a progressbar', action="store_true", default = False)
-    parser.add_argument('--size', dest='size', help='size of download for progressbar')
-    parser.add_argument('--chunk_size', dest='chunk_size', default=CHUNK_SIZE, help='max portion size of download to be loaded in memory in bytes.')
+    parser.add_argument('--size', dest='size', type=int, help='size of download for progressbar')
+    parser.add_argument('--chunk_size', dest='chunk_size', type=int, help='max portion size of download to be loaded in memory in bytes (default: adaptive)')
+    parser.add_argument('--segments', dest='segments', type=int, help='number of concurrent Range requests to use')
+    parser.add_argument('--mirror', dest='mirror_urls', action='append', help='another URL serving the same file (repeatable)')
+    parser.add_argument('--rate_limit', dest='rate_limit', help="bandwidth cap without --pb, e.g. '500K' or '25%%'")
     args = parser.parse_args()
 
     download_update(url = args.url,
                     download_dir = args.download_dir,
                     size = args.size,
                     progressbar = args.progressbar,
-                    chunk_size = args.chunk_size)
+                    chunk_size = args.chunk_size,
+                    segments = args.segments,
+                    rate_limit = args.rate_limit,
+                    mirror_urls = args.mirror_urls)
 
 if __name__ == "__main__":
     # Initialize the python logging system to SL Logging format and destination
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""\
+@file   download_worker.py
+@brief  Download an optional update in a detached process, so the launcher
+        can exit as soon as the viewer is running.
+
+The launcher writes a job file into the download directory and spawns
+
+    SLVersionChecker download <job file>
+
+which runs update_manager.download() and keeps a status file alongside:
+
+    {'state': 'downloading' | 'done' | 'failed',
+     'pid': <worker process id>, 'completed': <bytes>, 'size': <bytes>,
+     'installer': <pathname once done>, 'error': <message if failed>,
+     'updated': <time.time() of this report>}
+
+Later launches, and the LEAP path, read it with read_status().
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from util import SL_Logging, pass_logger
+
+JOB_FILE = 'download.job'
+STATUS_FILE = 'download.status'
+# How often (seconds) the worker rewrites the status file while downloading
+STATUS_INTERVAL = 2
+# A 'downloading' status this old means the worker died without saying so.
+STALE_STATUS = 120
+
+def status_file(download_dir):
+    return os.path.join(download_dir, STATUS_FILE)
+
+def write_status(download_dir, **status):
+    status.setdefault('pid', os.getpid())
+    status['updated'] = time.time()
+    path = status_file(download_dir)
+    # write-then-rename so a reader never sees half a status
+    with open(path + '.tmp', 'w') as f:
+        json.dump(status, f)
+    os.replace(path + '.tmp', path)
+
+def read_status(download_dir):
+    """
+    Return the worker's last status dict for 'download_dir', or None if
+    there's no (readable) status. A 'downloading' status from a worker that
+    has stopped reporting comes back with state 'dead'.
+    """
+    try:
+        with open(status_file(download_dir)) as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if status.get('state') == 'downloading' and \
+       time.time() - status.get('updated', 0) > STALE_STATUS:
+        status['state'] = 'dead'
+    return status
+
+def worker_command(job):
+    """the command line to run the worker for 'job'"""
+    if getattr(sys, 'frozen', False):
+        # PyInstaller: sys.executable is SLVersionChecker itself
+        return [sys.executable, 'download', job]
+    return [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                         'SLVersionChecker.py'),
+            'download', job]
+
+@pass_logger
+def spawn(log, result, download_dir, **options):
+    """
+    Start a detached worker to download the installer described by the
+    chosen VVM 'result' into 'download_dir'. 'options' are further keyword
+    arguments for update_manager.download(): segments, rate_limit,
+    mirror_urls. Return the worker's Popen object.
+    """
+    job = os.path.join(download_dir, JOB_FILE)
+    with open(job, 'w') as f:
+        # llsd hands us str subclasses and the like: flatten them
+        json.dump(dict(result=result, download_dir=download_dir, options=options),
+                  f, default=str)
+    # claim the download before the worker gets around to it
+    write_status(download_dir, state='downloading', completed=0, size=result.get('size'),
+                 pid=None)
+    command = worker_command(job)
+    kwds = dict(stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL, close_fds=True)
+    if platform.system() == 'Windows':
+        # no console window, and don't die with the launcher's console
+        kwds['creationflags'] = (subprocess.DETACHED_PROCESS |
+                                 subprocess.CREATE_NEW_PROCESS_GROUP |
+                                 subprocess.CREATE_NO_WINDOW)
+    else:
+        # own session: no SIGHUP when the launcher's terminal goes away
+        kwds['start_new_session'] = True
+    log.info("Spawning background downloader: %s", command)
+    return subprocess.Popen(command, **kwds)
+
+class StatusReporter(object):
+    """download_update() status callable that rewrites the status file"""
+    def __init__(self, download_dir, interval=STATUS_INTERVAL):
+        self.download_dir = download_dir
+        self.interval = interval
+        self.next = 0
+
+    def __call__(self, completed, size):
+        now = time.time()
+        if now >= self.next:
+            self.next = now + self.interval
+            write_status(self.download_dir, state='downloading', completed=completed, size=size)
+
+def run(job):
+    """the worker: perform the download described by the job file"""
+    # imported here: the launcher side of this module mustn't drag these in
+    import chunk_manifest
+    import download_scheduler
+    import update_manager
+    log = SL_Logging.getLogger('download_worker')
+    with open(job) as f:
+        job = json.load(f)
+    result, download_dir = job['result'], job['download_dir']
+    log.info("Background download of version %s to %s", result['version'], download_dir)
+    write_status(download_dir, state='downloading', completed=0, size=result.get('size'))
+    try:
+        installer = download_scheduler.run(download_scheduler.OPTIONAL, download_dir,
+                                           update_manager.download,
+                                           url=result['url'],
+                                           version=result['version'],
+                                           hash=result['hash'],
+                                           size=result['size'],
+                                           ui=False,
+                                           manifest=chunk_manifest.from_result(result),
+                                           delta=result.get('delta'),
+                                           status=StatusReporter(download_dir),
+                                           **job['options'])
+    except Exception as err:
+        log.error("Background download failed: %s: %s", type(err).__name__, err)
+        # a later launcher may have cleaned up the whole directory
+        if os.path.isdir(download_dir):
+            write_status(download_dir, state='failed', error="%s: %s" % (type(err).__name__, err))
+        return 1
+    write_status(download_dir, state='done', installer=installer,
+                 completed=os.path.getsize(installer), size=result.get('size'))
+    log.info("Background download finished: %s", installer)
+    return 0
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""\
+@file   gpu_rules.py
+@brief  The rules for which Windows systems can't run the 64-bit viewer, as
+        data rather than code.
+
+Empirically, the 64-bit viewer won't run on Windows 8.1 or 10 with certain
+Intel graphics: see WindowsVideo. Which cards -- and, for cards that don't
+give their model, which CPUs -- is in gpu_rules.json:
+
+    {"version": <int>,
+     "gpu": {"family": "Intel(R) HD Graphics",
+             "no64_models": [last word of a card name that's always bad],
+             "check_cpu_models": [last word of one that depends on the CPU]},
+     "cpu": [{"name": <description>, "pattern": <regexp>}, ...]}
+
+The copy bundled with the updater can be superseded by a newer one (higher
+'version') that the update service sends as 'gpu_rules' in its response.
+We save that for next time: by the time we see the response, this run has
+already chosen its platform.
+
+Each CPU pattern is compiled once, when the rules are loaded, and they're
+tried in order. (Folding them into one alternation would seem quicker, but
+with Python's backtracking re it's several times slower, and worse as the
+list grows: run tests/bench_gpu_rules.py.)
+
+Does not cover, due to supposedly up to date drivers:
+IntelR HD Graphics for Intel AtomR Processor Z3700 Series
+IntelR HD Graphics for IntelR CeleronR Processor N3000 Series (HD 400)
+
+IntelR HD Graphics for 4th Generation IntelR also have an up to date
+driver, but for now we consider it as 32 bit.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from contextlib import suppress
+import json
+import os
+import re
+import sys
+from util import Application, pass_logger
+
+RULES_FILE = 'gpu_rules.json'
+
+# what classify() says about a video card
+GOOD, BAD, CHECK_CPU = 'good', 'bad', 'check_cpu'
+
+def bundled_path():
+    # PyInstaller unpacks --add-data files under sys._MEIPASS
+    return os.path.join(getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__))),
+                        RULES_FILE)
+
+def saved_path():
+    return os.path.join(Application.userpath(), RULES_FILE)
+
+class Rules(object):
+    def __init__(self, data):
+        """
+        Compile rules 'data' (as in gpu_rules.json); raise ValueError if
+        they don't make sense.
+        """
+        try:
+            self.version = int(data['version'])
+            gpu = data['gpu']
+            self.family = gpu['family']
+            self.no64_models = frozenset(gpu['no64_models'])
+            self.check_cpu_models = frozenset(gpu['check_cpu_models'])
+            self.cpu_rules = [(rule['name'], re.compile(rule['pattern']))
+                              for rule in data['cpu']]
+        except (KeyError, TypeError, re.error) as err:
+            raise ValueError("invalid GPU rules: %s: %s" % (type(err).__name__, err)) from err
+
+    def classify(self, card):
+        """GOOD, BAD or CHECK_CPU for the video card named 'card'"""
+        words = card.split()
+        if self.family in card and words:
+            if words[-1] in self.no64_models:
+                return BAD
+            if words[-1] in self.check_cpu_models:
+                return CHECK_CPU
+        return GOOD
+
+    def match_cpu(self, cpu):
+        """the name of the first rule that flags CPU 'cpu' as bad, or None"""
+        for name, regexp in self.cpu_rules:
+            if regexp.search(cpu):
+                return name
+        return None
+
+def _read(path):
+    with open(path) as f:
+        return Rules(json.load(f))
+
+_rules = None
+
+@pass_logger
+def load(log):
+    """the current Rules: the saved copy if it's newer than the bundled one"""
+    global _rules
+    if _rules is None:
+        rules = _read(bundled_path())
+        try:
+            saved = _read(saved_path())
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as err:
+            log.warning("Ignoring saved GPU rules %s: %s: %s", saved_path(), type(err).__name__, err)
+        else:
+            if saved.version > rules.version:
+                log.debug("using GPU rules version %s from the update service", saved.version)
+                rules = saved
+        _rules = rules
+    return _rules
+
+@pass_logger
+def refresh(log, data):
+    """save the rules 'data' from the update service, if they're good and newer"""
+    try:
+        rules = Rules(data)
+    except ValueError as err:
+        log.warning("Update service sent %s", err)
+        return
+    if rules.version <= load().version:
+        return
+    path = saved_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write-then-rename so a reader never sees half a file
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(path + '.tmp', path)
+    except (OSError, TypeError) as err:
+        log.warning("Can't save GPU rules in %s: %s: %s", path, type(err).__name__, err)
+        with suppress(OSError):
+            os.remove(path + '.tmp')
+    else:
+        log.info("saved GPU rules version %s for next time", rules.version)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""\
+@file   hashing.py
+@brief  Compute one or more digests of a file in a single pass.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+import hashlib
+import mmap
+import os
+from util import on_hub
+
+# what the VVM hands us today
+DEFAULT_ALGORITHMS = ('md5',)
+# Reading in 4 KB pieces, as md5handle() used to, spends most of its time in
+# the interpreter rather than in the hash function.
+BUFFER_SIZE = 1024*1024
+# Files at least this big are hashed through mmap, which saves copying every
+# byte into a Python buffer first.
+MMAP_THRESHOLD = 64*1024*1024
+
+# see tests/bench_hashing.py
+STRATEGIES = ('readinto', 'mmap')
+
+class MultiHash(object):
+    """
+    Feed the same data to several hashlib algorithms at once:
+
+    digests = MultiHash(('md5', 'sha256'))
+    digests.update(data)
+    digests.hexdigests()    # {'md5': '...', 'sha256': '...'}
+    """
+    def __init__(self, algorithms=DEFAULT_ALGORITHMS):
+        self.hashes = {name: hashlib.new(name) for name in algorithms}
+
+    def update(self, data):
+        for h in self.hashes.values():
+            h.update(data)
+
+    def hexdigests(self):
+        return {name: h.hexdigest() for name, h in self.hashes.items()}
+
+def hash_handle(handle, algorithms=DEFAULT_ALGORITHMS, buffer_size=BUFFER_SIZE):
+    """
+    Return a dict of {algorithm: hexdigest} for the rest of the open binary
+    file 'handle', reading it through one reusable buffer.
+    """
+    digests = MultiHash(algorithms)
+    try:
+        readinto = handle.readinto
+    except AttributeError:
+        # not a real binary file -- do it the slow way
+        for chunk in iter(lambda: handle.read(buffer_size), b""):
+            digests.update(chunk)
+        return digests.hexdigests()
+
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        count = readinto(buffer)
+        if not count:
+            break
+        digests.update(view[:count])
+    return digests.hexdigests()
+
+def hash_mmap(handle, algorithms=DEFAULT_ALGORITHMS, buffer_size=BUFFER_SIZE):
+    """
+    Like hash_handle(), but hash the whole file behind 'handle' by mapping it
+    into memory, slicing it into buffer_size views.
+    """
+    digests = MultiHash(algorithms)
+    # can't mmap an empty file
+    if os.fstat(handle.fileno()).st_size:
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+             memoryview(mapped) as view:
+            for offset in range(0, len(view), buffer_size):
+                digests.update(view[offset:offset + buffer_size])
+    return digests.hexdigests()
+
+def hash_file(fname, algorithms=DEFAULT_ALGORITHMS, strategy=None, buffer_size=BUFFER_SIZE):
+    """
+    Return a dict of {algorithm: hexdigest} for the file 'fname'. Pass
+    strategy='readinto' or 'mmap' to override the choice by file size.
+
+    Under eventlet, the work happens on a tpool thread: hashlib releases
+    the GIL for big buffers, so other greenthreads -- in particular the Tk
+    event loop -- keep running while we hash a multi-hundred-MB installer.
+    """
+    return _offload(_hash_file, fname, tuple(algorithms), strategy, buffer_size)
+
+def _hash_file(fname, algorithms, strategy, buffer_size):
+    with open(fname, 'rb') as f:
+        if strategy is None:
+            strategy = 'mmap' if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD else 'readinto'
+        if strategy == 'mmap':
+            return hash_mmap(f, algorithms, buffer_size)
+        if strategy == 'readinto':
+            return hash_handle(f, algorithms, buffer_size)
+        raise ValueError("Unknown hashing strategy %r" % strategy)
+
+def _offload(func, *args):
+    # Off the hub (see util.on_hub()) we're a real thread, which may block
+    # all it likes -- and which tpool, tied to the hub, couldn't wake anyway.
+    if not on_hub():
+        return func(*args)
+    from eventlet import tpool
+    return tpool.execute(func, *args)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""\
+@file   installer_store.py
+@brief  Keep verified installers in one place, keyed by hash, so that every
+        viewer sharing this user directory downloads each one only once.
+
+    downloads/store/<md5>
+
+Each entry is a hard link (or, where links aren't possible, a copy) of an
+installer that passed its hash check. update_manager.download() links a
+stored installer into its downloads/<version> directory instead of fetching
+it again, and stores each one it does fetch.
+
+The store is held to a disk budget -- SL_DOWNLOAD_STORE_BUDGET, e.g. '2G';
+0 turns the store off -- by evicting the least recently used entries.
+(An entry still linked from a version directory costs no extra space, but
+counts against the budget all the same: the budget is meant to be simple.)
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from contextlib import suppress
+import download_update
+import hashing
+import os
+import shutil
+import string
+import time
+from util import Application, parse_size, pass_logger
+
+BUDGET = 2*1024*1024*1024
+
+def store_dir():
+    return os.path.join(Application.userpath(), "downloads", "store")
+
+def _entry(hash):
+    # it came from the network: make sure it's a plain file name
+    if hash and all(c in string.hexdigits for c in hash):
+        return os.path.join(store_dir(), hash.lower())
+    return None
+
+@pass_logger
+def budget(log):
+    value = os.getenv('SL_DOWNLOAD_STORE_BUDGET')
+    if value:
+        try:
+            return parse_size(value)
+        except ValueError:
+            log.warning("Ignoring invalid SL_DOWNLOAD_STORE_BUDGET value %r", value)
+    return BUDGET
+
+def link(source, dest):
+    """hard link 'source' as 'dest', atomically replacing any 'dest'"""
+    temp = dest + '.tmp%s' % os.getpid()
+    with suppress(FileNotFoundError):
+        os.remove(temp)
+    try:
+        os.link(source, temp)
+    except OSError:
+        # FAT, or some other filesystem without links
+        shutil.copy2(source, temp)
+    os.replace(temp, dest)
+
+@pass_logger
+def fetch(log, hash, download_dir, basename):
+    """
+    If the store has the installer with md5 'hash' -- and it still has that
+    hash -- put it in 'download_dir' as 'basename', complete with the .done
+    marker, and return its pathname. Otherwise return None.
+    """
+    entry = _entry(hash)
+    if not (entry and budget()):
+        return None
+    installer = os.path.join(download_dir, basename)
+    try:
+        # one corrupted entry would otherwise go to every install after it
+        if hashing.hash_file(entry)['md5'] != hash.lower():
+            log.warning("Stored installer %s doesn't match its hash; discarding it", entry)
+            os.remove(entry)
+            return None
+        link(entry, installer)
+        # we just used it
+        os.utime(entry)
+    except OSError as err:
+        if not isinstance(err, FileNotFoundError):
+            log.warning("Can't use stored installer %s: %s: %s", entry, type(err).__name__, err)
+        return None
+    download_update.mark_done(download_dir)
+    log.info("using stored installer %s for %s", entry, installer)
+    return installer
+
+@pass_logger
+def add(log, installer, hash):
+    """
+    Store 'installer', which has been verified to have md5 'hash', then
+    trim the store to its budget. Best effort: failure only costs bandwidth.
+    """
+    entry = _entry(hash)
+    limit = budget()
+    if not (entry and limit):
+        return
+    try:
+        os.makedirs(store_dir(), exist_ok=True)
+        if os.path.exists(entry):
+            os.utime(entry)
+        else:
+            link(installer, entry)
+            log.debug("stored %s as %s", installer, entry)
+        evict(limit)
+    except OSError as err:
+        log.warning("Can't store installer %s: %s: %s", installer, type(err).__name__, err)
+
+@pass_logger
+def evict(log, limit):
+    """remove least recently used entries until the store fits in 'limit' bytes"""
+    entries = []
+    with os.scandir(store_dir()) as it:
+        for entry in it:
+            if entry.is_file() and '.tmp' not in entry.name:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for mtime, size, path in entries)
+    # oldest first
+    for mtime, size, path in sorted(entries):
+        if total <= limit:
+            break
+        log.info("evicting stored installer %s, last used %s", path,
+                 time.strftime("%Y-%m-%d", time.localtime(mtime)))
+        with suppress(FileNotFoundError):
+            os.remove(path)
+        total -= size
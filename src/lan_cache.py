@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""\
+@file   lan_cache.py
+@brief  A caching proxy for the update service and its installers, so that a
+        site running many viewers fetches each installer from the CDN once.
+
+Run it on one machine:
+
+    SLVersionChecker serve --port 8073
+
+and point the others at it with SL_UPDATE_SERVICE=http://thathost:8073 .
+
+Update queries pass through to the real update service (--upstream, by
+default whatever query_vvm() would use). In each answer, every installer --
+any map with 'url', 'hash' and 'size' -- is redirected to
+
+    http://thathost:8073/installer/<hash>/<filename>
+
+with its original URL kept as the first of its 'mirrors', so clients can
+still fall back to the CDN.
+
+The first request for an installer starts a single download of it into the
+cache, which that request and any others stream from as the bytes arrive.
+(Clients check the hash of what they get, as always.) Only once the cached
+file matches the hash from the update service is it marked verified, and
+its last byte served; an unverified one is fetched again. Range requests
+are honored, so clients can resume, and split their downloads into
+segments, as usual.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from contextlib import suppress
+import download_update
+import hashing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
+import llsd
+import os
+import re
+import requests
+import shutil
+import string
+import threading
+from util import Application, BuildData, SL_Logging, pass_logger
+
+DEFAULT_PORT = 8073
+INSTALLER_PATH = re.compile(r'^/installer/([0-9a-fA-F]+)/([^/?]+)$')
+# marks a cache entry whose installer matched its hash
+VERIFIED = 'verified'
+# how much to send per write
+PIECE = 1024*1024
+
+def default_cache_dir():
+    return os.path.join(Application.userpath(), "downloads", "lan_cache")
+
+class Fetch(object):
+    """
+    One download of an installer into the cache, which any number of
+    requests can follow as it arrives.
+    """
+    def __init__(self, cache, record):
+        self.cache = cache
+        self.record = record
+        self.completed = 0
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+        threading.Thread(name="lan-cache-fetch", target=self._run, daemon=True).start()
+
+    def _status(self, completed, size):
+        with self.cond:
+            self.completed = completed
+            self.cond.notify_all()
+
+    def _run(self):
+        log=SL_Logging.getLogger('lan_cache')
+        hash = self.record['hash']
+        entry = self.cache.entry_dir(hash)
+        try:
+            log.info("fetching %s for the cache", self.record['url'])
+            # one stream from byte 0, so that whatever has arrived is contiguous
+            filename, digest = download_update.download_update(
+                url=self.record['url'], download_dir=entry, size=self.record['size'],
+                segments=1, rate_limit=0, status=self._status)
+            if digest is None:
+                digest = hashing.hash_file(filename)['md5']
+            if digest != hash:
+                raise ValueError("hash mismatch: expected %s, received %s" % (hash, digest))
+            with open(os.path.join(entry, VERIFIED), 'w'):
+                pass
+            log.info("cached %s", filename)
+        except Exception as err:
+            log.error("Couldn't cache %s: %s: %s", self.record['url'], type(err).__name__, err)
+            self.error = err
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+        self.cache.finished(hash)
+
+    def wait_for(self, offset):
+        """
+        Block until byte 'offset' of the installer may be served. Return how
+        far the file can now be read, or raise if the fetch failed.
+        """
+        with self.cond:
+            while True:
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return self.record['size']
+                # download_update() reports only bytes it has flushed to the
+                # file. Hold back the last one until the hash checks out, so
+                # that no client ever completes a bad copy.
+                readable = min(self.completed, self.record['size'] - 1)
+                if readable > offset:
+                    return readable
+                self.cond.wait()
+
+class InstallerCache(object):
+    def __init__(self, cache_dir, upstream):
+        self.cache_dir = cache_dir
+        self.upstream = upstream
+        self.lock = threading.Lock()
+        # hash: Fetch in progress
+        self.fetches = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_dir(self, hash):
+        return os.path.join(self.cache_dir, hash)
+
+    def learn(self, record):
+        """remember where to fetch the installer described by 'record'"""
+        path = os.path.join(self.cache_dir, record['hash'] + '.json')
+        # write-then-rename so lookup() never sees half a record -- with a
+        # temp file per thread, since handlers may learn the same one at once
+        temp = '%s.%s.tmp' % (path, threading.get_ident())
+        try:
+            with open(temp, 'w') as f:
+                json.dump(record, f)
+            os.replace(temp, path)
+        except BaseException:
+            with suppress(OSError):
+                os.remove(temp)
+            raise
+
+    def lookup(self, hash):
+        try:
+            with open(os.path.join(self.cache_dir, hash + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def open(self, hash):
+        """
+        Return (pathname, size, Fetch or None if it's already cached) for
+        the installer with 'hash', or None if we've never heard of it.
+        """
+        hash = hash.lower()
+        with self.lock:
+            record = self.lookup(hash)
+            if record is None:
+                return None
+            filename = os.path.join(self.entry_dir(hash), record['url'].split('/')[-1])
+            if os.path.exists(os.path.join(self.entry_dir(hash), VERIFIED)):
+                return filename, record['size'], None
+            fetch = self.fetches.get(hash)
+            if fetch is None:
+                fetch = self.fetches[hash] = Fetch(self, record)
+            return filename, record['size'], fetch
+
+    def finished(self, hash):
+        with self.lock:
+            fetch = self.fetches.pop(hash, None)
+        if fetch is not None and fetch.error is not None:
+            # don't serve a bad copy to the next request, nor resume it
+            shutil.rmtree(self.entry_dir(hash), ignore_errors=True)
+
+    def rewrite(self, body, base):
+        """
+        Redirect the installers in update service response 'body' to this
+        server, at 'base' (e.g. 'http://thathost:8073'). Return the new body,
+        or None if it isn't LLSD.
+        """
+        try:
+            data = llsd.parse(body)
+        except Exception:
+            return None
+
+        def walk(node):
+            if isinstance(node, dict):
+                hash = node.get('hash')
+                if isinstance(hash, str) and hash and node.get('url') and node.get('size') \
+                   and all(c in string.hexdigits for c in hash):
+                    hash = hash.lower()
+                    self.learn(dict(url=node['url'], hash=hash, size=node['size']))
+                    node['mirrors'] = [node['url']] + list(node.get('mirrors') or [])
+                    node['url'] = '%s/installer/%s/%s' % (base, hash, node['url'].split('/')[-1])
+                for value in node.values():
+                    walk(value)
+            elif isinstance(node, list):
+                for value in node:
+                    walk(value)
+
+        walk(data)
+        return llsd.format_xml(data)
+
+def make_server(cache_dir, upstream, bind='', port=DEFAULT_PORT):
+    """a ThreadingHTTPServer for the cache; call serve_forever() on it"""
+    cache = InstallerCache(cache_dir, upstream)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            log=SL_Logging.getLogger('lan_cache')
+            match = INSTALLER_PATH.match(self.path)
+            try:
+                if match:
+                    self._send_installer(match.group(1))
+                else:
+                    self._forward()
+            except (BrokenPipeError, ConnectionResetError):
+                # the client gave up
+                pass
+            except Exception as err:
+                log.error("%s failed: %s: %s", self.path, type(err).__name__, err)
+                # too late for an error status once the body is under way
+                self.close_connection = True
+
+        def _forward(self):
+            headers = {name: self.headers[name] for name in ('Accept',) if self.headers[name]}
+            response = requests.get(cache.upstream.rstrip('/') + self.path, headers=headers,
+                                    timeout=download_update.timeouts())
+            body = response.content
+            content_type = response.headers.get('Content-Type', 'application/octet-stream')
+            if response.ok:
+                rewritten = cache.rewrite(body, 'http://%s' % self.headers['Host'])
+                if rewritten is not None:
+                    body, content_type = rewritten, 'application/llsd+xml'
+            self.send_response(response.status_code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_installer(self, hash):
+            found = cache.open(hash)
+            if found is None:
+                self.send_error(404, "unknown installer: ask the update service first")
+                return
+            filename, size, fetch = found
+            start, end = 0, size
+            match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+            if match:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(end, int(match.group(2)) + 1)
+                if start >= end:
+                    self.send_error(416)
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %s-%s/%s' % (start, end - 1, size))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start))
+            self.send_header('Accept-Ranges', 'bytes')
+            # the content is the hash: it never changes
+            self.send_header('ETag', '"%s"' % hash.lower())
+            self.end_headers()
+            offset = start
+            f = None
+            try:
+                while offset < end:
+                    available = end if fetch is None else min(end, fetch.wait_for(offset))
+                    if f is None:
+                        # not until the download has created it
+                        f = open(filename, 'rb')
+                    f.seek(offset)
+                    data = f.read(min(available - offset, PIECE))
+                    if not data:
+                        raise EOFError("%s ends at %s" % (filename, offset))
+                    self.wfile.write(data)
+                    offset += len(data)
+            finally:
+                if f is not None:
+                    f.close()
+
+        def log_message(self, format, *args):
+            SL_Logging.getLogger('lan_cache').debug("%s: " + format, self.address_string(), *args)
+
+    server = ThreadingHTTPServer((bind, port), Handler)
+    server.daemon_threads = True
+    return server
+
+@pass_logger
+def serve(log, port, bind, cache, upstream):
+    """SLVersionChecker serve: run the caching proxy until interrupted"""
+    import update_manager
+    upstream = upstream or os.getenv('SL_UPDATE_SERVICE') or \
+        BuildData.get('Update Service', update_manager.DEFAULT_UPDATE_SERVICE)
+    cache = cache or default_cache_dir()
+    server = make_server(cache, upstream, bind, port)
+    log.info("serving updates from %s on port %s, caching installers in %s",
+             upstream, server.server_port, cache)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
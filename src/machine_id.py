@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""\
+@file   machine_id.py
+@brief  Remember the hashed machine id that make_VVM_UUID_hash() sends to
+        the update service, so that launches needn't probe for it.
+
+Probing means running hostid, system_profiler or PowerShell, which can take
+seconds -- for a value that changes only with the hardware. So the hash is
+kept in <userpath>/machine_id.json:
+
+    {"version": VERSION, "key": <invalidation key>, "hash": <md5 hex>,
+     "probed": <time.time()>, "dummy": <true if the probe failed>}
+
+and reused as long as the invalidation key -- platform, host name and
+architecture, all cheap to get -- still matches. Bump VERSION whenever the
+probe changes what it hashes.
+
+When the probe fails, we reuse whatever hash we have rather than mint a
+fresh dummy each time: a stable id is worth more to the update service than
+a new one per launch. Only with nothing cached do we mint one, and cache it;
+it's replaced by a real one, in the background, once a probe succeeds.
+
+Set SL_MACHINE_ID_REFRESH to a number of seconds to re-probe, in the
+background, a cached id older than that.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from contextlib import suppress
+import hashlib
+import json
+import os
+import platform
+import threading
+import time
+import uuid
+from util import Application, SL_Logging, config_int, pass_logger
+
+VERSION = 1
+CACHE_FILE = 'machine_id.json'
+
+def cache_path():
+    return os.path.join(Application.userpath(), CACHE_FILE)
+
+def invalidation_key(platform_key):
+    return '/'.join((platform_key, platform.node(), platform.machine()))
+
+def load():
+    """the cache record, or {} if there isn't a readable one"""
+    try:
+        with open(cache_path()) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return record if isinstance(record, dict) and record.get('hash') else {}
+
+@pass_logger
+def save(log, platform_key, hash, dummy=False):
+    path = cache_path()
+    record = dict(version=VERSION, key=invalidation_key(platform_key), hash=hash,
+                  probed=time.time(), dummy=dummy)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write-then-rename so a reader never sees half a record
+        with open(path + '.tmp', 'w') as f:
+            json.dump(record, f)
+        os.replace(path + '.tmp', path)
+    except OSError as err:
+        log.warning("Can't cache machine id in %s: %s: %s", path, type(err).__name__, err)
+        with suppress(OSError):
+            os.remove(path + '.tmp')
+
+def _refresh(platform_key, probe):
+    log=SL_Logging.getLogger('machine_id')
+    hash = probe(platform_key)
+    if hash is not None:
+        log.debug("refreshed machine id")
+        save(platform_key, hash)
+
+@pass_logger
+def get(log, platform_key, probe):
+    """
+    Return the hashed machine id, calling probe(platform_key) -- which
+    returns the hash, or None if it can't get one -- only if need be.
+    """
+    record = load()
+    current = record.get('version') == VERSION and \
+              record.get('key') == invalidation_key(platform_key)
+    if current:
+        interval = config_int(None, 'SL_MACHINE_ID_REFRESH', 0)
+        if record.get('dummy') or \
+           (interval and time.time() - record.get('probed', 0) > interval):
+            # off the critical path: this launch uses what we have
+            threading.Thread(name="machine-id-refresh", target=_refresh,
+                             args=(platform_key, probe), daemon=True).start()
+        return record['hash']
+
+    hash = probe(platform_key)
+    if hash is not None:
+        save(platform_key, hash)
+        return hash
+    if record:
+        # the hardware may have changed, or may not: either way, a stable
+        # id beats a new one per launch
+        log.info("Unable to get system unique id; reusing the cached one")
+        save(platform_key, record['hash'], dummy=True)
+        return record['hash']
+    #fake it
+    log.info("Unable to get system unique id; constructing a dummy")
+    hash = hashlib.md5(str(uuid.uuid1()).encode('utf8')).hexdigest()
+    save(platform_key, hash, dummy=True)
+    return hash
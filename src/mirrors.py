@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""\
+@file   mirrors.py
+@brief  Choose among several URLs serving the same installer, and fail over
+        between them mid-download.
+
+Mirrors can come from the VVM platform result:
+
+    'mirrors': ['https://mirror1.example.com/.../Second_Life_Setup.exe', ...]
+
+and/or from the UpdaterMirrors setting: base URLs (a list, or a
+comma-separated string) to which the installer's filename is appended.
+
+Since every mirror serves the same bytes, a download can carry on from one
+where it left off on another. The final hash check (and chunk manifest, if
+any) is what guarantees that premise.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+import requests
+import threading
+import time
+from util import SL_Logging, pass_logger
+
+# how much of the installer each mirror gets to show how fast it is
+PROBE_BYTES = 256*1024
+# a mirror that can't deliver PROBE_BYTES within this many seconds loses
+PROBE_TIMEOUT = 5
+
+def from_result(result, setting=None):
+    """
+    Return the list of mirror URLs (excluding result['url'] itself) for the
+    chosen VVM 'result' plus the UpdaterMirrors 'setting'.
+    """
+    urls = list(result.get('mirrors') or [])
+    if isinstance(setting, str):
+        setting = setting.split(',')
+    filename = result['url'].split('/')[-1]
+    urls.extend(base.strip().rstrip('/') + '/' + filename
+                for base in (setting or []) if base.strip())
+    # keep the order, lose duplicates and the primary
+    seen = {result['url']}
+    return [url for url in urls if not (url in seen or seen.add(url))]
+
+@pass_logger
+def rank(log, urls, probe_bytes=PROBE_BYTES, timeout=PROBE_TIMEOUT):
+    """
+    Fetch the first 'probe_bytes' of each of 'urls' concurrently and return
+    them fastest first. Mirrors that fail the probe go last, in their
+    original order: slow beats nothing.
+    """
+    if len(urls) < 2:
+        return list(urls)
+    timings = {}
+    def probe(url):
+        start = time.monotonic()
+        try:
+            with requests.get(url, stream=True, timeout=timeout,
+                              headers={'Range': 'bytes=0-%s' % (probe_bytes - 1)}) as req:
+                req.raise_for_status()
+                received = 0
+                for chunk in req.iter_content(64*1024):
+                    received += len(chunk)
+                    if received >= probe_bytes or time.monotonic() - start > timeout:
+                        break
+        except Exception as err:
+            log.info("mirror probe of %s failed: %s: %s", url, type(err).__name__, err)
+            return
+        elapsed = time.monotonic() - start
+        timings[url] = elapsed / max(received, 1) * probe_bytes
+
+    threads = [threading.Thread(name="mirror-probe", target=probe, args=(url,), daemon=True)
+               for url in urls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout + 1)
+    ranked = sorted(timings, key=timings.get) + [url for url in urls if url not in timings]
+    log.info("mirrors by probe time: %s",
+             ', '.join("%s (%s)" % (url, ("%.2fs" % timings[url]) if url in timings else 'failed')
+                       for url in ranked))
+    return ranked
+
+class MirrorList(object):
+    """
+    The URLs a download may use, best first. Any number of download threads
+    may call failover() on the same bad mirror: it moves on only once.
+    """
+    def __init__(self, urls):
+        self.urls = list(urls)
+        self.index = 0
+        self.lock = threading.Lock()
+
+    def current(self):
+        return self.urls[self.index]
+
+    def failover(self, bad):
+        """Stop using 'bad' (if we still were); return the URL to use now"""
+        log = SL_Logging.getLogger('MirrorList')
+        with self.lock:
+            if len(self.urls) > 1 and self.urls[self.index] == bad:
+                self.index = (self.index + 1) % len(self.urls)
+                log.warning("switching from mirror %s to %s", bad, self.urls[self.index])
+            return self.urls[self.index]
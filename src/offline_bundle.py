@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""\
+@file   offline_bundle.py
+@brief  Install from a directory of pre-seeded installers instead of the
+        network, for air-gapped or bandwidth-starved sites.
+
+Copy installers into the bundle directory -- SL_UPDATE_BUNDLE, or by default
+<userpath>/bundle -- and update_manager.download() uses whichever one matches
+the size and hash of the chosen update, without touching the network.
+
+The directory holds an index, index.json:
+
+    {"installers": {<md5>: {"file": <name>, "size": <bytes>, "mtime": <float>}}}
+
+so that a launch costs a couple of stat() calls and one small read however
+many versions the directory holds. The index is brought up to date whenever
+the directory has changed since it was written, which rehashes only files
+that are new or changed. A read-only directory (say, a share prepared
+elsewhere) works too: we just can't save the updated index there.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from contextlib import suppress
+import download_update
+import hashing
+import installer_store
+import json
+import os
+from util import Application, pass_logger
+
+INDEX = 'index.json'
+# Writing the index itself touches the directory; allow for that (and for
+# filesystems with coarse timestamps) before calling the index stale.
+SLACK = 2
+
+def bundle_dir():
+    return os.getenv('SL_UPDATE_BUNDLE') or os.path.join(Application.userpath(), "bundle")
+
+def read_index(directory):
+    """the index in 'directory', or {} if there isn't a readable one"""
+    try:
+        with open(os.path.join(directory, INDEX)) as f:
+            return json.load(f)['installers']
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+@pass_logger
+def build_index(log, directory, old=None):
+    """
+    Index the installers in 'directory', reusing entries from index 'old'
+    for files whose size and mtime are unchanged. Save the index if we can,
+    and return it.
+    """
+    known = {entry['file']: (hash, entry) for hash, entry in (old or {}).items()}
+    installers = {}
+    with os.scandir(directory) as it:
+        for item in it:
+            if item.name == INDEX or item.name.startswith('.') or not item.is_file():
+                continue
+            stat = item.stat()
+            hash, entry = known.get(item.name, (None, None))
+            if entry is None or (entry.get('size'), entry.get('mtime')) != \
+                                (stat.st_size, stat.st_mtime):
+                log.info("indexing %s", item.path)
+                hash = hashing.hash_file(item.path)['md5']
+                entry = dict(file=item.name, size=stat.st_size, mtime=stat.st_mtime)
+            installers[hash] = entry
+    path = os.path.join(directory, INDEX)
+    try:
+        # write-then-rename so a reader never sees half an index
+        with open(path + '.tmp', 'w') as f:
+            json.dump(dict(installers=installers), f, indent=1)
+        os.replace(path + '.tmp', path)
+    except OSError as err:
+        log.warning("Can't save bundle index %s: %s: %s", path, type(err).__name__, err)
+        with suppress(OSError):
+            os.remove(path + '.tmp')
+    return installers
+
+def _index(directory):
+    try:
+        changed = os.stat(directory).st_mtime
+    except FileNotFoundError:
+        return {}
+    try:
+        indexed = os.stat(os.path.join(directory, INDEX)).st_mtime
+    except FileNotFoundError:
+        return build_index(directory)
+    old = read_index(directory)
+    if changed > indexed + SLACK:
+        return build_index(directory, old)
+    return old
+
+def _match(directory, index, hash, size):
+    """pathname of the indexed installer with 'hash' and 'size', if it's still there"""
+    entry = index.get(hash)
+    if not entry or entry.get('size') != size:
+        return None
+    source = os.path.join(directory, entry['file'])
+    try:
+        stat = os.stat(source)
+    except FileNotFoundError:
+        return None
+    if (stat.st_size, stat.st_mtime) != (entry['size'], entry['mtime']):
+        return None
+    return source
+
+@pass_logger
+def fetch(log, hash, size, download_dir, basename):
+    """
+    If the bundle directory has the installer with md5 'hash' and 'size',
+    put it in 'download_dir' as 'basename', complete with the .done marker,
+    and return its pathname. Otherwise return None.
+    """
+    directory = bundle_dir()
+    try:
+        index = _index(directory)
+        source = _match(directory, index, hash, size)
+        if source is None and hash in index:
+            # replaced or removed since it was indexed
+            source = _match(directory, build_index(directory, index), hash, size)
+    except OSError as err:
+        log.warning("Can't read bundle directory %s: %s: %s", directory, type(err).__name__, err)
+        return None
+    if source is None:
+        return None
+    installer = os.path.join(download_dir, basename)
+    try:
+        installer_store.link(source, installer)
+    except OSError as err:
+        log.warning("Can't use bundled installer %s: %s: %s", source, type(err).__name__, err)
+        return None
+    download_update.mark_done(download_dir)
+    log.info("using bundled installer %s for %s", source, installer)
+    return installer
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""\
+@file   rate_limit.py
+@brief  Cap the bandwidth a background download takes from the viewer.
+
+A limit may be expressed as:
+
+    '500K', '2M', 250000   -- bytes per second
+    '25%'                  -- a share of the link, measured by letting the
+                              download run flat out for PROBE_SECONDS first
+    0, '', None            -- no limit
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+import threading
+import time
+from util import parse_size
+
+# how long a percentage limiter measures the link before throttling
+PROBE_SECONDS = 5
+
+class TokenBucket(object):
+    """
+    Classic token bucket: 'rate' tokens (bytes) per second accrue, up to
+    'burst'. consume(n) takes n tokens, sleeping off any deficit. It's safe
+    to share one bucket among several download threads.
+    """
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        # by default, allow a second's worth at once
+        self.burst = float(burst if burst is not None else rate)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.stamp = clock()
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes):
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            # Go into debt rather than waiting for enough tokens: a chunk has
+            # already arrived by the time we're asked, and whoever comes next
+            # inherits the deficit.
+            self.tokens -= nbytes
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            self.sleep(wait)
+
+class LinkShare(object):
+    """
+    Pass bytes through unthrottled for 'probe' seconds to measure the link,
+    then hold the download to 'percent' of that.
+    """
+    def __init__(self, percent, probe=PROBE_SECONDS, clock=time.monotonic, sleep=time.sleep):
+        self.percent = percent
+        self.probe = probe
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+        self.measured = 0
+        self.bucket = None
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes):
+        with self.lock:
+            if self.bucket is None:
+                now = self.clock()
+                if self.start is None:
+                    self.start = now
+                self.measured += nbytes
+                elapsed = now - self.start
+                if elapsed < self.probe:
+                    return
+                rate = max(1, self.measured / elapsed * self.percent / 100)
+                self.bucket = TokenBucket(rate, clock=self.clock, sleep=self.sleep)
+                return
+        self.bucket.consume(nbytes)
+
+def limiter(value):
+    """
+    Return an object with a consume(nbytes) method implementing the limit
+    described by 'value' (see module docstring), or None for no limit.
+    Raise ValueError for garbage.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return None
+        if value.endswith('%'):
+            percent = float(value[:-1])
+            if not 0 < percent <= 100:
+                raise ValueError("link share %r must be in (0%%, 100%%]" % value)
+            return None if percent == 100 else LinkShare(percent)
+        value = parse_size(value)
+    if value < 0:
+        raise ValueError("negative rate limit %r" % value)
+    return TokenBucket(value) if value else None
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""\
+@file   stream_extract.py
+@brief  Unpack a Linux .tar.bz2 update while it downloads, instead of reading
+        the whole tarball back afterwards.
+
+download_update() feeds each chunk of an in-order download to a
+StreamingExtractor, which unpacks it on its own thread into
+
+    <installer>.extracting
+
+Once update_manager.download() has checked the hash of the very bytes we
+unpacked, commit() renames that to <installer>.extracted, and
+apply_linux_update() just moves it into place. Anything less -- a resumed
+or segmented download, a bad or repaired chunk, a hash mismatch, a corrupt
+tarball -- leaves no .extracted tree (see discard()), and
+apply_linux_update() unpacks the tarball as it always has.
+
+Since nothing is verified while we unpack, no member may land outside the
+.extracting tree: no absolute paths, no '..', no links pointing out of it.
+
+Both trees live inside the download directory, so they go wherever it goes.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from contextlib import suppress
+import os
+import shutil
+import tarfile
+from util import SL_Logging, hub_queue, hub_threading, pass_logger
+
+EXTRACTING = '.extracting'
+EXTRACTED = '.extracted'
+# how many downloaded chunks may wait for the unpacking thread
+BACKLOG = 8
+
+def staged_tree(installer):
+    """the verified tree unpacked from 'installer', or None"""
+    staged = installer + EXTRACTED
+    return staged if os.path.isdir(staged) else None
+
+@pass_logger
+def commit(log, installer):
+    """
+    'installer' has passed its hash check: bless whatever was unpacked from
+    it as it downloaded.
+    """
+    with suppress(FileNotFoundError):
+        os.rename(installer + EXTRACTING, installer + EXTRACTED)
+        log.info("unpacked %s during download", installer)
+
+def discard(installer):
+    """throw away whatever was unpacked from 'installer' as it downloaded"""
+    shutil.rmtree(installer + EXTRACTING, ignore_errors=True)
+
+def _checked(tar, dest):
+    """
+    tar's members, refusing any that would write outside 'dest' -- for
+    Pythons whose tarfile lacks extraction filters
+    """
+    dest = os.path.realpath(dest)
+    def inside(path):
+        return os.path.commonpath([dest, os.path.realpath(path)]) == dest
+    for member in tar:
+        target = os.path.join(dest, member.name)
+        if os.path.isabs(member.name) or not inside(target) or member.isdev() or \
+           (member.issym() and not inside(os.path.join(os.path.dirname(target),
+                                                       member.linkname))) or \
+           (member.islnk() and not inside(os.path.join(dest, member.linkname))):
+            raise tarfile.TarError("refusing to unpack %r outside %s" % (member.name, dest))
+        yield member
+
+class Tee(object):
+    """pass each update(data) on to every one of 'sinks'"""
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def update(self, data):
+        for sink in self.sinks:
+            sink.update(data)
+
+class StreamingExtractor(object):
+    """
+    Unpack the .tar.bz2 whose bytes are passed, in order, to update() into
+    <installer>.extracting. Call finish() after the last byte, or abort() to
+    give up.
+
+    The unpacking runs on its own thread -- a greenthread on the eventlet
+    hub's thread (see util.hub_threading()), where a full backlog then makes
+    update() yield rather than block.
+    """
+    def __init__(self, installer):
+        self.staging = installer + EXTRACTING
+        # leftovers from an earlier attempt
+        shutil.rmtree(self.staging, ignore_errors=True)
+        shutil.rmtree(installer + EXTRACTED, ignore_errors=True)
+        os.makedirs(self.staging)
+        self.chunks = hub_queue().Queue(BACKLOG)
+        self.current = memoryview(b'')
+        self.eof = False
+        self.error = None
+        self.thread = hub_threading().Thread(name="stream-extract", target=self._extract,
+                                             daemon=True)
+        self.thread.start()
+
+    def update(self, data):
+        if self.error is None:
+            self.chunks.put(bytes(data))
+
+    def read(self, size=-1):
+        # tarfile's end of the pipe: short reads are fine, b'' means EOF
+        while not self.current and not self.eof:
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.eof = True
+            else:
+                self.current = memoryview(chunk)
+        if size < 0:
+            size = len(self.current)
+        data, self.current = self.current[:size], self.current[size:]
+        return bytes(data)
+
+    def _extract(self):
+        try:
+            with tarfile.open(fileobj=self, mode="r|bz2") as tar:
+                # these bytes aren't verified yet: keep them in the staging tree
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(path=self.staging, filter='data')
+                else:
+                    tar.extractall(path=self.staging, members=_checked(tar, self.staging))
+        except Exception as err:
+            self.error = err
+        # Swallow whatever follows the end of the archive (or the error),
+        # so that update() never blocks.
+        while not self.eof:
+            self.read()
+
+    def _close(self):
+        if self.thread.is_alive():
+            self.chunks.put(None)
+            self.thread.join()
+
+    def finish(self):
+        """
+        The download is complete: wait for the unpacking. Return True if it
+        worked; otherwise clean up and return False.
+        """
+        log=SL_Logging.getLogger('StreamingExtractor')
+        self._close()
+        if self.error is not None:
+            log.warning("Couldn't unpack download as it arrived: %s: %s",
+                        type(self.error).__name__, self.error)
+            self.abort()
+            return False
+        return True
+
+    def abort(self):
+        self._close()
+        shutil.rmtree(self.staging, ignore_errors=True)
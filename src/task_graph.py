@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""\
+@file   task_graph.py
+@brief  Run a handful of interdependent steps concurrently.
+
+    results = task_graph.run(dict(
+        settings=(get_settings, ()),
+        platform=(lambda settings: pick_target_platform(settings.get('x')), ('settings',)),
+        vvm_id=(lambda: make_VVM_UUID_hash(key), ()),
+    ))
+
+Each step runs on its own greenthread or thread (see below) as soon as the
+steps it names are done, and is called with their results as keyword
+arguments. run() returns {name: result}. So the update check takes about as long as its slowest
+chain of steps, not the sum of them all.
+
+If a step raises, the steps that depend on it are skipped, and once every
+step that could run has finished, run() raises that exception (the first
+such step's, in the order given, if there are several).
+
+SLVersionChecker monkeypatches sockets, time, subprocess and the like, but
+not threads, so its eventlet hub -- and every greenthread, LEAP's included
+-- lives on the main thread. Called there, run() spawns greenthreads and
+waits on green events (see util.hub_threading()), so the steps' subprocess
+and HTTP waits, and run()'s own, yield to everything else. Anywhere else (a
+real thread, or without eventlet) the steps are real threads.
+
+So nothing a step calls may wait on a real threading primitive: on the hub
+that blocks every greenthread, the one that would wake it included. Locks
+that real threads share too must be util.HubLocks.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+import time
+from util import SL_Logging, hub_threading
+
+class Skipped(Exception):
+    """a step that didn't run because a step it depends on failed"""
+    pass
+
+class _Step(object):
+    def __init__(self, name, func, deps, threads):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.done = threads.Event()
+        self.result = None
+        self.error = None
+
+def run(tasks):
+    """
+    'tasks' is {name: (callable, (names of the steps it depends on))}.
+    Return {name: result}.
+    """
+    log=SL_Logging.getLogger('task_graph')
+    threads = hub_threading()
+    steps = {name: _Step(name, func, deps, threads) for name, (func, deps) in tasks.items()}
+    for step in steps.values():
+        unknown = [dep for dep in step.deps if dep not in steps]
+        if unknown:
+            raise ValueError("step %r depends on unknown %s" % (step.name, ', '.join(unknown)))
+    _check_cycles(steps)
+
+    start = time.perf_counter()
+
+    def perform(step):
+        try:
+            for dep in step.deps:
+                steps[dep].done.wait()
+                if steps[dep].error is not None:
+                    raise Skipped("%s: %s failed" % (step.name, dep))
+            began = time.perf_counter()
+            step.result = step.func(**{dep: steps[dep].result for dep in step.deps})
+            log.debug("%s took %.3fs (finished at %.3fs)", step.name,
+                      time.perf_counter() - began, time.perf_counter() - start)
+        except BaseException as err:
+            step.error = err
+        finally:
+            step.done.set()
+
+    for step in steps.values():
+        threads.Thread(name="task-" + step.name, target=perform, args=(step,),
+                       daemon=True).start()
+    for step in steps.values():
+        step.done.wait()
+    log.debug("%s steps took %.3fs", len(steps), time.perf_counter() - start)
+
+    for step in steps.values():
+        if step.error is not None and not isinstance(step.error, Skipped):
+            raise step.error
+    return {name: step.result for name, step in steps.items()}
+
+def _check_cycles(steps):
+    # a cycle would leave run() waiting forever
+    state = {}
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError("steps depend on each other: %s" % ' -> '.join(path + [name]))
+        state[name] = 'visiting'
+        for dep in steps[name].deps:
+            visit(dep, path + [name])
+        state[name] = 'done'
+    for name in steps:
+        visit(name, [])
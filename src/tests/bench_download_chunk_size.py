@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""\
+@file   bench_download_chunk_size.py
+@brief  Compare adaptive download chunk sizing against fixed sizes on a
+        local throttled server.
+
+Usage (from src):  python tests/bench_download_chunk_size.py --rates 2M,20M,0
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [here, os.path.dirname(here)]
+os.environ.setdefault('APP_DATA_DIR', here)
+
+from util import SL_Logging, BuildData, parse_size
+from fake_cdn import FakeCDN
+import download_update
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark download_update() chunk sizing")
+    parser.add_argument('--size', default='64M', help='payload size (default %(default)s)')
+    parser.add_argument('--rates', default='2M,20M,0',
+                        help='comma-separated server rates in bytes/sec, 0 for unthrottled '
+                        '(default %(default)s)')
+    parser.add_argument('--chunks', default='auto,64K,1M',
+                        help="comma-separated chunk sizes, 'auto' for adaptive "
+                        "(default %(default)s)")
+    parser.add_argument('--verbose', action='store_true', help='log adaptive decisions')
+    args = parser.parse_args()
+
+    BuildData.read(os.path.join(here, 'build_data.json'))
+    SL_Logging.getLogger('bench_chunk_size', verbosity=('DEBUG' if args.verbose else 'WARNING'))
+    os.environ.pop("http_proxy", None)
+    payload = os.urandom(parse_size(args.size))
+
+    print("%10s %10s %10s %10s %12s" % ('rate', 'chunk', 'seconds', 'MB/s', 'max stall'))
+    for rate in (parse_size(r) for r in args.rates.split(',')):
+        for chunk in args.chunks.split(','):
+            chunk_size = None if chunk == 'auto' else parse_size(chunk)
+            tmpdir = tempfile.mkdtemp(prefix='bench_chunk_size')
+            # longest gap between progress updates
+            stalls = []
+            real_step = download_update.ProgressReporter.step
+            def step(self, nbytes, last=[None]):
+                now = time.monotonic()
+                if last[0] is not None:
+                    stalls.append(now - last[0])
+                last[0] = now
+                return real_step(self, nbytes)
+            download_update.ProgressReporter.step = step
+            try:
+                with FakeCDN({'/installer.bin': payload}, rate=rate or None) as cdn:
+                    start = time.perf_counter()
+                    download_update.download_update(
+                        url=cdn.url('/installer.bin'), download_dir=tmpdir,
+                        size=len(payload), chunk_size=chunk_size)
+                    elapsed = time.perf_counter() - start
+            finally:
+                download_update.ProgressReporter.step = real_step
+                shutil.rmtree(tmpdir, ignore_errors=True)
+            print("%10s %10s %10.2f %10.1f %12.2f" %
+                  (rate or 'max', chunk, elapsed, len(payload) / elapsed / 1024**2,
+                   max(stalls, default=0)))
+
+if __name__ == "__main__":
+    main()
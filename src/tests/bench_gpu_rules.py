@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""\
+@file   bench_gpu_rules.py
+@brief  Compare gpu_rules' matching of CPU names -- each rule's regexp in
+        turn -- with a single alternation of them all, as the list grows.
+
+Usage (from src):  python tests/bench_gpu_rules.py --copies 1,10,100
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [here, os.path.dirname(here)]
+os.environ.setdefault('APP_DATA_DIR', here)
+
+import gpu_rules
+from test_gpu_rules_match import CPUS
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark GPU rule matching")
+    parser.add_argument('--copies', default='1,10,100',
+                        help='comma-separated multiples of the bundled CPU rules to match '
+                        'against (default %(default)s)')
+    parser.add_argument('--number', type=int, default=200,
+                        help='passes over the test CPU names (default %(default)s)')
+    args = parser.parse_args()
+
+    with open(gpu_rules.bundled_path()) as f:
+        data = json.load(f)
+    cpus = [cpu for cpu, expected in CPUS]
+
+    print("%8s %12s %12s" % ('rules', 'in turn', 'alternation'))
+    for copies in (int(c) for c in args.copies.split(',')):
+        # rules shaped like the real ones, but (mostly) unable to match, so
+        # most names have to get past all of them
+        rules = [dict(name='%s %s' % (rule['name'], n),
+                      pattern=rule['pattern'].replace(r'\s', r'\s' + 'Q'*n, 1))
+                 for n in range(1, copies) for rule in data['cpu']] + data['cpu']
+        compiled = gpu_rules.Rules(dict(data, cpu=rules))
+        names = {'rule%d' % index: rule['name'] for index, rule in enumerate(rules)}
+        alternation = re.compile('|'.join('(?P<rule%d>%s)' % (index, rule['pattern'])
+                                          for index, rule in enumerate(rules)))
+
+        def in_turn():
+            for cpu in cpus:
+                compiled.match_cpu(cpu)
+
+        def single_pass():
+            for cpu in cpus:
+                match = alternation.search(cpu)
+                match and names[match.lastgroup]
+
+        print("%8s %10.2fms %10.2fms" %
+              (len(rules), timeit.timeit(in_turn, number=args.number) * 1000,
+               timeit.timeit(single_pass, number=args.number) * 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""\
+@file   bench_hashing.py
+@brief  Compare hashing buffer sizes and strategies on files of various
+        sizes.
+
+Usage (from src):  python tests/bench_hashing.py --sizes 100M,1G
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [here, os.path.dirname(here)]
+os.environ.setdefault('APP_DATA_DIR', here)
+
+import hashing
+from util import parse_size
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark file hashing buffer sizes and strategies")
+    parser.add_argument('--sizes', default='100M,1G',
+                        help='comma-separated test file sizes (default %(default)s)')
+    parser.add_argument('--buffers', default='4K,64K,256K,1M,4M',
+                        help='comma-separated buffer sizes (default %(default)s)')
+    parser.add_argument('--strategies', default=','.join(hashing.STRATEGIES),
+                        help='comma-separated strategies (default %(default)s)')
+    parser.add_argument('--algorithms', default='md5',
+                        help='comma-separated hashlib algorithms computed together '
+                        '(default %(default)s)')
+    parser.add_argument('--dir', default=None,
+                        help='where to create the test files (default: system temp)')
+    args = parser.parse_args()
+
+    algorithms = tuple(args.algorithms.split(','))
+    print("%10s %10s %10s %10s %10s" % ('file', 'strategy', 'buffer', 'seconds', 'MB/s'))
+    for size in (parse_size(s) for s in args.sizes.split(',')):
+        with tempfile.NamedTemporaryFile(dir=args.dir, delete=False) as f:
+            block = os.urandom(1024*1024)
+            for offset in range(0, size, len(block)):
+                f.write(block[:size - offset])
+        try:
+            for strategy in args.strategies.split(','):
+                for buffer_size in (parse_size(b) for b in args.buffers.split(',')):
+                    start = time.perf_counter()
+                    hashing.hash_file(f.name, algorithms, strategy, buffer_size)
+                    elapsed = time.perf_counter() - start
+                    print("%10s %10s %10s %10.3f %10.1f" %
+                          (size, strategy, buffer_size, elapsed, size / elapsed / 1024**2))
+        finally:
+            os.remove(f.name)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""\
+@file   fake_cdn.py
+@brief  Provide a local stand-in for the download CDN for test scripts
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+import hashlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import re
+import threading
+import time
+
+class FakeCDN(object):
+    """
+    Usage:
+
+    with FakeCDN({'/installer.exe': payload}) as cdn:
+        download_update.download_update(url=cdn.url('/installer.exe'), ...)
+
+    Serves each path in the passed dict from memory on a free localhost port,
+    honoring single-range 'Range: bytes=N-M' requests unless honor_range is
+    False. Each file's ETag is the md5 of its current contents, so replacing
+    a file in 'files' makes a stale If-Range fetch the whole file. Every
+    request is recorded in 'requests' as (path, headers) so the test can
+    inspect what the downloader actually asked for.
+
+    To simulate a dropped connection, set drop[path] = N: the next response
+    for that path is cut off after N body bytes. To simulate corruption in
+    transit, set corrupt[path] = N: the next response for that path that
+    covers byte offset N delivers that byte inverted. To simulate a stalled
+    connection, set stall[path] = (N, seconds): the next response for that
+    path goes silent for that long after N body bytes.
+
+    Pass rate (bytes/sec) to serve every response at no more than that
+    speed, as a stand-in for a slow link.
+    """
+    # granularity of rate limiting
+    PIECE = 16*1024
+
+    def __init__(self, files, honor_range=True, rate=None):
+        self.files = dict(files)
+        self.honor_range = honor_range
+        self.rate = rate
+        self.requests = []
+        self.drop = {}
+        self.corrupt = {}
+        self.stall = {}
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                cdn.requests.append((self.path, dict(self.headers)))
+                try:
+                    body = cdn.files[self.path]
+                except KeyError:
+                    self.send_error(404)
+                    return
+                etag = '"%s"' % hashlib.md5(body).hexdigest()
+                start, end = 0, len(body)
+                match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+                if_range = self.headers.get('If-Range')
+                if match and cdn.honor_range and if_range in (None, etag):
+                    start = int(match.group(1))
+                    if match.group(2):
+                        end = min(end, int(match.group(2)) + 1)
+                    self.send_response(206)
+                    self.send_header('Content-Range',
+                                     'bytes %s-%s/%s' % (start, end-1, len(body)))
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Length', str(end - start))
+                self.send_header('Accept-Ranges', 'bytes' if cdn.honor_range else 'none')
+                self.send_header('ETag', etag)
+                self.end_headers()
+                offset = cdn.corrupt.get(self.path)
+                if offset is not None and start <= offset < end:
+                    del cdn.corrupt[self.path]
+                    body = body[:offset] + bytes([body[offset] ^ 0xff]) + body[offset+1:]
+                stall = cdn.stall.pop(self.path, None)
+                if stall is not None:
+                    count, seconds = stall
+                    try:
+                        self.wfile.write(body[start:min(end, start + count)])
+                        self.wfile.flush()
+                        time.sleep(seconds)
+                        self.wfile.write(body[start + count:end])
+                    except (BrokenPipeError, ConnectionResetError):
+                        # the client gave up on us, as it should
+                        pass
+                    self.close_connection = True
+                    return
+                drop = cdn.drop.pop(self.path, None)
+                if drop is not None:
+                    self.wfile.write(body[start:min(end, start + drop)])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                if not cdn.rate:
+                    self.wfile.write(body[start:end])
+                    return
+                for offset in range(start, end, cdn.PIECE):
+                    self.wfile.write(body[offset:min(end, offset + cdn.PIECE)])
+                    time.sleep(min(end - offset, cdn.PIECE) / cdn.rate)
+
+            def log_message(self, *args):
+                # keep test output quiet
+                pass
+
+        # port 0 asks the OS for any free port
+        self.server = ThreadingHTTPServer(('localhost', 0), Handler)
+        self.server.daemon_threads = True
+
+    def url(self, path):
+        return 'http://localhost:%s%s' % (self.server.server_port, path)
+
+    def __enter__(self):
+        threading.Thread(name='fake_cdn', target=self.server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+        return False
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""\
+@file   monkeypatched.py
+@brief  Run a test scenario in a child process monkeypatched the way
+        SLVersionChecker patches itself.
+
+    output = monkeypatched.run('''
+    with Bystander() as bystander:
+        update_manager.WindowsHardware.get()
+    print(bystander.ticks)
+    ''')
+
+The child imports SLVersionChecker -- and so calls eventlet.monkey_patch()
+exactly as it does -- plus the modules under test, then runs the script on
+its main thread: the hub's. A scenario that blocks the hub for good fails
+the test by timing out, rather than hanging the whole test run.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+PREAMBLE = """\
+import os, sys
+sys.path[:0] = [%r, %r]
+os.environ['APP_DATA_DIR'] = %r
+import SLVersionChecker
+import eventlet
+import time
+import update_manager
+from monkeypatched import Bystander
+from patch import patch, patch_dict
+""" % (here, os.path.dirname(here), here)
+
+def run(script, timeout=30):
+    """
+    Run Python source 'script' as described above. Return its stdout, or
+    raise AssertionError if it fails or takes longer than 'timeout' seconds.
+    """
+    try:
+        child = subprocess.run([sys.executable, '-c', PREAMBLE + textwrap.dedent(script)],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True, timeout=timeout)
+    except subprocess.TimeoutExpired as err:
+        # (what output there is comes back as bytes, universal_newlines or no)
+        stderr = err.stderr.decode(errors='replace') if err.stderr else ''
+        raise AssertionError("still running after %s seconds: the hub is blocked\n%s" %
+                             (timeout, stderr)) from None
+    assert child.returncode == 0, "failed with %s:\n%s" % (child.returncode, child.stderr)
+    return child.stdout
+
+class Bystander(object):
+    """
+    A greenthread that just ticks, every 'interval' seconds, for as long as
+    the hub lets it: ticks counts how often it got to.
+    """
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.ticks = 0
+
+    def _tick(self):
+        import eventlet
+        while True:
+            eventlet.sleep(self.interval)
+            self.ticks += 1
+
+    def __enter__(self):
+        import eventlet
+        self.thread = eventlet.spawn(self._tick)
+        return self
+
+    def __exit__(self, *exc):
+        self.thread.kill()
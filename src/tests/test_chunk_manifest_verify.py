@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""\
+@file   test_chunk_manifest_verify.py
+@brief  Test per-chunk verification and repair of downloads
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import hashlib
+import os
+import pytest
+import shutil
+import tempfile
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch, patch_dict
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import chunk_manifest
+import download_update
+import installer_store
+import update_manager
+
+PAYLOAD = bytes(range(256)) * 1031 + b'tail'
+PATH = '/Second_Life_Setup.exe'
+CHUNK = 16384
+
+def setup_function():
+    global tmpdir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_chunk_manifest', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_manifest')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def make_manifest(payload=PAYLOAD, chunk_size=CHUNK):
+    chunks = [hashlib.md5(payload[start:start + chunk_size]).hexdigest()
+              for start in range(0, len(payload), chunk_size)]
+    return chunk_manifest.ChunkManifest(len(payload), chunk_size, chunks,
+                                        root=chunk_manifest.merkle_root(chunks))
+
+def test_merkle_root():
+    leaves = [hashlib.md5(c).hexdigest() for c in (b'a', b'b', b'c')]
+    ab = hashlib.md5(bytes.fromhex(leaves[0]) + bytes.fromhex(leaves[1])).digest()
+    # odd node 'c' is carried up unchanged
+    expected = hashlib.md5(ab + bytes.fromhex(leaves[2])).hexdigest()
+    assert_equal(chunk_manifest.merkle_root(leaves), expected)
+    assert_equal(chunk_manifest.merkle_root(leaves[:1]), leaves[0])
+
+def test_bad_manifest():
+    manifest = make_manifest()
+    with pytest.raises(chunk_manifest.ManifestError):
+        # wrong number of chunks for the size
+        chunk_manifest.ChunkManifest(len(PAYLOAD), CHUNK, manifest.chunks[:-1])
+    with pytest.raises(chunk_manifest.ManifestError):
+        chunk_manifest.ChunkManifest(len(PAYLOAD), CHUNK, manifest.chunks, root='0'*32)
+    # and from_result() just shrugs it off
+    assert_equal(chunk_manifest.from_result(dict(size=len(PAYLOAD),
+                                                 manifest=dict(chunk_size=CHUNK))), None)
+
+def test_verify_file():
+    filename = os.path.join(tmpdir, 'installer')
+    with open(filename, 'wb') as f:
+        f.write(PAYLOAD[:CHUNK*2 + 5] + b'X' + PAYLOAD[CHUNK*2 + 6:])
+    assert_equal(make_manifest().verify_file(filename), [2])
+
+def test_corrupt_chunk_refetched():
+    with FakeCDN({PATH: PAYLOAD}) as cdn:
+        cdn.corrupt[PATH] = CHUNK*3 + 7
+        filename, digest = download_update.download_update(
+            url=cdn.url(PATH), download_dir=tmpdir, size=len(PAYLOAD),
+            chunk_size=4096, manifest=make_manifest())
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
+    # streaming digest was abandoned, and only the bad chunk onward re-fetched
+    assert_equal(digest, None)
+    assert_equal(cdn.requests[-1][1]['Range'], 'bytes=%s-%s' % (CHUNK*3, len(PAYLOAD) - 1))
+
+def test_corrupt_segment_refetched():
+    with patch(download_update, 'MIN_SEGMENT_SIZE', 1024), FakeCDN({PATH: PAYLOAD}) as cdn:
+        cdn.corrupt[PATH] = CHUNK*10 + 7
+        filename, digest = download_update.download_update(
+            url=cdn.url(PATH), download_dir=tmpdir, size=len(PAYLOAD),
+            chunk_size=4096, segments=4, manifest=make_manifest())
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
+
+def test_download_repairs_bad_chunk():
+    manifest = make_manifest()
+    real_download_update = download_update.download_update
+    def corrupting_download_update(**kwds):
+        # simulate damage the per-chunk check couldn't see
+        kwds.pop('manifest')
+        filename, digest = real_download_update(**kwds)
+        with open(filename, 'r+b') as f:
+            f.seek(CHUNK + 1)
+            f.write(b'!')
+        return filename, None
+    with FakeCDN({PATH: PAYLOAD}) as cdn, \
+         patch(download_update, 'download_update', corrupting_download_update), \
+         patch(installer_store, 'store_dir', lambda: os.path.join(tmpdir, 'store')), \
+         patch_dict(os.environ, 'SL_UPDATE_BUNDLE', os.path.join(tmpdir, 'bundle')):
+        filename = update_manager.download(
+            url=cdn.url(PATH), version='1.2.3', download_dir=tmpdir, size=len(PAYLOAD),
+            hash=hashlib.md5(PAYLOAD).hexdigest(), ui=False, manifest=manifest)
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
+    assert_equal(cdn.requests[-1][1]['Range'], 'bytes=%s-%s' % (CHUNK, CHUNK*2 - 1))
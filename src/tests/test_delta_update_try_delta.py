@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""\
+@file   test_delta_update_try_delta.py
+@brief  Test rebuilding an installer from the retained one plus a patch
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import glob
+import hashlib
+import os
+import pytest
+import shutil
+import tempfile
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch, patch_dict
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import delta_update
+
+OLD = bytes(range(256)) * 400
+NEW = OLD[:50000] + b'new build' + OLD[50009:]
+URL_NAME = 'Second_Life_4_0_6.exe'
+
+def setup_function():
+    global tmpdir, download_dir, version
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_delta_update', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_delta')
+    download_dir = os.path.join(tmpdir, '4.0.6.999999')
+    os.makedirs(download_dir)
+    version = BuildData.get('Version')
+    installer = os.path.join(tmpdir, 'Second_Life_4_0_5.exe')
+    with open(installer, 'wb') as f:
+        f.write(OLD)
+    with patch(delta_update, 'base_dir', lambda: os.path.join(tmpdir, 'base')):
+        delta_update.retain(installer, version)
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def xor_patch(base, patch, output):
+    # stand-in patch format: new = base XOR patch
+    with open(base, 'rb') as b, open(patch, 'rb') as p, open(output, 'wb') as o:
+        o.write(bytes(x ^ y for x, y in zip(b.read(), p.read())))
+
+def try_delta(cdn, patchdata, rate_limit=None, **overrides):
+    cdn.files['/delta'] = patchdata
+    delta = dict(url=cdn.url('/delta'), hash=hashlib.md5(patchdata).hexdigest(),
+                 size=len(patchdata), base_version=version, format='xor')
+    delta.update(overrides)
+    with patch(delta_update, 'base_dir', lambda: os.path.join(tmpdir, 'base')), \
+         patch_dict(delta_update.APPLIERS, 'xor', xor_patch):
+        return delta_update.try_delta(delta, 'https://cdn/' + URL_NAME, download_dir,
+                                      hashlib.md5(NEW).hexdigest(), False,
+                                      rate_limit=rate_limit)
+
+def test_retain():
+    with patch(delta_update, 'base_dir', lambda: os.path.join(tmpdir, 'base')):
+        base = delta_update.base_installer(version)
+        assert base
+        with open(base, 'rb') as f:
+            assert f.read() == OLD
+        # retaining a newer one replaces it
+        delta_update.retain(base, '4.0.6.999999')
+        assert_equal(delta_update.base_installer(version), None)
+        assert delta_update.base_installer('4.0.6.999999')
+
+def test_try_delta():
+    with FakeCDN({}) as cdn:
+        installer = try_delta(cdn, bytes(x ^ y for x, y in zip(OLD, NEW)))
+    assert_equal(installer, os.path.join(download_dir, URL_NAME))
+    with open(installer, 'rb') as f:
+        assert f.read() == NEW
+    assert glob.glob(os.path.join(download_dir, '*.done'))
+    assert not os.path.exists(download_dir + '.delta')
+
+class Meter(object):
+    """a limiter that just counts what it's charged"""
+    throttled = False
+
+    def __init__(self):
+        self.consumed = 0
+
+    def consume(self, nbytes):
+        self.consumed += nbytes
+
+def test_try_delta_throttled():
+    patchdata = bytes(x ^ y for x, y in zip(OLD, NEW))
+    meter = Meter()
+    with FakeCDN({}) as cdn:
+        assert try_delta(cdn, patchdata, rate_limit=meter)
+    assert_equal(meter.consumed, len(patchdata))
+
+def test_try_delta_bad_result():
+    with FakeCDN({}) as cdn:
+        assert_equal(try_delta(cdn, bytes(len(OLD))), None)
+    # nothing for check_for_completed_download() to mistake for an installer
+    assert_equal(os.listdir(download_dir), [])
+
+def test_try_delta_other_base():
+    with FakeCDN({}) as cdn:
+        assert_equal(try_delta(cdn, b'', base_version='1.2.3.4'), None)
+    assert_equal(cdn.requests, [])
+
+def test_try_delta_zstd():
+    zstandard = pytest.importorskip('zstandard')
+    params = zstandard.ZstdCompressionParameters.from_level(19, window_log=27)
+    compressor = zstandard.ZstdCompressor(
+        compression_params=params,
+        dict_data=zstandard.ZstdCompressionDict(OLD, dict_type=zstandard.DICT_TYPE_RAWCONTENT))
+    with FakeCDN({}) as cdn:
+        installer = try_delta(cdn, compressor.compress(NEW), format='zstd')
+    with open(installer, 'rb') as f:
+        assert f.read() == NEW
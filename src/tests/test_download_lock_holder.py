@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""\
+@file   test_download_lock_holder.py
+@brief  Test single-flight download coordination between processes
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import hashlib
+import os
+import pytest
+import shutil
+import tempfile
+import threading
+import time
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch, patch_dict
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_lock
+import download_update
+import installer_store
+import update_manager
+
+PAYLOAD = os.urandom(50000)
+PATH = '/Second_Life_Setup.exe'
+
+def setup_function():
+    global tmpdir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_download_lock', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_lock')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def test_holder():
+    assert_equal(download_lock.holder(tmpdir), None)
+    with download_lock.DownloadLock(tmpdir) as lock:
+        assert_equal(download_lock.holder(tmpdir)['pid'], os.getpid())
+        with pytest.raises(download_lock.LockHeld):
+            download_lock.DownloadLock(tmpdir).acquire()
+        # no need to sleep and compare file sizes
+        with patch(update_manager, 'sleep', lambda duration: 1/0):
+            assert_equal(update_manager.check_for_completed_download(tmpdir, 100), 'skip')
+    assert_equal(download_lock.holder(tmpdir), None)
+    assert not os.path.exists(os.path.join(tmpdir, download_lock.OWNER_FILE))
+
+def test_download_update_busy():
+    with download_lock.DownloadLock(tmpdir), FakeCDN({PATH: PAYLOAD}) as cdn, \
+         patch(download_update, 'LOCK_WAIT', 0):
+        with pytest.raises(download_update.FileInUseExcption):
+            download_update.download_update(url=cdn.url(PATH), download_dir=tmpdir,
+                                            size=len(PAYLOAD))
+    assert_equal(cdn.requests, [])
+
+def test_wait_for_other_download():
+    lock = download_lock.DownloadLock(tmpdir).acquire()
+    def other_process():
+        for completed in 20000, len(PAYLOAD):
+            time.sleep(0.2)
+            lock.next_update = 0
+            lock.update(completed, len(PAYLOAD))
+        with open(os.path.join(tmpdir, PATH[1:]), 'wb') as f:
+            f.write(PAYLOAD)
+        download_update.mark_done(tmpdir)
+        lock.release()
+    threading.Thread(target=other_process).start()
+    with FakeCDN({PATH: PAYLOAD}) as cdn, \
+         patch(download_update, 'LOCK_WAIT', 0), patch(download_lock, 'POLL', 0.01), \
+         patch(installer_store, 'store_dir', lambda: os.path.join(tmpdir, 'store')), \
+         patch_dict(os.environ, 'SL_UPDATE_BUNDLE', os.path.join(tmpdir, 'bundle')):
+        installer = update_manager.download(url=cdn.url(PATH), version='1.2.3',
+                                            download_dir=tmpdir, size=len(PAYLOAD),
+                                            hash=hashlib.md5(PAYLOAD).hexdigest(), ui=False)
+    assert_equal(installer, os.path.join(tmpdir, PATH[1:]))
+    # we attached to the other download instead of starting our own
+    assert_equal(cdn.requests, [])
+
+def test_download_in_progress():
+    assert not update_manager.download_in_progress(tmpdir)
+    with download_lock.DownloadLock(tmpdir):
+        assert update_manager.download_in_progress(tmpdir)
+    assert not update_manager.download_in_progress(tmpdir)
+
+def test_clear_keeps_lock():
+    download_lock.DownloadLock(tmpdir).acquire().release()
+    os.makedirs(os.path.join(tmpdir, 'installer.extracting', 'SecondLife'))
+    with open(os.path.join(tmpdir, PATH[1:]), 'wb') as f:
+        f.write(PAYLOAD)
+    download_update.mark_done(tmpdir)
+    download_lock.clear(tmpdir)
+    assert_equal(os.listdir(tmpdir), [download_lock.LOCK_FILE])
+
+def test_hash_mismatch_keeps_lock():
+    with FakeCDN({PATH: PAYLOAD}) as cdn, \
+         patch(installer_store, 'store_dir', lambda: os.path.join(tmpdir, 'store')), \
+         patch_dict(os.environ, 'SL_UPDATE_BUNDLE', os.path.join(tmpdir, 'bundle')):
+        download_dir = os.path.join(tmpdir, '1.2.3')
+        with pytest.raises(update_manager.UpdateError):
+            update_manager.download(url=cdn.url(PATH), version='1.2.3',
+                                    download_dir=download_dir, size=len(PAYLOAD),
+                                    hash='0'*32, ui=False)
+    # anyone else waiting on it is still waiting on the same file
+    assert_equal(os.listdir(download_dir), [download_lock.LOCK_FILE])
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""\
+@file   test_download_scheduler_run.py
+@brief  Test prioritizing, pausing and sharing concurrent downloads
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from util import SL_Logging, BuildData
+from patch import patch
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_scheduler
+from download_scheduler import REQUIRED, OPTIONAL, PREFETCH
+
+def setup_function():
+    global tmpdir, scheduler
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_download_scheduler', verbosity='DEBUG')
+    tmpdir = tempfile.mkdtemp(prefix = 'test_scheduler')
+    scheduler = download_scheduler.Scheduler()
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+class Background(object):
+    """a fake background download that runs until stopped"""
+    def __init__(self, priority, name):
+        self.stop = threading.Event()
+        self.chunks = 0
+        self.gate = None
+        self.thread = threading.Thread(target=scheduler.run, daemon=True,
+                                       args=(priority, os.path.join(tmpdir, name), self.download))
+        self.thread.start()
+        while self.gate is None:
+            time.sleep(0.01)
+
+    def download(self, download_dir, rate_limit):
+        self.gate = rate_limit
+        while not self.stop.is_set():
+            rate_limit.consume(1)
+            self.chunks += 1
+            time.sleep(0.001)
+        return download_dir
+
+    def paused(self, timeout=5):
+        # wait for the gate to notice, then make sure it's stopped
+        deadline = time.monotonic() + timeout
+        while not self.gate.job.paused and time.monotonic() < deadline:
+            time.sleep(0.01)
+        before = self.chunks
+        time.sleep(0.05)
+        return self.gate.job.paused and self.chunks == before
+
+    def finish(self):
+        self.stop.set()
+        self.thread.join(5)
+
+def test_preempt():
+    with patch(download_scheduler, 'PAUSE_POLL', 0.01):
+        prefetch = Background(PREFETCH, 'prefetch')
+        optional = Background(OPTIONAL, 'optional')
+        # the optional download pauses the prefetch...
+        assert prefetch.paused()
+        assert not optional.paused(timeout=0)
+        def required(download_dir, rate_limit):
+            # ...and a required one pauses both, without itself being throttled
+            assert_equal(rate_limit, 0)
+            assert optional.paused()
+            assert prefetch.paused()
+            return 'installer'
+        assert_equal(scheduler.run(REQUIRED, os.path.join(tmpdir, 'required'), required),
+                     'installer')
+        # once it's done, the optional download resumes
+        assert not optional.paused(timeout=0.1)
+        optional.finish()
+        assert not prefetch.paused(timeout=0.1)
+        prefetch.finish()
+
+def test_join():
+    with patch(download_scheduler, 'PAUSE_POLL', 0.01):
+        optional = Background(OPTIONAL, 'same')
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(
+            scheduler.run(REQUIRED, os.path.join(tmpdir, 'same'), lambda **kwds: 1/0)))
+        waiter.start()
+        # the running download is promoted, not duplicated
+        while optional.gate.job.priority != REQUIRED:
+            time.sleep(0.01)
+        assert not optional.gate.throttled
+        optional.finish()
+        waiter.join(5)
+    assert_equal(results, [os.path.join(tmpdir, 'same')])
+
+def test_shared_budget():
+    gates = []
+    for name, limit in ('one', '1M'), ('two', '5M'):
+        scheduler.run(OPTIONAL, os.path.join(tmpdir, name),
+                      lambda download_dir, rate_limit: gates.append(rate_limit), rate_limit=limit)
+    # both charged the budget the first one set
+    assert gates[0].throttled
+    assert_equal(scheduler.budget.rate, 1024*1024)
+
+def test_other_process():
+    marker = os.path.join(tmpdir, download_scheduler.PREEMPT_FILE)
+    with patch(download_scheduler, 'PAUSE_POLL', 0.01):
+        with open(marker, 'w') as f:
+            f.write('999999')
+        optional = Background(OPTIONAL, 'optional')
+        assert optional.paused()
+        # a marker nobody refreshes goes stale
+        old = time.time() - download_scheduler.PREEMPT_STALE - 1
+        os.utime(marker, (old, old))
+        assert not optional.paused(timeout=0.1)
+        optional.finish()
+
+def test_announce_required():
+    marker = os.path.join(tmpdir, download_scheduler.PREEMPT_FILE)
+    seen = []
+    def required(download_dir, rate_limit):
+        deadline = time.monotonic() + 5
+        while not os.path.exists(marker) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with open(marker) as f:
+            seen.append(f.read())
+    scheduler.run(REQUIRED, os.path.join(tmpdir, 'required'), required)
+    assert_equal(seen, [str(os.getpid())])
+    assert not os.path.exists(marker)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""\
+@file   test_download_update_adaptive_chunk_size.py
+@brief  Test adapting the download chunk size to measured throughput
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import os
+import shutil
+import tempfile
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_update
+from download_update import AdaptiveChunkSize, CHUNK_SIZE, MIN_CHUNK_SIZE, MAX_CHUNK_SIZE
+
+def setup_function():
+    global log, tmpdir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    log = SL_Logging.getLogger('test_adaptive_chunk_size', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_adaptive')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def test_grows_while_throughput_rises():
+    adaptive = AdaptiveChunkSize(log)
+    # a link with fixed per-chunk overhead: bigger chunks amortize it
+    while adaptive.size < MAX_CHUNK_SIZE:
+        size = adaptive.size
+        adaptive.record(size, 0.01 + size / 1e9)
+        assert adaptive.size > size
+    adaptive.record(MAX_CHUNK_SIZE, 0.01)
+    assert_equal(adaptive.size, MAX_CHUNK_SIZE)
+
+def test_holds_when_throughput_flat():
+    adaptive = AdaptiveChunkSize(log)
+    adaptive.record(CHUNK_SIZE, CHUNK_SIZE / 1e8)
+    size = adaptive.size
+    # same bytes/sec at twice the size: no point growing further
+    adaptive.record(size, size / 1e8)
+    assert_equal(adaptive.size, size)
+
+def test_shrinks_when_chunks_stall():
+    adaptive = AdaptiveChunkSize(log)
+    for n in range(20):
+        adaptive.record(adaptive.size, download_update.CHUNK_LATENCY * 2)
+    assert_equal(adaptive.size, MIN_CHUNK_SIZE)
+
+def test_adaptive_download():
+    payload = os.urandom(3*CHUNK_SIZE + 12345)
+    with FakeCDN({'/installer.exe': payload}) as cdn:
+        filename, digest = download_update.download_update(
+            url=cdn.url('/installer.exe'), download_dir=tmpdir, size=len(payload))
+    with open(filename, 'rb') as f:
+        assert f.read() == payload
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""\
+@file   test_download_update_check_free_space.py
+@brief  Test the free-space preflight and preallocation
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import collections
+import os
+import pytest
+import shutil
+import tempfile
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_update
+import update_manager
+
+PAYLOAD = bytes(range(256)) * 1031 + b'tail'
+PATH = '/Second_Life_Setup.exe'
+
+DiskUsage = collections.namedtuple('DiskUsage', ('total', 'used', 'free'))
+
+def setup_function():
+    global tmpdir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_free_space', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_free_space')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def full_disk(path):
+    return DiskUsage(10**12, 10**12 - 1000, 1000)
+
+def test_preflight_fails_before_network():
+    with FakeCDN({PATH: PAYLOAD}) as cdn, patch(download_update.shutil, 'disk_usage', full_disk):
+        with pytest.raises(download_update.InsufficientSpaceError):
+            download_update.download_update(url=cdn.url(PATH), download_dir=tmpdir,
+                                            size=len(PAYLOAD))
+    assert_equal(cdn.requests, [])
+
+def test_download_gives_up_at_once():
+    checks = []
+    def counting_full_disk(path):
+        checks.append(path)
+        return full_disk(path)
+    with FakeCDN({PATH: PAYLOAD}) as cdn, \
+         patch(download_update.shutil, 'disk_usage', counting_full_disk):
+        with pytest.raises(update_manager.UpdateError):
+            update_manager.download(url=cdn.url(PATH), version='1.2.3', download_dir=tmpdir,
+                                    size=len(PAYLOAD), hash='0', ui=False)
+    assert_equal(cdn.requests, [])
+    # no second or third attempt
+    assert_equal(len(checks), 1)
+
+def test_preallocated_partial_is_not_done():
+    with FakeCDN({PATH: PAYLOAD}) as cdn:
+        cdn.drop[PATH] = 10000
+        with patch(download_update, 'RECONNECTS', 0), pytest.raises(Exception):
+            download_update.download_update(url=cdn.url(PATH), download_dir=tmpdir,
+                                            size=len(PAYLOAD), chunk_size=4096)
+    filename = os.path.join(tmpdir, PATH.lstrip('/'))
+    # preallocated to full size...
+    assert_equal(os.path.getsize(filename), len(PAYLOAD))
+    # ...but nobody mistakes it for a finished download
+    with patch(update_manager, 'sleep', lambda duration: None):
+        assert_equal(update_manager.check_for_completed_download(tmpdir, len(PAYLOAD)), None)
+
+def test_sidecar_before_preallocation():
+    filename = os.path.join(tmpdir, PATH.lstrip('/'))
+    def crash(fd, size):
+        # by now, a full-size file can't be mistaken for a finished one
+        assert download_update.ResumeState.completed_for(filename) == 0
+        raise KeyboardInterrupt
+    with FakeCDN({PATH: PAYLOAD}) as cdn, patch(download_update, 'preallocate', crash), \
+         pytest.raises(KeyboardInterrupt):
+        download_update.download_update(url=cdn.url(PATH), download_dir=tmpdir,
+                                        size=len(PAYLOAD))
+
+def test_unsaved_sidecar_fails():
+    filename = os.path.join(tmpdir, PATH.lstrip('/'))
+    # a directory where the sidecar's temp file would go
+    os.makedirs(filename + download_update.ResumeState.SUFFIX + '.tmp')
+    with FakeCDN({PATH: PAYLOAD}) as cdn, pytest.raises(OSError):
+        download_update.download_update(url=cdn.url(PATH), download_dir=tmpdir,
+                                        size=len(PAYLOAD))
+    # no zero-padded installer
+    assert not os.path.exists(filename)
+
+def test_short_stream_truncated():
+    with FakeCDN({PATH: PAYLOAD}) as cdn:
+        # the VVM overstated the size
+        filename, digest = download_update.download_update(
+            url=cdn.url(PATH), download_dir=tmpdir, size=len(PAYLOAD) + 5000)
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
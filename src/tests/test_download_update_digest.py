@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""\
+@file   test_download_update_digest.py
+@brief  Test hashing downloads on the fly
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import hashlib
+import os
+import shutil
+import tempfile
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch, patch_dict
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_update
+import installer_store
+import update_manager
+
+PAYLOAD = bytes(range(256)) * 1031 + b'tail'
+MD5 = hashlib.md5(PAYLOAD).hexdigest()
+PATH = '/Second_Life_Setup.exe'
+
+def setup_function():
+    global tmpdir, redirects
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_download_digest', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_digest')
+    # Keep update_manager.download() away from the real installer store and
+    # bundle: an installer found there wouldn't be downloaded at all.
+    redirects = [patch(installer_store, 'store_dir', lambda: os.path.join(tmpdir, 'store')),
+                 patch_dict(os.environ, 'SL_UPDATE_BUNDLE', os.path.join(tmpdir, 'bundle'))]
+    for redirect in redirects:
+        redirect.__enter__()
+
+def teardown_function():
+    for redirect in reversed(redirects):
+        redirect.__exit__(None, None, None)
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def no_md5file(fname):
+    raise AssertionError("md5file(%r) should not have been needed" % fname)
+
+def test_single_stream_digest():
+    with FakeCDN({PATH: PAYLOAD}) as cdn:
+        filename, digest = download_update.download_update(
+            url=cdn.url(PATH), download_dir=tmpdir, size=len(PAYLOAD), chunk_size=4096)
+    assert_equal(digest, MD5)
+
+def test_segmented_no_digest():
+    with patch(download_update, 'MIN_SEGMENT_SIZE', 1024), FakeCDN({PATH: PAYLOAD}) as cdn:
+        filename, digest = download_update.download_update(
+            url=cdn.url(PATH), download_dir=tmpdir, size=len(PAYLOAD), chunk_size=4096,
+            segments=2)
+    assert_equal(digest, None)
+
+def test_download_uses_streamed_digest():
+    with FakeCDN({PATH: PAYLOAD}) as cdn, patch(update_manager, 'md5file', no_md5file):
+        filename = update_manager.download(url=cdn.url(PATH), version='1.2.3.4',
+                                           download_dir=os.path.join(tmpdir, '1.2.3.4'),
+                                           size=len(PAYLOAD), hash=MD5, ui=False)
+        # really downloaded
+        assert_equal(len(cdn.requests), 1)
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
+
+def test_download_falls_back_to_md5file():
+    with patch(download_update, 'MIN_SEGMENT_SIZE', 1024), FakeCDN({PATH: PAYLOAD}) as cdn:
+        filename = update_manager.download(url=cdn.url(PATH), version='1.2.3.4',
+                                           download_dir=os.path.join(tmpdir, '1.2.3.4'),
+                                           size=len(PAYLOAD), hash=MD5, ui=False, segments=2)
+        assert len(cdn.requests) > 1, "not downloaded in segments"
+    assert_equal(update_manager.md5file(filename), MD5)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""\
+@file   test_download_update_download_segments.py
+@brief  Test segmented (concurrent Range request) downloads
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import glob
+import os
+import shutil
+import tempfile
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch, patch_dict, DELETE
+
+import monkeypatched
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_update
+
+# deliberately not a multiple of anything interesting
+PAYLOAD = bytes(range(256)) * 1031 + b'tail'
+
+def setup_function():
+    global tmpdir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_download_segments', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_segments')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def ranges_requested(cdn):
+    return sorted(headers['Range'] for path, headers in cdn.requests if 'Range' in headers)
+
+def test_split_ranges():
+    with patch(download_update, 'MIN_SEGMENT_SIZE', 10):
+        assert_equal(download_update.split_ranges(100, 4), [(0, 25), (25, 50), (50, 75), (75, 100)])
+        # never smaller than MIN_SEGMENT_SIZE
+        assert_equal(download_update.split_ranges(25, 4), [(0, 12), (12, 25)])
+        assert_equal(download_update.split_ranges(100, 1), [(0, 100)])
+        # unknown size can't be split
+        assert_equal(download_update.split_ranges(None, 4), [(0, None)])
+
+def test_segmented_download():
+    with patch(download_update, 'MIN_SEGMENT_SIZE', 1024), \
+         FakeCDN({'/Second_Life_Setup.exe': PAYLOAD}) as cdn:
+        filename, digest = download_update.download_update(
+            url=cdn.url('/Second_Life_Setup.exe'), download_dir=tmpdir,
+            size=len(PAYLOAD), chunk_size=4096, segments=4)
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
+    assert_equal(len(ranges_requested(cdn)), 4)
+    assert glob.glob(os.path.join(tmpdir, '*.done'))
+
+def test_segments_from_environment():
+    with patch(download_update, 'MIN_SEGMENT_SIZE', 1024), \
+         patch_dict(os.environ, 'SL_DOWNLOAD_SEGMENTS', '3'), \
+         FakeCDN({'/Second_Life_Setup.exe': PAYLOAD}) as cdn:
+        filename, digest = download_update.download_update(
+            url=cdn.url('/Second_Life_Setup.exe'), download_dir=tmpdir,
+            size=len(PAYLOAD), chunk_size=4096)
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
+    assert_equal(len(ranges_requested(cdn)), 3)
+
+def test_server_ignores_range():
+    with patch(download_update, 'MIN_SEGMENT_SIZE', 1024), \
+         FakeCDN({'/Second_Life_Setup.exe': PAYLOAD}, honor_range=False) as cdn:
+        filename, digest = download_update.download_update(
+            url=cdn.url('/Second_Life_Setup.exe'), download_dir=tmpdir,
+            size=len(PAYLOAD), chunk_size=4096, segments=4)
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
+    # the full-file answer to the first Range request was used as-is
+    assert_equal(len(cdn.requests), 1)
+
+def test_green():
+    # as when SLVersionChecker downloads inline, on the hub's thread
+    output = monkeypatched.run("""
+    import download_update
+    from fake_cdn import FakeCDN
+    os.environ.pop("http_proxy", None)
+    payload = os.urandom(1200000)
+    with patch(download_update, 'MIN_SEGMENT_SIZE', 1024), \\
+         FakeCDN({'/installer.exe': payload}, rate=400000) as cdn, Bystander() as bystander:
+        filename, digest = download_update.download_update(
+            url=cdn.url('/installer.exe'), download_dir=%r, size=len(payload), segments=2)
+    with open(filename, 'rb') as f:
+        print(f.read() == payload, len(cdn.requests), bystander.ticks > 10)
+    """ % tmpdir)
+    assert_equal(output.split(), ['True', '2', 'True'])
@@ -68,10 +68,30 @@ marker_regex = '*' + '.done'
 
 # Mock the requests get module and its response object so that we don't need a real request
 class DummyResponse(object):
+    status_code = 200
+    headers = {}
+
+    def __init__(self):
+        self.raw = DummyRaw(self.iter_content())
+
     def iter_content(self, chunk_size=1, decode_unicode=False):
         return [b'a', b'b', b'c']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+    
+# adaptive chunk sizing reads response.raw directly
+class DummyRaw(object):
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def read(self, amt=None, decode_content=None):
+        return self.chunks.pop(0) if self.chunks else b''
     
-def dummy_get(url, stream=None): # mock for request.get
+def dummy_get(url, stream=None, **kwds): # mock for request.get
     if url != URL:
         raise ValueError("Incorrect URL passed")
     return DummyResponse()
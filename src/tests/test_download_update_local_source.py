@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""\
+@file   test_download_update_local_source.py
+@brief  Test copying installers from file:// URLs and local mirrors
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import errno
+import glob
+import os
+import pathlib
+import shutil
+import tempfile
+from util import SL_Logging, BuildData
+from patch import patch, patch_dict, DELETE
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_update
+
+PAYLOAD = os.urandom(300000)
+
+def setup_function():
+    global tmpdir, share, download_dir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_local_source', verbosity='DEBUG')
+    tmpdir = tempfile.mkdtemp(prefix = 'test_local')
+    share = os.path.join(tmpdir, 'share')
+    os.makedirs(os.path.join(share, 'viewer', '7.1'))
+    with open(os.path.join(share, 'viewer', '7.1', 'Second_Life_Setup.exe'), 'wb') as f:
+        f.write(PAYLOAD)
+    download_dir = os.path.join(tmpdir, 'download')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def check_copied(filename, digest):
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
+    # caller hashes it
+    assert_equal(digest, None)
+    assert glob.glob(os.path.join(download_dir, '*.done'))
+
+def test_file_url():
+    url = pathlib.Path(share, 'viewer', '7.1', 'Second_Life_Setup.exe').as_uri()
+    with patch(download_update, 'LOCAL_COPY_STEP', 65536):
+        check_copied(*download_update.download_update(url=url, download_dir=download_dir,
+                                                      size=len(PAYLOAD)))
+
+def test_local_mirror():
+    url = 'https://cdn.example.com/viewer/7.1/Second_Life_Setup.exe'
+    with patch_dict(os.environ, 'SL_DOWNLOAD_LOCAL_MIRROR', share):
+        check_copied(*download_update.download_update(url=url, download_dir=download_dir,
+                                                      size=len(PAYLOAD)))
+
+def test_shared_target_untouched():
+    # an earlier installer with the same name, hard-linked from the store
+    stored = os.path.join(tmpdir, 'store', 'Second_Life_Setup.exe')
+    os.makedirs(os.path.dirname(stored))
+    with open(stored, 'wb') as f:
+        f.write(b'older installer')
+    os.makedirs(download_dir)
+    os.link(stored, os.path.join(download_dir, 'Second_Life_Setup.exe'))
+    url = pathlib.Path(share, 'viewer', '7.1', 'Second_Life_Setup.exe').as_uri()
+    check_copied(*download_update.download_update(url=url, download_dir=download_dir,
+                                                  size=len(PAYLOAD)))
+    with open(stored, 'rb') as f:
+        assert_equal(f.read(), b'older installer')
+
+def test_local_mirror_miss():
+    with patch_dict(os.environ, 'SL_DOWNLOAD_LOCAL_MIRROR', share):
+        assert_equal(download_update.local_source('https://cdn.example.com/other.exe'), None)
+    with patch_dict(os.environ, 'SL_DOWNLOAD_LOCAL_MIRROR', DELETE):
+        assert_equal(download_update.local_source(
+            'https://cdn.example.com/viewer/7.1/Second_Life_Setup.exe'), None)
+
+def test_zero_copy_fallback():
+    def cross_device(*args):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    source = os.path.join(share, 'viewer', '7.1', 'Second_Life_Setup.exe')
+    target = os.path.join(tmpdir, 'copy')
+    with patch_dict(os.__dict__, 'copy_file_range', cross_device), \
+         patch_dict(os.__dict__, 'sendfile', DELETE), \
+         open(source, 'rb') as src, open(target, 'wb') as dst:
+        steps = list(download_update.zero_copy(src, dst, len(PAYLOAD), step=100000))
+    assert_equal(sum(steps), len(PAYLOAD))
+    with open(target, 'rb') as f:
+        assert f.read() == PAYLOAD
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""\
+@file   test_download_update_resume.py
+@brief  Test resuming interrupted downloads with Range/If-Range
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import glob
+import os
+import pytest
+import shutil
+import tempfile
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_update
+import update_manager
+
+PAYLOAD = bytes(range(256)) * 1031 + b'tail'
+PATH = '/Second_Life_Setup.exe'
+
+def setup_function():
+    global tmpdir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_download_resume', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_resume')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def interrupted_download(cdn, **kwds):
+    """start a download that the fake CDN cuts off partway through"""
+    cdn.drop[PATH] = 100000
+    try:
+        # don't let fetch_segment() quietly reconnect
+        with patch(download_update, 'RECONNECTS', 0):
+            download_update.download_update(url=cdn.url(PATH), download_dir=tmpdir,
+                                            size=len(PAYLOAD), chunk_size=4096, **kwds)
+    except Exception:
+        pass
+    else:
+        raise AssertionError("download_update() survived a dropped connection")
+    filename = os.path.join(tmpdir, PATH.lstrip('/'))
+    completed = download_update.ResumeState.completed_for(filename)
+    assert completed, "no resume state after interrupted download"
+    assert not glob.glob(os.path.join(tmpdir, '*.done'))
+    return filename, completed
+
+def test_resume_single_stream():
+    with FakeCDN({PATH: PAYLOAD}) as cdn:
+        filename, completed = interrupted_download(cdn)
+        del cdn.requests[:]
+        download_update.download_update(url=cdn.url(PATH), download_dir=tmpdir,
+                                        size=len(PAYLOAD), chunk_size=4096)
+    path, headers = cdn.requests[0]
+    assert_equal(headers['Range'], 'bytes=%s-%s' % (completed, len(PAYLOAD) - 1))
+    assert 'If-Range' in headers
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
+    assert_equal(download_update.ResumeState.completed_for(filename), None)
+    assert glob.glob(os.path.join(tmpdir, '*.done'))
+
+def test_resume_segments():
+    with patch(download_update, 'MIN_SEGMENT_SIZE', 1024), FakeCDN({PATH: PAYLOAD}) as cdn:
+        filename, completed = interrupted_download(cdn, segments=2)
+        del cdn.requests[:]
+        download_update.download_update(url=cdn.url(PATH), download_dir=tmpdir,
+                                        size=len(PAYLOAD), chunk_size=4096, segments=2)
+    # nothing we already had was fetched again
+    starts = [int(headers['Range'][len('bytes='):].split('-')[0])
+              for path, headers in cdn.requests]
+    assert 0 not in starts, "resumed download started over: %s" % starts
+    assert any(headers.get('If-Range') for path, headers in cdn.requests)
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
+
+def test_resume_changed_file():
+    changed = PAYLOAD[::-1]
+    with FakeCDN({PATH: PAYLOAD}) as cdn:
+        filename, completed = interrupted_download(cdn)
+        # the file changed on the server: If-Range gets the whole thing
+        cdn.files[PATH] = changed
+        download_update.download_update(url=cdn.url(PATH), download_dir=tmpdir,
+                                        size=len(changed), chunk_size=4096)
+    with open(filename, 'rb') as f:
+        assert f.read() == changed
+
+def test_check_for_completed_download_keeps_resumable():
+    with FakeCDN({PATH: PAYLOAD}) as cdn:
+        filename, completed = interrupted_download(cdn)
+    with patch(update_manager, 'sleep', lambda duration: None):
+        assert_equal(update_manager.check_for_completed_download(tmpdir, len(PAYLOAD)), None)
+    assert os.path.exists(filename), "partial download deleted"
+
+def test_resume_error_status_keeps_state():
+    with FakeCDN({PATH: PAYLOAD}) as cdn:
+        filename, completed = interrupted_download(cdn)
+        # a transient error mustn't throw away what we have...
+        del cdn.files[PATH]
+        with pytest.raises(download_update.SegmentError):
+            download_update.download_update(url=cdn.url(PATH), download_dir=tmpdir,
+                                            size=len(PAYLOAD), chunk_size=4096)
+        assert_equal(download_update.ResumeState.completed_for(filename), completed)
+        # ...nor end up in the file
+        with open(filename, 'rb') as f:
+            assert f.read(completed) == PAYLOAD[:completed]
+        cdn.files[PATH] = PAYLOAD
+        del cdn.requests[:]
+        download_update.download_update(url=cdn.url(PATH), download_dir=tmpdir,
+                                        size=len(PAYLOAD), chunk_size=4096)
+    path, headers = cdn.requests[0]
+    assert_equal(headers['Range'], 'bytes=%s-%s' % (completed, len(PAYLOAD) - 1))
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
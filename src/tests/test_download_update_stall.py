@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""\
+@file   test_download_update_stall.py
+@brief  Test recovering from stalled and dropped connections mid-download
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import os
+import pytest
+import shutil
+import tempfile
+import time
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch, patch_dict
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_update
+
+PAYLOAD = bytes(range(256)) * 1031 + b'tail'
+PATH = '/Second_Life_Setup.exe'
+
+def setup_function():
+    global tmpdir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_download_stall', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_stall')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def download(cdn, **kwds):
+    filename, digest = download_update.download_update(
+        url=cdn.url(PATH), download_dir=tmpdir, size=len(PAYLOAD), chunk_size=4096, **kwds)
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
+    return digest
+
+def test_read_timeout_reconnects():
+    with patch_dict(os.environ, 'SL_DOWNLOAD_READ_TIMEOUT', '1'), FakeCDN({PATH: PAYLOAD}) as cdn:
+        cdn.stall[PATH] = (100000, 10)
+        start = time.monotonic()
+        digest = download(cdn)
+    # well before the server would have woken up
+    assert time.monotonic() - start < 8
+    # resumed from (about) where the stall left off, not from scratch
+    resumed = int(cdn.requests[-1][1]['Range'][len('bytes='):].split('-')[0])
+    assert 100000 - 4096 < resumed <= 100000
+    # bytes stayed in order, so the streaming digest is still good
+    assert_equal(digest, download_update.hashing.hash_file(
+        os.path.join(tmpdir, PATH.lstrip('/')))['md5'])
+
+def test_dropped_connection_reconnects():
+    with patch(download_update, 'MIN_SEGMENT_SIZE', 1024), FakeCDN({PATH: PAYLOAD}) as cdn:
+        cdn.drop[PATH] = 10000
+        download(cdn, segments=2)
+
+def test_reconnects_give_up():
+    with patch(download_update, 'RECONNECTS', 0), FakeCDN({PATH: PAYLOAD}) as cdn:
+        cdn.drop[PATH] = 10000
+        with pytest.raises(download_update.SegmentError):
+            download(cdn)
+
+def test_watchdog_throughput_floor():
+    now = [0.0]
+    with patch(download_update, 'MIN_THROUGHPUT', 1000), \
+         patch(download_update, 'STALL_WINDOW', 10):
+        watchdog = download_update.StallWatchdog(clock=lambda: now[0])
+    for n in range(10):
+        now[0] += 1
+        watchdog.check(2000)
+    # a fresh window: a trickle now fails
+    for n in range(9):
+        now[0] += 1
+        watchdog.check(100)
+    now[0] += 1
+    with pytest.raises(download_update.DownloadStalled):
+        watchdog.check(100)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""\
+@file   test_download_update_write_behind.py
+@brief  Test the reader/writer pipeline between the socket and the disk
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import os
+import pytest
+import shutil
+import tempfile
+import threading
+import time
+import util
+from util import SL_Logging, BuildData
+from patch import patch
+
+import monkeypatched
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_update
+
+CHUNKS = [bytes([n]) * 1000 for n in range(20)]
+
+def setup_function():
+    global tmpdir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_write_behind', verbosity='DEBUG')
+    tmpdir = tempfile.mkdtemp(prefix = 'test_write_behind')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def test_bounded():
+    readers = set()
+    def received(nbytes):
+        readers.add(threading.current_thread())
+    # a real reader thread, even if some other test module has monkeypatched
+    with patch(util, 'on_hub', lambda: False), \
+         download_update.WriteBehind(iter(CHUNKS), received, limit=2500) as pipe:
+        out = []
+        for chunk in pipe:
+            # a slow disk
+            time.sleep(0.005)
+            out.append(chunk)
+    assert_equal(out, CHUNKS)
+    assert pipe.peak <= 2500, pipe.peak
+    # the reader got ahead of us, and then had to wait for us
+    assert pipe.peak > 1000, pipe.peak
+    assert pipe.reader_waited > 0
+    assert threading.current_thread() not in readers
+
+def test_error_after_chunks():
+    def chunks():
+        yield CHUNKS[0]
+        yield CHUNKS[1]
+        raise download_update.DownloadStalled("trickle")
+    out = []
+    with pytest.raises(download_update.DownloadStalled):
+        with download_update.WriteBehind(chunks(), limit=2500) as pipe:
+            for chunk in pipe:
+                out.append(chunk)
+    # everything that arrived before the stall still gets written
+    assert_equal(out, CHUNKS[:2])
+
+def test_abandoned():
+    with download_update.WriteBehind(iter(CHUNKS), limit=1000) as pipe:
+        for chunk in pipe:
+            break
+    pipe.thread.join(5)
+    assert not pipe.thread.is_alive()
+
+def test_unbuffered():
+    readers = set()
+    with download_update.WriteBehind(iter(CHUNKS), lambda n: readers.add(threading.current_thread()),
+                                     limit=0) as pipe:
+        assert_equal(list(pipe), CHUNKS)
+    assert_equal(pipe.thread, None)
+    assert_equal(readers, {threading.current_thread()})
+
+def test_green():
+    # as when SLVersionChecker downloads inline, on the hub's thread
+    output = monkeypatched.run("""
+    import download_update
+    from fake_cdn import FakeCDN
+    tmpdir = %r
+    os.environ.pop("http_proxy", None)
+    payload = os.urandom(600000)
+    with FakeCDN({'/installer.exe': payload}, rate=400000) as cdn, Bystander() as bystander:
+        filename, digest = download_update.download_update(
+            url=cdn.url('/installer.exe'), download_dir=tmpdir, size=len(payload), segments=1)
+    with open(filename, 'rb') as f:
+        print(f.read() == payload, bystander.ticks > 10)
+    """ % tmpdir)
+    assert_equal(output.split(), ['True', 'True'])
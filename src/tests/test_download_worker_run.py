@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""\
+@file   test_download_worker_run.py
+@brief  Test the detached background downloader and its status file
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch, patch_dict
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_worker
+import installer_store
+import update_manager
+
+PAYLOAD = bytes(range(256)) * 1031 + b'tail'
+PATH = '/Second_Life_Setup.exe'
+
+def setup_function():
+    global tmpdir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_download_worker', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_worker')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def make_result(cdn, hash=hashlib.md5(PAYLOAD).hexdigest()):
+    return dict(url=cdn.url(PATH), version='4.0.6.999999', size=len(PAYLOAD), hash=hash,
+                required=False)
+
+class FakePopen(object):
+    def __init__(self, command, **kwds):
+        FakePopen.command = command
+        FakePopen.kwds = kwds
+
+def test_spawn():
+    with FakeCDN({PATH: PAYLOAD}) as cdn, patch(download_worker.subprocess, 'Popen', FakePopen):
+        download_worker.spawn(make_result(cdn), tmpdir, segments=2, rate_limit='25%')
+    assert_equal(FakePopen.command[-2:], ['download', os.path.join(tmpdir, 'download.job')])
+    assert FakePopen.kwds.get('start_new_session') or FakePopen.kwds.get('creationflags')
+    with open(os.path.join(tmpdir, 'download.job')) as f:
+        job = json.load(f)
+    assert_equal(job['options'], dict(segments=2, rate_limit='25%'))
+    # the download is claimed before the worker even starts
+    assert_equal(download_worker.read_status(tmpdir)['state'], 'downloading')
+    with patch(update_manager, 'sleep', lambda duration: 1/0):
+        assert_equal(update_manager.check_for_completed_download(tmpdir, len(PAYLOAD)), 'skip')
+
+def test_run():
+    with FakeCDN({PATH: PAYLOAD}) as cdn, patch(download_worker.subprocess, 'Popen', FakePopen), \
+         patch(installer_store, 'store_dir', lambda: os.path.join(tmpdir, 'store')), \
+         patch_dict(os.environ, 'SL_UPDATE_BUNDLE', os.path.join(tmpdir, 'bundle')):
+        download_worker.spawn(make_result(cdn), tmpdir)
+        assert_equal(download_worker.run(FakePopen.command[-1]), 0)
+    status = download_worker.read_status(tmpdir)
+    assert_equal(status['state'], 'done')
+    assert_equal(status['completed'], len(PAYLOAD))
+    with open(status['installer'], 'rb') as f:
+        assert f.read() == PAYLOAD
+    assert_equal(update_manager.check_for_completed_download(tmpdir, len(PAYLOAD)), 'done')
+
+def test_run_failed():
+    with FakeCDN({PATH: PAYLOAD}) as cdn, patch(download_worker.subprocess, 'Popen', FakePopen), \
+         patch(installer_store, 'store_dir', lambda: os.path.join(tmpdir, 'store')), \
+         patch_dict(os.environ, 'SL_UPDATE_BUNDLE', os.path.join(tmpdir, 'bundle')):
+        download_worker.spawn(make_result(cdn, hash='0'*32), tmpdir)
+        assert_equal(download_worker.run(FakePopen.command[-1]), 1)
+    status = download_worker.read_status(tmpdir)
+    assert_equal(status['state'], 'failed')
+    assert 'UpdateError' in status['error']
+
+def test_stale_status():
+    download_worker.write_status(tmpdir, state='downloading', completed=5, size=10)
+    assert_equal(download_worker.read_status(tmpdir)['state'], 'downloading')
+    real_time = time.time
+    with patch(download_worker.time, 'time', lambda: real_time() + download_worker.STALE_STATUS + 1):
+        assert_equal(download_worker.read_status(tmpdir)['state'], 'dead')
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""\
+@file   test_gpu_rules_match.py
+@brief  Test the Windows 64-bit compatibility rules
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import json
+import os
+import shutil
+import tempfile
+from util import SL_Logging, BuildData
+from patch import patch
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import gpu_rules
+
+# CPU name: the rule that should flag it, or None
+CPUS = [
+    ('Intel(R) Core(TM) i7-2600 CPU @ 3.40GHz', 'Intel HD 2000/3000'),
+    ('Intel(R) Xeon(R) CPU E3-1260L @ 2.40GHz', 'Intel HD 2000/3000'),
+    ('Intel(R) Core(TM) i5-520M CPU @ 2.40GHz', 'Intel HD Graphics'),
+    ('Intel(R) Pentium(R) CPU G630 @ 2.70GHz', 'Intel 2nd Generation'),
+    ('Intel(R) Celeron(R) CPU 1007U @ 1.50GHz', '3rd Generation'),
+    ('Intel(R) Pentium(R) CPU G3220 @ 3.00GHz', 'Intel HD Graphics for 4th Generation'),
+    ('Intel64 Family 6 Model 58 Stepping 9, GenuineIntel', 'unrecognized Intel64 Family CPU'),
+    ('Intel(R) Core(TM) i5-6600K CPU @ 3.50GHz', None),
+    ('Intel(R) Core(TM) i7-3770 CPU @ 3.40GHz', None),
+    ('AMD Ryzen 7 5800X 8-Core Processor', None),
+]
+
+# video card name: classification
+CARDS = [
+    ('NVIDIA GeForce GTS 450', gpu_rules.GOOD),
+    ('Intel(R) HD Graphics 530', gpu_rules.GOOD),
+    ('Intel(R) HD Graphics 2000', gpu_rules.BAD),
+    ('Intel(R) HD Graphics 3000', gpu_rules.BAD),
+    ('Intel(R) HD Graphics', gpu_rules.CHECK_CPU),
+]
+
+def setup_function():
+    global tmpdir, saved
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_gpu_rules', verbosity='DEBUG')
+    tmpdir = tempfile.mkdtemp(prefix = 'test_gpu_rules')
+    saved = patch(gpu_rules, 'saved_path', lambda: os.path.join(tmpdir, gpu_rules.RULES_FILE))
+    saved.__enter__()
+    gpu_rules._rules = None
+
+def teardown_function():
+    saved.__exit__(None, None, None)
+    gpu_rules._rules = None
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def bundled():
+    with open(gpu_rules.bundled_path()) as f:
+        return json.load(f)
+
+def test_cpu_table():
+    rules = gpu_rules.load()
+    for cpu, expected in CPUS:
+        assert rules.match_cpu(cpu) == expected, cpu
+
+def test_card_table():
+    rules = gpu_rules.load()
+    for card, expected in CARDS:
+        assert rules.classify(card) == expected, card
+
+def test_refresh():
+    data = bundled()
+    data['version'] += 1
+    data['cpu'].append(dict(name='Ryzen', pattern=r'Ryzen\s7'))
+    gpu_rules.refresh(data)
+    # not this run...
+    assert_equal(gpu_rules.load().match_cpu('AMD Ryzen 7 5800X 8-Core Processor'), None)
+    # ...but the next
+    gpu_rules._rules = None
+    assert_equal(gpu_rules.load().version, data['version'])
+    assert_equal(gpu_rules.load().match_cpu('AMD Ryzen 7 5800X 8-Core Processor'), 'Ryzen')
+
+def test_refresh_rejected():
+    # not newer
+    gpu_rules.refresh(bundled())
+    # garbled
+    data = bundled()
+    data['version'] += 1
+    data['cpu'].append(dict(name='broken', pattern='(unbalanced'))
+    gpu_rules.refresh(data)
+    assert not os.path.exists(gpu_rules.saved_path())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""\
+@file   test_hashing_hash_file.py
+@brief  Test single-pass multi-algorithm file hashing
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import hashlib
+import os
+import tempfile
+import threading
+from eventlet import patcher
+from patch import patch
+import hashing
+
+ALGORITHMS = ('md5', 'sha256', 'blake2b')
+# odd length, so the last buffer is always partial
+DATA = os.urandom(3*1024*1024 + 17)
+
+def setup_function():
+    global fname
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(DATA)
+    fname = f.name
+
+def teardown_function():
+    os.remove(fname)
+
+def expected(data):
+    return {name: hashlib.new(name, data).hexdigest() for name in ALGORITHMS}
+
+def test_strategies_agree():
+    for strategy in hashing.STRATEGIES:
+        for buffer_size in (4096, 65536, 1024*1024):
+            assert_equal(hashing.hash_file(fname, ALGORITHMS, strategy, buffer_size),
+                         expected(DATA))
+
+def test_default_strategy():
+    assert_equal(hashing.hash_file(fname), {'md5': hashlib.md5(DATA).hexdigest()})
+
+def test_empty_file():
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        pass
+    try:
+        for strategy in hashing.STRATEGIES:
+            assert_equal(hashing.hash_file(f.name, ALGORITHMS, strategy), expected(b''))
+    finally:
+        os.remove(f.name)
+
+def test_bad_strategy():
+    try:
+        hashing.hash_file(fname, strategy='telepathy')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("hash_file() accepted a bogus strategy")
+
+def hashed_on():
+    """the thread on which hash_file() runs, as if under SLVersionChecker"""
+    threads = []
+    real = hashing._hash_file
+    def _hash_file(*args):
+        threads.append(threading.current_thread())
+        return real(*args)
+    with patch(hashing, '_hash_file', _hash_file), \
+         patch(patcher, 'is_monkey_patched', lambda module: module != 'thread'):
+        assert_equal(hashing.hash_file(fname), {'md5': hashlib.md5(DATA).hexdigest()})
+    return threads[0]
+
+def test_offload_from_hub():
+    assert hashed_on() is not threading.main_thread()
+
+def test_no_offload_from_thread():
+    threads = []
+    thread = threading.Thread(target=lambda: threads.append(hashed_on()))
+    thread.start()
+    thread.join()
+    assert threads[0] is thread
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""\
+@file   test_installer_store_fetch.py
+@brief  Test sharing verified installers among download directories
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch, patch_dict
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import installer_store
+import update_manager
+
+PAYLOAD = os.urandom(100000)
+HASH = hashlib.md5(PAYLOAD).hexdigest()
+PATH = '/Second_Life_7_1_4.exe'
+
+def setup_function():
+    global tmpdir, store
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_installer_store', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_store')
+    store = patch(installer_store, 'store_dir', lambda: os.path.join(tmpdir, 'store'))
+    store.__enter__()
+
+def teardown_function():
+    store.__exit__(None, None, None)
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def download(cdn, version):
+    download_dir = os.path.join(tmpdir, version)
+    os.makedirs(download_dir)
+    return update_manager.download(url=cdn.url(PATH), version=version, download_dir=download_dir,
+                                   size=len(PAYLOAD), hash=HASH, ui=False)
+
+def test_download_once():
+    with FakeCDN({PATH: PAYLOAD}) as cdn:
+        first = download(cdn, '7.1.4.100')
+        fetched = len(cdn.requests)
+        # say, the Beta viewer wants the same installer
+        second = download(cdn, '7.1.4.100-beta')
+        assert_equal(len(cdn.requests), fetched)
+    with open(second, 'rb') as f:
+        assert f.read() == PAYLOAD
+    assert_equal(os.stat(second).st_ino, os.stat(first).st_ino)
+    assert glob.glob(os.path.join(os.path.dirname(second), '*.done'))
+    # removing a version directory leaves the stored copy
+    shutil.rmtree(os.path.dirname(first))
+    shutil.rmtree(os.path.dirname(second))
+    assert os.path.exists(os.path.join(tmpdir, 'store', HASH))
+
+def test_evict():
+    os.makedirs(os.path.join(tmpdir, 'installers'))
+    hashes = []
+    for n in range(3):
+        content = bytes([n]) * 1000
+        hash = hashlib.md5(content).hexdigest()
+        hashes.append(hash)
+        installer = os.path.join(tmpdir, 'installers', hash)
+        with open(installer, 'wb') as f:
+            f.write(content)
+        os.utime(installer, (n * 100, n * 100))
+        with patch_dict(os.environ, 'SL_DOWNLOAD_STORE_BUDGET', '2500'):
+            installer_store.add(installer, hash)
+        os.utime(installer, (n * 100, n * 100))
+    # the least recently used went
+    assert_equal(sorted(os.listdir(os.path.join(tmpdir, 'store'))), sorted(hashes[1:]))
+    # and using one makes it the most recent
+    download_dir = os.path.join(tmpdir, 'download')
+    os.makedirs(download_dir)
+    assert installer_store.fetch(hashes[1], download_dir, 'Second_Life.exe')
+    with patch_dict(os.environ, 'SL_DOWNLOAD_STORE_BUDGET', '1500'):
+        installer_store.evict(installer_store.budget())
+    assert_equal(os.listdir(os.path.join(tmpdir, 'store')), [hashes[1]])
+
+def test_corrupt_entry():
+    with FakeCDN({PATH: PAYLOAD}) as cdn:
+        first = download(cdn, '7.1.4.100')
+        fetched = len(cdn.requests)
+        # e.g. something wrote through a hard link
+        with open(os.path.join(tmpdir, 'store', HASH), 'r+b') as f:
+            f.write(b'garbage')
+        second = download(cdn, '7.1.4.100-beta')
+        # not served from the store: fetched again
+        assert len(cdn.requests) > fetched
+    with open(second, 'rb') as f:
+        assert f.read() == PAYLOAD
+
+def test_disabled():
+    installer = os.path.join(tmpdir, 'installer')
+    with open(installer, 'wb') as f:
+        f.write(PAYLOAD)
+    with patch_dict(os.environ, 'SL_DOWNLOAD_STORE_BUDGET', '0'):
+        installer_store.add(installer, HASH)
+    assert not os.path.exists(os.path.join(tmpdir, 'store'))
+    # nor does anything not a hash get in
+    installer_store.add(installer, '../../etc')
+    assert not os.path.exists(os.path.join(tmpdir, 'store'))
+    assert not os.path.exists(os.path.join(tmpdir, '..', 'etc'))
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""\
+@file   test_lan_cache_serve.py
+@brief  Test the caching proxy for the update service and its installers
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import hashlib
+import llsd
+import os
+import pytest
+import requests
+import shutil
+import tempfile
+import threading
+from llbase import llrest
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_update
+import lan_cache
+
+PAYLOAD = os.urandom(300000)
+HASH = hashlib.md5(PAYLOAD).hexdigest()
+QUERY = '/update/v1.2/Second%20Life%20Release/7.1.4/win64'
+INSTALLER = '/viewer/Second_Life_7_1_4.exe'
+
+def setup_function():
+    global tmpdir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_lan_cache', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_lan_cache')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+class Proxy(object):
+    def __init__(self, cdn, hash=HASH):
+        cdn.files[QUERY] = llsd.format_xml(
+            dict(required=False, version='7.1.4.999999',
+                 platforms=dict(win64=dict(url=cdn.url(INSTALLER), hash=hash,
+                                           size=len(PAYLOAD)))))
+        self.server = lan_cache.make_server(os.path.join(tmpdir, 'cache'),
+                                            cdn.url('/update'), 'localhost', 0)
+        self.base = 'http://localhost:%s' % self.server.server_port
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def query(self):
+        # just as query_vvm() would, with SL_UPDATE_SERVICE pointing here
+        service = llrest.SimpleRESTService(name='VVM', baseurl=self.base)
+        return service.get(QUERY[len('/update/'):])['platforms']['win64']
+
+def test_serve():
+    with FakeCDN({INSTALLER: PAYLOAD}) as cdn, Proxy(cdn) as proxy:
+        result = proxy.query()
+        assert_equal(result['url'], '%s/installer/%s/Second_Life_7_1_4.exe' % (proxy.base, HASH))
+        # the CDN remains a fallback
+        assert_equal(result['mirrors'], [cdn.url(INSTALLER)])
+        for seat in 'one', 'two', 'three':
+            filename, digest = download_update.download_update(
+                url=result['url'], download_dir=os.path.join(tmpdir, seat), size=len(PAYLOAD))
+            with open(filename, 'rb') as f:
+                assert f.read() == PAYLOAD
+        # resuming clients get what they ask for
+        response = requests.get(result['url'], headers={'Range': 'bytes=1000-1999'})
+        assert_equal(response.status_code, 206)
+        assert response.content == PAYLOAD[1000:2000]
+    # the CDN served the installer just once
+    assert_equal([path for path, headers in cdn.requests if path == INSTALLER], [INSTALLER])
+
+def test_bad_hash():
+    with FakeCDN({INSTALLER: PAYLOAD}) as cdn, Proxy(cdn, hash='0'*32) as proxy:
+        result = proxy.query()
+        # the client is cut off before the end...
+        with pytest.raises(download_update.SegmentError):
+            download_update.download_update(
+                url=result['url'], download_dir=os.path.join(tmpdir, 'seat'), size=len(PAYLOAD))
+        # ...and the proxy doesn't keep the bad copy: each retry fetched it anew
+        assert not os.path.exists(os.path.join(tmpdir, 'cache', '0'*32, lan_cache.VERIFIED))
+    assert len([path for path, headers in cdn.requests if path == INSTALLER]) > 1
+
+def test_serve_while_fetching():
+    # slow enough that the clients read the cached file as it grows
+    with FakeCDN({INSTALLER: PAYLOAD}, rate=len(PAYLOAD)) as cdn, Proxy(cdn) as proxy:
+        result = proxy.query()
+        received = {}
+        def client(seat):
+            filename, digest = download_update.download_update(
+                url=result['url'], download_dir=os.path.join(tmpdir, seat), size=len(PAYLOAD),
+                chunk_size=4096)
+            with open(filename, 'rb') as f:
+                received[seat] = f.read()
+        clients = [threading.Thread(target=client, args=(seat,)) for seat in ('one', 'two')]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+    for seat, data in received.items():
+        assert data == PAYLOAD, seat
+    assert_equal(len(received), 2)
+
+def test_learn_atomic():
+    cache = lan_cache.InstallerCache(os.path.join(tmpdir, 'cache'), None)
+    record = dict(url='https://cdn/' + 'x'*10000, hash=HASH, size=len(PAYLOAD))
+    cache.learn(record)
+    stop = threading.Event()
+    def relearn():
+        while not stop.is_set():
+            cache.learn(record)
+    threads = [threading.Thread(target=relearn) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    try:
+        for n in range(500):
+            assert_equal(cache.lookup(HASH), record)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert_equal(os.listdir(os.path.join(tmpdir, 'cache')), [HASH + '.json'])
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""\
+@file   test_machine_id_get.py
+@brief  Test caching the hashed machine id
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from util import SL_Logging
+from patch import patch, patch_dict
+
+import machine_id
+
+HASH = '0123456789abcdef0123456789abcdef'
+
+class Probe(object):
+    def __init__(self, answer=HASH):
+        self.answer = answer
+        self.calls = 0
+        self.called = threading.Event()
+
+    def __call__(self, platform_key):
+        self.calls += 1
+        self.called.set()
+        return self.answer
+
+def setup_function():
+    global tmpdir, cache
+    SL_Logging.getLogger('test_machine_id', verbosity='DEBUG')
+    tmpdir = tempfile.mkdtemp(prefix = 'test_machine_id')
+    cache = patch(machine_id, 'cache_path', lambda: os.path.join(tmpdir, machine_id.CACHE_FILE))
+    cache.__enter__()
+
+def teardown_function():
+    cache.__exit__(None, None, None)
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def test_cached():
+    probe = Probe()
+    assert_equal(machine_id.get('lnx', probe), HASH)
+    assert_equal(machine_id.get('lnx', probe), HASH)
+    assert_equal(probe.calls, 1)
+
+def test_invalidated():
+    probe = Probe()
+    machine_id.get('lnx', probe)
+    with patch(machine_id.platform, 'node', lambda: 'newhost'):
+        machine_id.get('lnx', probe)
+    assert_equal(probe.calls, 2)
+
+def test_failed_probe_reuses():
+    machine_id.get('lnx', Probe())
+    with patch(machine_id.platform, 'node', lambda: 'newhost'):
+        assert_equal(machine_id.get('lnx', Probe(None)), HASH)
+
+def test_dummy_stable():
+    first = machine_id.get('lnx', Probe(None))
+    assert first
+    # later launches keep the same dummy, while trying for a real one
+    # in the background
+    probe = Probe(None)
+    assert_equal(machine_id.get('lnx', probe), first)
+    assert probe.called.wait(5)
+    probe = Probe()
+    assert_equal(machine_id.get('lnx', probe), first)
+    assert probe.called.wait(5)
+    for wait in range(50):
+        if machine_id.load()['hash'] == HASH:
+            break
+        time.sleep(0.1)
+    assert_equal(machine_id.get('lnx', Probe(None)), HASH)
+
+def test_refresh():
+    machine_id.get('lnx', Probe())
+    probe = Probe('fedcba9876543210fedcba9876543210')
+    # no refresh unless asked
+    machine_id.get('lnx', probe)
+    assert_equal(probe.calls, 0)
+    with patch_dict(os.environ, 'SL_MACHINE_ID_REFRESH', '60'), \
+         patch(machine_id.time, 'time', lambda: time.monotonic() + 1e10):
+        # this launch still gets the cached id
+        assert_equal(machine_id.get('lnx', probe), HASH)
+        assert probe.called.wait(5)
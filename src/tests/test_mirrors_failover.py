@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""\
+@file   test_mirrors_failover.py
+@brief  Test mirror ranking and switching mirrors mid-download
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import os
+import shutil
+import tempfile
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch, patch_dict
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_update
+import mirrors
+
+PAYLOAD = bytes(range(256)) * 1031 + b'tail'
+PATH = '/Second_Life_Setup.exe'
+
+def setup_function():
+    global tmpdir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_mirrors', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_mirrors')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def test_from_result():
+    result = dict(url='https://cdn/v1/Setup.exe',
+                  mirrors=['https://m1/v1/Setup.exe', 'https://cdn/v1/Setup.exe'])
+    assert_equal(mirrors.from_result(result, 'https://lan/cache/, https://m1/v1'),
+                 ['https://m1/v1/Setup.exe', 'https://lan/cache/Setup.exe'])
+    assert_equal(mirrors.from_result(dict(url='https://cdn/Setup.exe')), [])
+
+def test_rank():
+    with FakeCDN({PATH: PAYLOAD}, rate=64*1024) as slow, FakeCDN({PATH: PAYLOAD}) as fast:
+        ranked = mirrors.rank([slow.url(PATH), 'http://localhost:1/nothing', fast.url(PATH)],
+                              probe_bytes=32*1024)
+    assert_equal(ranked, [fast.url(PATH), slow.url(PATH), 'http://localhost:1/nothing'])
+
+def test_failover():
+    with patch_dict(os.environ, 'SL_DOWNLOAD_READ_TIMEOUT', '1'), \
+         FakeCDN({PATH: PAYLOAD}) as primary, FakeCDN({PATH: PAYLOAD}) as mirror:
+        # no probing: both look the same, so the primary goes first
+        primary.stall[PATH] = (100000, 10)
+        with patch(mirrors, 'rank', lambda urls: urls):
+            filename, digest = download_update.download_update(
+                url=primary.url(PATH), download_dir=tmpdir, size=len(PAYLOAD),
+                chunk_size=4096, mirror_urls=[mirror.url(PATH)])
+    with open(filename, 'rb') as f:
+        assert f.read() == PAYLOAD
+    # the mirror picked up where the primary stalled, without If-Range
+    # (its validators are the primary's business)
+    assert_equal(len(mirror.requests), 1)
+    path, headers = mirror.requests[0]
+    assert int(headers['Range'][len('bytes='):].split('-')[0]) > 0
+    assert 'If-Range' not in headers
+
+def test_failover_once():
+    mirror_list = mirrors.MirrorList(['a', 'b', 'c'])
+    # two threads notice 'a' is bad: only one switch
+    assert_equal(mirror_list.failover('a'), 'b')
+    assert_equal(mirror_list.failover('a'), 'b')
+    assert_equal(mirror_list.failover('b'), 'c')
+    assert_equal(mirror_list.failover('c'), 'a')
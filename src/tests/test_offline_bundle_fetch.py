@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""\
+@file   test_offline_bundle_fetch.py
+@brief  Test installing from a pre-seeded bundle directory
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch, patch_dict
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import hashing
+import installer_store
+import offline_bundle
+import update_manager
+
+PAYLOAD = os.urandom(100000)
+HASH = hashlib.md5(PAYLOAD).hexdigest()
+PATH = '/Second_Life_7_1_4.exe'
+
+def setup_function():
+    global tmpdir, bundle, env, store
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_offline_bundle', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_bundle')
+    bundle = os.path.join(tmpdir, 'bundle')
+    os.makedirs(bundle)
+    for name, content in (('Second_Life_7_1_3.exe', os.urandom(1000)),
+                          ('Second_Life_7_1_4.exe', PAYLOAD)):
+        with open(os.path.join(bundle, name), 'wb') as f:
+            f.write(content)
+    env = patch_dict(os.environ, 'SL_UPDATE_BUNDLE', bundle)
+    env.__enter__()
+    store = patch(installer_store, 'store_dir', lambda: os.path.join(tmpdir, 'store'))
+    store.__enter__()
+
+def teardown_function():
+    store.__exit__(None, None, None)
+    env.__exit__(None, None, None)
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def download(version):
+    download_dir = os.path.join(tmpdir, version)
+    os.makedirs(download_dir)
+    # nothing answers at this URL: the bundle had better have it
+    return update_manager.download(url='http://localhost:1' + PATH, version=version,
+                                   download_dir=download_dir, size=len(PAYLOAD),
+                                   hash=HASH, ui=False)
+
+def test_bundled():
+    installer = download('7.1.4.100')
+    with open(installer, 'rb') as f:
+        assert f.read() == PAYLOAD
+    assert glob.glob(os.path.join(os.path.dirname(installer), '*.done'))
+    assert_equal(offline_bundle.read_index(bundle)[HASH]['file'], 'Second_Life_7_1_4.exe')
+
+def test_index_reused():
+    offline_bundle.build_index(bundle)
+    # with the index current, nothing need be hashed
+    def hash_file(*args, **kwds):
+        raise AssertionError("hashed %s" % (args,))
+    with patch(hashing, 'hash_file', hash_file):
+        assert download('7.1.4.100')
+
+def test_new_file_indexed():
+    offline_bundle.build_index(bundle)
+    other = os.urandom(2000)
+    with open(os.path.join(bundle, 'Second_Life_7_1_5.exe'), 'wb') as f:
+        f.write(other)
+    # as if the new file arrived well after the index was written
+    later = time.time() + 2*offline_bundle.SLACK
+    os.utime(bundle, (later, later))
+    hashed = []
+    real_hash_file = hashing.hash_file
+    def hash_file(fname, *args, **kwds):
+        hashed.append(os.path.basename(fname))
+        return real_hash_file(fname, *args, **kwds)
+    download_dir = os.path.join(tmpdir, '7.1.5.100')
+    os.makedirs(download_dir)
+    with patch(hashing, 'hash_file', hash_file):
+        assert offline_bundle.fetch(hashlib.md5(other).hexdigest(), len(other),
+                                    download_dir, 'Second_Life_7_1_5.exe')
+    # only the new one
+    assert_equal(hashed, ['Second_Life_7_1_5.exe'])
+
+def test_replaced_in_place():
+    offline_bundle.build_index(bundle)
+    # same name, different content, directory untouched
+    with open(os.path.join(bundle, 'Second_Life_7_1_4.exe'), 'wb') as f:
+        f.write(os.urandom(len(PAYLOAD)))
+    os.utime(os.path.join(bundle, 'Second_Life_7_1_4.exe'), (1, 1))
+    download_dir = os.path.join(tmpdir, '7.1.4.100')
+    os.makedirs(download_dir)
+    assert_equal(offline_bundle.fetch(HASH, len(PAYLOAD), download_dir, 'x.exe'), None)
+    assert HASH not in offline_bundle.read_index(bundle)
+
+def test_no_bundle():
+    with FakeCDN({PATH: PAYLOAD}) as cdn, \
+         patch_dict(os.environ, 'SL_UPDATE_BUNDLE', os.path.join(tmpdir, 'nonesuch')):
+        download_dir = os.path.join(tmpdir, '7.1.4.100')
+        os.makedirs(download_dir)
+        installer = update_manager.download(url=cdn.url(PATH), version='7.1.4.100',
+                                            download_dir=download_dir, size=len(PAYLOAD),
+                                            hash=HASH, ui=False)
+        assert cdn.requests
+    with open(installer, 'rb') as f:
+        assert f.read() == PAYLOAD
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""\
+@file   test_rate_limit_limiter.py
+@brief  Test the background download bandwidth limiter
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import os
+import pytest
+import shutil
+import tempfile
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch, patch_dict
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_update
+import rate_limit
+
+class FakeClock(object):
+    """time.monotonic() and time.sleep() stand-ins: sleeping advances time"""
+    def __init__(self):
+        self.now = 100.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.slept += duration
+        self.now += duration
+
+def setup_function():
+    global tmpdir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_rate_limit', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_rate_limit')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def test_limiter_parsing():
+    for none in (None, '', 0, '0', '100%'):
+        assert_equal(rate_limit.limiter(none), None)
+    assert_equal(rate_limit.limiter('2M').rate, 2*1024*1024)
+    assert_equal(rate_limit.limiter(250000).rate, 250000)
+    assert_equal(rate_limit.limiter('25%').percent, 25)
+    for bad in ('fast', '-5', '150%'):
+        with pytest.raises(ValueError):
+            rate_limit.limiter(bad)
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = rate_limit.TokenBucket(1000, clock=clock, sleep=clock.sleep)
+    # the initial burst is free
+    bucket.consume(1000)
+    assert_equal(clock.slept, 0)
+    # after that, 5000 bytes take 5 seconds however they're sliced
+    for n in range(10):
+        bucket.consume(500)
+    assert_equal(clock.slept, 5)
+
+def test_link_share():
+    clock = FakeClock()
+    share = rate_limit.LinkShare(25, probe=2, clock=clock, sleep=clock.sleep)
+    # probe: 8000 bytes/sec flat out
+    for n in range(4):
+        share.consume(4000)
+        clock.now += 0.5
+    share.consume(4000)
+    assert_equal(clock.slept, 0)
+    assert_equal(share.bucket.rate, 20000 / 2.0 * 0.25)
+
+def test_download_throttled():
+    payload = bytes(range(256)) * 1024
+    consumed = []
+    class Recorder(object):
+        def consume(self, nbytes):
+            consumed.append(nbytes)
+    with FakeCDN({'/installer.exe': payload}) as cdn, \
+         patch(rate_limit, 'limiter', lambda value: Recorder()), \
+         patch_dict(os.environ, 'SL_DOWNLOAD_RATE_LIMIT', '100K'):
+        download_update.download_update(url=cdn.url('/installer.exe'), download_dir=tmpdir,
+                                        size=len(payload))
+    assert_equal(sum(consumed), len(payload))
+    # throttled downloads read in small pieces
+    assert max(consumed) <= download_update.THROTTLED_CHUNK_SIZE
+
+def test_explicit_zero_overrides_environment():
+    with patch_dict(os.environ, 'SL_DOWNLOAD_RATE_LIMIT', '100K'):
+        assert download_update.config_rate_limit(None) is not None
+        assert_equal(download_update.config_rate_limit(0), None)
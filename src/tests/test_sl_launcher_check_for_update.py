@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""\
+@file   test_sl_launcher_check_for_update.py
+@brief  Test that the update check's concurrent steps cooperate with LEAP
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import monkeypatched
+
+def setup_function():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp(prefix = 'test_check_for_update')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def test_green():
+    # the real step graph, on a first launch on Windows: every probe is a
+    # slow (but yielding) subprocess or HTTP request, and none of it may
+    # keep the LEAP greenthreads from running meanwhile
+    output = monkeypatched.run("""
+    import hashlib
+    import json
+    import machine_id
+    from util import Application, BuildData
+    BuildData.read(os.path.join(os.environ['APP_DATA_DIR'], 'build_data.json'))
+    tmpdir = %r
+
+    def pshell(*args, timeout=None):
+        eventlet.sleep(0.5)
+        return json.dumps(dict(gpus=['NVIDIA GeForce GTS 450'], cpus=[], uuid='1234'))
+
+    def query_vvm(platform_data, channel, UpdaterWillingToTest, vvm_id=None):
+        eventlet.sleep(0.2)
+        return dict(version='1.2.3', vvm_id=vvm_id)
+
+    with patch(Application, 'platform_key', lambda: 'win'), \\
+         patch_dict(os.environ, 'PROGRAMFILES(X86)', 'C:/Program Files (x86)'), \\
+         patch(update_manager.WindowsVideo, 'onNo64Windows', lambda: True), \\
+         patch(update_manager, '_pshell', pshell), \\
+         patch(update_manager, 'query_vvm', query_vvm), \\
+         patch(update_manager.WindowsHardware, 'cache_path',
+               lambda: os.path.join(tmpdir, 'windows_hardware.json')), \\
+         patch(machine_id, 'cache_path', lambda: os.path.join(tmpdir, 'machine_id.json')), \\
+         Bystander() as bystander:
+        install_mode, platdata, result = \\
+            SLVersionChecker.check_for_update(None, 'Second Life Release', 1, None)
+    print(install_mode, platdata.target, result['vvm_id'], bystander.ticks > 5)
+    """ % tmpdir)
+    assert_equal(output.split(), ['Install_automatically', 'win64',
+                                  hashlib.md5(b'1234').hexdigest(), 'True'])
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""\
+@file   test_stream_extract_download.py
+@brief  Test unpacking a Linux tarball while it downloads
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+from util import SL_Logging, BuildData
+from fake_cdn import FakeCDN
+from patch import patch, patch_dict, DELETE
+
+import monkeypatched
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+import download_update
+import stream_extract
+
+PATH = '/Second_Life_7_1_4_x86_64.tar.bz2'
+FILES = {'SecondLife/secondlife': os.urandom(200000),
+         'SecondLife/etc/settings.xml': b'<llsd/>' * 20000}
+
+def make_tarball(files=FILES, links={}):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w:bz2') as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+        for name, target in links.items():
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.SYMTYPE
+            info.linkname = target
+            tar.addfile(info)
+    return data.getvalue()
+
+TARBALL = make_tarball()
+
+def setup_function():
+    global tmpdir, download_dir
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_stream_extract', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_extract')
+    download_dir = os.path.join(tmpdir, '7.1.4.999999')
+
+def teardown_function():
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def download(cdn, **kwds):
+    return download_update.download_update(url=cdn.url(PATH), download_dir=download_dir,
+                                           size=len(TARBALL), chunk_size=16384, extract=True,
+                                           **kwds)
+
+def test_extract():
+    with FakeCDN({PATH: TARBALL}) as cdn:
+        filename, digest = download(cdn)
+    assert_equal(digest, hashlib.md5(TARBALL).hexdigest())
+    # not to be trusted until the caller has checked that hash
+    assert_equal(stream_extract.staged_tree(filename), None)
+    stream_extract.commit(filename)
+    staged = stream_extract.staged_tree(filename)
+    for name, content in FILES.items():
+        with open(os.path.join(staged, name), 'rb') as f:
+            assert f.read() == content
+    # and nothing there to confuse apply_update.get_filename()
+    assert_equal(sorted(os.listdir(download_dir))[0], os.path.basename(filename))
+
+def test_corrupt():
+    with FakeCDN({PATH: TARBALL}) as cdn:
+        cdn.corrupt[PATH] = 1000
+        filename, digest = download(cdn)
+    assert digest != hashlib.md5(TARBALL).hexdigest()
+    stream_extract.commit(filename)
+    assert_equal(stream_extract.staged_tree(filename), None)
+    assert not os.path.exists(filename + stream_extract.EXTRACTING)
+
+def test_segmented():
+    with FakeCDN({PATH: TARBALL}) as cdn, patch(download_update, 'MIN_SEGMENT_SIZE', 65536):
+        filename, digest = download(cdn, segments=2)
+    assert_equal(digest, None)
+    stream_extract.commit(filename)
+    # out-of-order bytes: leave it to apply_linux_update()
+    assert_equal(stream_extract.staged_tree(filename), None)
+
+def escapes():
+    for tarball in (make_tarball(dict(FILES, **{'../escaped': b'gotcha'})),
+                    make_tarball(links={'SecondLife/out': '../..'})):
+        with FakeCDN({PATH: tarball}) as cdn:
+            download_update.download_update(url=cdn.url(PATH), download_dir=download_dir,
+                                            size=len(tarball), extract=True)
+        assert not os.path.exists(os.path.join(download_dir, 'escaped'))
+        assert not os.path.lexists(os.path.join(download_dir,
+                                                PATH.lstrip('/') + stream_extract.EXTRACTING,
+                                                'SecondLife', 'out'))
+
+def test_no_escape():
+    escapes()
+
+def test_no_escape_without_filters():
+    with patch_dict(vars(tarfile), 'data_filter', DELETE):
+        escapes()
+
+def test_green():
+    # as when SLVersionChecker downloads inline, on the hub's thread, with an
+    # extractor that can't keep up
+    output = monkeypatched.run("""
+    import download_update
+    import stream_extract
+    from fake_cdn import FakeCDN
+    from test_stream_extract_download import PATH, TARBALL
+    os.environ.pop("http_proxy", None)
+    read = stream_extract.StreamingExtractor.read
+    def slow_read(self, size=-1):
+        time.sleep(0.05)
+        return read(self, size)
+    with patch(stream_extract, 'BACKLOG', 1), \\
+         patch(stream_extract.StreamingExtractor, 'read', slow_read), \\
+         FakeCDN({PATH: TARBALL}) as cdn, Bystander() as bystander:
+        filename, digest = download_update.download_update(
+            url=cdn.url(PATH), download_dir=%r, size=len(TARBALL), chunk_size=16384,
+            extract=True)
+    stream_extract.commit(filename)
+    print(stream_extract.staged_tree(filename) is not None, bystander.ticks > 10)
+    """ % download_dir)
+    assert_equal(output.split(), ['True', 'True'])
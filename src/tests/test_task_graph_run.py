@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""\
+@file   test_task_graph_run.py
+@brief  Test running interdependent steps concurrently
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+import eventlet
+from eventlet import patcher
+import pytest
+import threading
+import time
+from util import SL_Logging
+from patch import patch
+
+import task_graph
+
+DELAY = 0.3
+
+def setup_function():
+    SL_Logging.getLogger('test_task_graph', verbosity='DEBUG')
+
+def slow(value):
+    def step(**kwds):
+        time.sleep(DELAY)
+        return value
+    return step
+
+def test_concurrent():
+    start = time.monotonic()
+    results = task_graph.run(dict(a=(slow(1), ()), b=(slow(2), ()), c=(slow(3), ())))
+    elapsed = time.monotonic() - start
+    assert_equal(results, dict(a=1, b=2, c=3))
+    assert elapsed < 2*DELAY, "steps ran one after another: %.2fs" % elapsed
+
+def test_dependencies():
+    order = []
+    def step(name, value):
+        def func(**deps):
+            order.append(name)
+            return value + sum(deps.values())
+        return func
+    results = task_graph.run(dict(
+        total=(step('total', 0), ('x', 'y')),
+        x=(step('x', 1), ()),
+        y=(step('y', 10), ('x',)),
+    ))
+    assert_equal(results, dict(x=1, y=11, total=12))
+    assert_equal(order, ['x', 'y', 'total'])
+
+def test_failure():
+    ran = []
+    def fail():
+        raise RuntimeError("no such luck")
+    with pytest.raises(RuntimeError):
+        task_graph.run(dict(
+            bad=(fail, ()),
+            after=(lambda bad: ran.append('after'), ('bad',)),
+            other=(lambda: ran.append('other'), ()),
+        ))
+    # independent steps still run; dependent ones don't
+    assert_equal(ran, ['other'])
+
+def test_cycle():
+    with pytest.raises(ValueError):
+        task_graph.run(dict(a=(slow(1), ('b',)), b=(slow(2), ('a',))))
+    with pytest.raises(ValueError):
+        task_graph.run(dict(a=(slow(1), ('nonesuch',))))
+
+def test_green():
+    # as under SLVersionChecker: the steps must be greenthreads on the hub's
+    # thread, and run() mustn't block the hub while it waits for them
+    ticks = []
+    def ticker():
+        while len(ticks) < 100:
+            ticks.append(time.monotonic())
+            eventlet.sleep(DELAY/10)
+    def green(value):
+        def step(**kwds):
+            eventlet.sleep(DELAY)
+            return threading.current_thread() is threading.main_thread() and value
+        return step
+    bystander = eventlet.spawn(ticker)
+    try:
+        with patch(patcher, 'is_monkey_patched', lambda module: module != 'thread'):
+            start = time.monotonic()
+            results = task_graph.run(dict(a=(green(1), ()), b=(green(2), ('a',)),
+                                          c=(green(3), ())))
+            elapsed = time.monotonic() - start
+    finally:
+        bystander.kill()
+    assert_equal(results, dict(a=1, b=2, c=3))
+    assert elapsed < 3*DELAY, "steps ran one after another: %.2fs" % elapsed
+    assert len([tick for tick in ticks if tick > start]) >= 5, "run() blocked the hub"
@@ -29,10 +29,15 @@ $/LicenseInfo$
 
 from nose_tools import assert_equal, assert_false, assert_true
 
+import json
 import os
+import shutil
+import subprocess
 import sys
 import platform
+import tempfile
 
+import monkeypatched
 from patch import patch, patch_dict, DELETE
 
 # when running individual test files, this is needed for the imports below
@@ -40,65 +45,119 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import update_manager
 
-class testWindowsVideo(object):
+class FakePShell(object):
+    """stands in for update_manager._pshell, answering the hardware query"""
+    def __init__(self, gpus=(), cpus=(), uuid='4C4C4544-0042-3610-8052-B4C04F4E3732'):
+        self.output = json.dumps(dict(gpus=list(gpus), cpus=list(cpus), uuid=uuid))
+        self.calls = []
+
+    def __call__(self, *args, timeout=None):
+        self.calls.append((args, timeout))
+        return self.output
+
+class TestWindowsVideo(object):
 
     def setup_method(self):
         update_manager.WindowsVideo.hasOnlyUnsupported = None # defeat caching so each test rechecks
+        update_manager.WindowsHardware.data = None
         os.environ['APP_DATA_DIR'] = os.path.dirname(os.path.abspath(__file__))
+        self.tmpdir = tempfile.mkdtemp(prefix='test_windows_video')
+        self.cache = patch(update_manager.WindowsHardware, 'cache_path',
+                           lambda: os.path.join(self.tmpdir, 'windows_hardware.json'))
+        self.cache.__enter__()
+
+    def teardown_method(self):
+        self.cache.__exit__(None, None, None)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def relaunch(self):
+        # as if in a new process
+        update_manager.WindowsVideo.hasOnlyUnsupported = None
+        update_manager.WindowsHardware.data = None
 
     def testOnlyOneGoodCard(self):
-        with patch(update_manager, "pshell",
-                   lambda *args:
-                   'NVIDIA GeForce GTS 450  \r\r\n'
-                   '\r\r\n'):
+        with patch(update_manager, "_pshell", FakePShell(['NVIDIA GeForce GTS 450  '])):
             assert_false(update_manager.WindowsVideo.isUnsupported())
 
     def testOneBadOneGood(self):
-        with patch(update_manager, "pshell",
-                       lambda *args:
-                       'Intel(R) HD Graphics 2000 \r\r\n'
-                       'NVIDIA GeForce GTS 450    \r\r\n'
-                       '\r\r\n'):
+        with patch(update_manager, "_pshell",
+                   FakePShell(['Intel(R) HD Graphics 2000 ', 'NVIDIA GeForce GTS 450    '])):
             assert_false(update_manager.WindowsVideo.isUnsupported())
 
     def testTwoBad(self):
-        with patch(update_manager, "pshell", 
-                       lambda *args:
-                       'Intel(R) HD Graphics 2000 \r\r\n' 
-                       'Intel(R) HD Graphics 3000 \r\r\n'
-                       '\r\r\n'): 
+        with patch(update_manager, "_pshell",
+                   FakePShell(['Intel(R) HD Graphics 2000 ', 'Intel(R) HD Graphics 3000 '])):
             assert_equal(update_manager.WindowsVideo.isUnsupported(), True)
 
     def testNoCards(self):
-        with patch(update_manager, "pshell", 
-                       lambda *args: 
-                       '\r\r\n'): 
+        with patch(update_manager, "_pshell", FakePShell()):
             assert_true(update_manager.WindowsVideo.isUnsupported())
 
     def testBadPShell(self):
-        def pshell(*args):
-            raise update_manager.PShellError("fake error")
-        with patch(update_manager, "pshell", pshell):
+        def pshell(*args, timeout=None):
+            raise subprocess.CalledProcessError(1, args, "fake error")
+        with patch(update_manager, "_pshell", pshell):
             assert_true(update_manager.WindowsVideo.isUnsupported())
 
     def testBadIntelHDGraphics(self):
-        def pshell(*args):
-            if args[0] == 'path':
-                return 'Intel(R) HD Graphics      \r\r\n'\
-                       '\r\r\n'
-            else:
-                return 'Intel(R) Core(TM) i7-2600 CPU @ 3.20GHz \r\r\n'\
-                       '\r\r\n'
-        with patch(update_manager, "pshell", pshell):
+        with patch(update_manager, "_pshell",
+                   FakePShell(['Intel(R) HD Graphics      '],
+                              ['Intel(R) Core(TM) i7-2600 CPU @ 3.20GHz '])):
             assert_true(update_manager.WindowsVideo.isUnsupported())
 
     def testGoodIntelHDGraphics(self):
-        def pshell(*args):
-            if args[0] == 'path':
-                return 'Intel(R) HD Graphics      \r\r\n'\
-                       '\r\r\n'
-            else:
-                return 'Intel(R) Core(TM) i5-6600K CPU @ 3.20GHz \r\r\n'\
-                       '\r\r\n'
-        with patch(update_manager, "pshell", pshell):
+        with patch(update_manager, "_pshell",
+                   FakePShell(['Intel(R) HD Graphics      '],
+                              ['Intel(R) Core(TM) i5-6600K CPU @ 3.20GHz '])):
             assert_false(update_manager.WindowsVideo.isUnsupported())
+
+    def testOneRunForEverything(self):
+        fake = FakePShell(['Intel(R) HD Graphics      '],
+                          ['Intel(R) Core(TM) i5-6600K CPU @ 3.20GHz '])
+        with patch(update_manager, "_pshell", fake):
+            update_manager.WindowsVideo.isUnsupported()
+            assert update_manager.probe_VVM_UUID_hash('win')
+        assert_equal(len(fake.calls), 1)
+        # with a deadline
+        assert_equal(fake.calls[0][1], update_manager.WindowsHardware.TIMEOUT)
+
+    def testSaved(self):
+        with patch(update_manager, "_pshell", FakePShell(['NVIDIA GeForce GTS 450'])):
+            assert_false(update_manager.WindowsVideo.isUnsupported())
+        self.relaunch()
+        fake = FakePShell(['Intel(R) HD Graphics 2000'])
+        with patch(update_manager, "_pshell", fake):
+            assert_false(update_manager.WindowsVideo.isUnsupported())
+            assert_equal(fake.calls, [])
+            # new hardware, new answer
+            self.relaunch()
+            with patch_dict(os.environ, 'PROCESSOR_IDENTIFIER', 'something else'):
+                assert_true(update_manager.WindowsVideo.isUnsupported())
+        assert_equal(len(fake.calls), 1)
+
+    def testTimeout(self):
+        def pshell(*args, timeout=None):
+            raise subprocess.TimeoutExpired(args, timeout)
+        with patch(update_manager, "_pshell", pshell):
+            assert_true(update_manager.WindowsVideo.isUnsupported())
+        # a failure isn't saved: next time, try again
+        assert not os.path.exists(update_manager.WindowsHardware.cache_path())
+
+    def testGreenthreads(self):
+        # as under SLVersionChecker, where task_graph runs platdata and vvm_id
+        # as greenthreads, each wanting the hardware at once
+        output = monkeypatched.run("""
+        import json
+        hardware = dict(gpus=['NVIDIA GeForce GTS 450'], cpus=[], uuid='1234')
+        def pshell(*args, timeout=None):
+            # as the green subprocess module would, yield while it runs
+            eventlet.sleep(0.5)
+            return json.dumps(hardware)
+        with patch(update_manager, '_pshell', pshell), \\
+             patch(update_manager.WindowsHardware, 'cache_path',
+                   lambda: os.path.join(%r, 'windows_hardware.json')), \\
+             Bystander() as bystander:
+            getters = [eventlet.spawn(update_manager.WindowsHardware.get) for n in range(2)]
+            print([getter.wait() == hardware for getter in getters], bystander.ticks > 5)
+        """ % self.tmpdir)
+        assert_equal(output.strip(), '[True, True] True')
@@ -30,8 +30,12 @@ $/LicenseInfo$
 
 from nose_tools import *
 
+import os
+import shutil
+import tempfile
 import update_manager
 from util import Application
+from patch import patch
 
 def test_make_VVM_UUID_hash():
     #because the method returns different results on different hosts
@@ -39,7 +43,21 @@ def test_make_VVM_UUID_hash():
     #About the best we can do is check for the exception from subprocess
     key = Application.platform_key()
 
-    UUID_hash = update_manager.make_VVM_UUID_hash(key)
+    # with a cached id, we'd never run the probe
+    tmpdir = tempfile.mkdtemp(prefix = 'test_make_VVM_UUID_hash')
+    probes = []
+    def probe(platform_key):
+        probes.append(platform_key)
+        return real_probe(platform_key)
+    real_probe = update_manager.probe_VVM_UUID_hash
+    try:
+        with patch(update_manager.machine_id, 'cache_path',
+                   lambda: os.path.join(tmpdir, 'machine_id.json')), \
+             patch(update_manager, 'probe_VVM_UUID_hash', probe):
+            UUID_hash = update_manager.make_VVM_UUID_hash(key)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors = True)
 
     #make_UUID_hash returned None
     assert UUID_hash, "make_UUID_hash failed to make a hash."
+    assert probes, "make_UUID_hash didn't probe"
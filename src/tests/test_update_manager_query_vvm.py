@@ -35,11 +35,14 @@ import os.path
 import platform
 import random
 import re
+import shutil
 import sys
+import tempfile
 import threading
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from util import SL_Logging, Application, BuildData
+from patch import patch
 
 os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
 BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
@@ -127,12 +130,20 @@ def test_query_vvm():
     # This test CANNOT succeed with $http_proxy in the environment.
     os.environ.pop("http_proxy", None)
     os.environ["SL_UPDATE_SERVICE"] = 'http://localhost:%s/update' % port
+    # a response cached by an earlier run would mean we never asked the
+    # server; and leave the real machine id cache alone
+    tmpdir = tempfile.mkdtemp(prefix = 'test_query_vvm')
     try:
-        results = update_manager.query_vvm_from_settings(
-            platform_data=platform_data,
-            settings={})
+        with patch(update_manager.vvm_cache, 'cache_dir',
+                   lambda: os.path.join(tmpdir, 'vvm_cache')), \
+             patch(update_manager.machine_id, 'cache_path',
+                   lambda: os.path.join(tmpdir, 'machine_id.json')):
+            results = update_manager.query_vvm_from_settings(
+                platform_data=platform_data,
+                settings={})
     finally:
         os.environ.pop("SL_UPDATE_SERVICE")
+        shutil.rmtree(tmpdir, ignore_errors = True)
 
     assert results
     assert channel_pattern.search(results['channel']), "Incorrect channel %r" % results
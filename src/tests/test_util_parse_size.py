@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""\
+@file   test_util_parse_size.py
+@brief  Test parsing byte counts such as '64K'
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+from util import parse_size
+
+def test_parse_size():
+    assert_equal(parse_size('64K'), 65536)
+    assert_equal(parse_size('1g'), 1024**3)
+    assert_equal(parse_size('1.5M'), 3*512*1024)
+    assert_equal(parse_size('100'), 100)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""\
+@file   test_vvm_cache_get.py
+@brief  Test caching update service responses
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from nose_tools import *
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import llsd
+import os
+import pytest
+import shutil
+import tempfile
+import threading
+import time
+from util import SL_Logging, BuildData
+from patch import patch, patch_dict
+
+os.environ['APP_DATA_DIR'] = os.path.dirname(__file__)
+from llbase import llrest
+import vvm_cache
+
+RESULT = dict(version='7.1.4.100', required=False)
+QUERY = 'v1.2/Second%20Life%20Release/7.1.3.1/win64/10.0/testok/abc'
+UNMANAGED = 'v1.2/Second%20Life%20Test/7.1.3.1/win64/10.0/testok/abc'
+
+class FakeVVM(object):
+    """answers QUERY with RESULT (and an ETag), anything else with 404"""
+    def __init__(self, cache_control=None):
+        self.requests = []
+        vvm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                vvm.requests.append((self.path, dict(self.headers)))
+                if not self.path.endswith(QUERY):
+                    self.send_error(404)
+                    return
+                if self.headers.get('If-None-Match') == '"v1"':
+                    self.send_response(304)
+                    self.send_header('ETag', '"v1"')
+                    self.end_headers()
+                    return
+                body = llsd.format_xml(RESULT)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/llsd+xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', '"v1"')
+                if cache_control:
+                    self.send_header('Cache-Control', cache_control)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.service = llrest.SimpleRESTService(
+            name='VVM', baseurl='http://127.0.0.1:%s/update' % self.server.server_port)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+def setup_function():
+    global tmpdir, cache
+    BuildData.read(os.path.join(os.path.dirname(__file__),'build_data.json'))
+    SL_Logging.getLogger('test_vvm_cache', verbosity='DEBUG')
+    os.environ.pop("http_proxy", None)
+    tmpdir = tempfile.mkdtemp(prefix = 'test_vvm_cache')
+    cache = patch(vvm_cache, 'cache_dir', lambda: tmpdir)
+    cache.__enter__()
+
+def teardown_function():
+    cache.__exit__(None, None, None)
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+def test_fresh():
+    with FakeVVM() as vvm:
+        assert_equal(vvm_cache.get(vvm.service, QUERY), RESULT)
+        assert_equal(vvm_cache.get(vvm.service, QUERY), RESULT)
+    assert_equal(len(vvm.requests), 1)
+
+def test_revalidate():
+    with FakeVVM() as vvm, patch_dict(os.environ, 'SL_VVM_CACHE_TTL', '1'):
+        assert_equal(vvm_cache.get(vvm.service, QUERY), RESULT)
+        with patch(vvm_cache.time, 'time', lambda: time.monotonic() + 1e10):
+            assert_equal(vvm_cache.get(vvm.service, QUERY), RESULT)
+    assert_equal(len(vvm.requests), 2)
+    assert_equal(vvm.requests[1][1].get('If-None-Match'), '"v1"')
+
+def test_unmanaged():
+    with FakeVVM() as vvm:
+        for attempt in range(2):
+            with pytest.raises(llrest.RESTError) as err:
+                vvm_cache.get(vvm.service, UNMANAGED)
+            assert_equal(err.value.status, 404)
+    assert_equal(len(vvm.requests), 1)
+
+def test_no_store():
+    with FakeVVM(cache_control='no-store') as vvm:
+        vvm_cache.get(vvm.service, QUERY)
+        vvm_cache.get(vvm.service, QUERY)
+    assert_equal(len(vvm.requests), 2)
+    assert_equal(os.listdir(tmpdir), [])
+
+def test_disabled():
+    with FakeVVM() as vvm, patch_dict(os.environ, 'SL_VVM_CACHE_TTL', '0'):
+        vvm_cache.get(vvm.service, QUERY)
+        vvm_cache.get(vvm.service, QUERY)
+    assert_equal(len(vvm.requests), 2)
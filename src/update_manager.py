@@ -30,27 +30,39 @@ $/LicenseInfo$
 """
 
 from logging import DEBUG
-from util import Application, BuildData, SL_Logging, log_calls, pass_logger, subprocess_args, \
-     put_marker_file, MergedSettings, ufile
+from util import Application, BuildData, HubLock, SL_Logging, log_calls, pass_logger, \
+     subprocess_args, put_marker_file, MergedSettings
 from llbase import llrest
 import llsd
 
 import apply_update
+import chunk_manifest
 from contextlib import suppress
+import delta_update
+import download_lock
+import download_scheduler
+import download_worker
 import download_update
 import errno
 import glob
+import gpu_rules
 import hashlib
+import hashing
+import machine_id
+import mirrors
+import offline_bundle
+import installer_store
 import InstallerUserMessage
+import json
 import os
 import os.path
-from pprint import pformat
 import re
 import platform
 from runner import PopenRunner
 import shutil
+import stream_extract
 import subprocess
-import tempfile
+import task_graph
 import time
 import threading
 # specifically import the sleep() function for testability
@@ -59,7 +71,7 @@ from time import sleep
 import urllib.parse
 #for the disable_warnings method 
 import urllib3
-import uuid
+import vvm_cache
 import warnings
 from xml.etree import ElementTree
 
@@ -98,17 +110,13 @@ class PlatformData:
 #module globals
 
 def md5file(fname):
-    with open(fname, "rb") as f:
-        return md5handle(f)
+    return hashing.hash_file(fname)['md5']
 
 def md5handle(handle):
     #utility method to compute the checksum of the contents of a file
-    hash_md5 = hashlib.md5()
     #unit tests use tempfile temporary files which return handles to files that vanish if you
     #close the handle while Windows will say permission denied to a second handle.
-    for chunk in iter(lambda: handle.read(4096), b""):
-        hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+    return hashing.hash_handle(handle)['md5']
 
 def convert_version_file_style(version):
     #converts a version string a.b.c.d to a_b_c_d as used in downloaded filenames
@@ -133,7 +141,8 @@ def check_for_completed_download(download_dir, expected_size = 0):
     """
     Return:
     'winstall' if we previously launched a Windows NSIS installer from there; else
-    'skip' if the user asked never to install this version; else
+    'skip' if the user asked never to install this version, or another
+           process is downloading it right now; else
     'next' if the user asked to defer installation until next run; else
     'done' if we finished downloading a new installer; else
     None if the directory doesn't even exist.
@@ -160,51 +169,64 @@ def check_for_completed_download(download_dir, expected_size = 0):
             log.debug('download_dir %s has %s marker', download_dir, ext)
             return ext.lstrip('.')
 
+    if download_in_progress(download_dir):
+        #this is a protocol hack.  The caller will see this and interpret the download
+        #in progress as an optional update to be ignored.  Later, when done, a later launch
+        #instance will see the completed download and act accordingly. (A required
+        #update can't be ignored: update_manager() waits for it.)
+        log.debug('download_dir %s is being downloaded, fake skip', download_dir)
+        return 'skip'
+
     # no markers: we found some sort of partial remnants of a download
     installer = apply_update.get_filename(download_dir)
     if not installer:
         log.warning("no installer in download_dir %s, deleting", download_dir)
         #cleanup the mess, start over next time
-        shutil.rmtree(download_dir)
+        download_lock.clear(download_dir)
         return None
 
-    #the theory of operation is that if the file hasn't changed in ten seconds
-    #there is no download in progress
-    samples = []
-    for x in sleep_between(
-        range(2),                       # returned items
-        'download_dir %s has partial installer %s (expecting %s), sleeping' %
-        (download_dir, installer, expected_size),
-        10):                            # sleep seconds
-        # See sleep_between() below. The idea is to execute this block once,
-        # maybe twice -- but we sleep() only after the *first* iteration, not
-        # the second.
-        # Are we there yet?
-        samples.append(os.path.getsize(installer))
-        # If, on either check, the file reached the expected size, we're good.
-        if samples[-1] == expected_size:
-            log.debug('%d: download_dir %s has installer %s of expected size %s, done',
-                      x+1, download_dir, installer, expected_size)
-            # Place a marker for future reference.
-            put_marker_file(download_dir, ".done")
-            return 'done'
-
-    # If we get here at all, there are exactly two samples. If the second is
-    # bigger than the first, there's a download in progress elsewhere.
-    if samples[1] > samples[0]:
-        #this is a protocol hack.  The caller will see this and interpret the download
-        #in progress as an optional update to be ignored.  Later, when done, a later launch
-        #instance will see the completed download and act accordingly.
-        log.debug('download_dir %s has installer %s being downloaded, fake skip',
-                  download_dir, installer)
-        return 'skip'
+    # A resume sidecar means the installer is incomplete, however big the
+    # (possibly preallocated) file might be.
+    completed = download_update.ResumeState.completed_for(installer)
+    if completed is not None:
+        # Keep what we have: download_update() will pick up where it left off.
+        log.info('download_dir %s has resumable partial installer %s (%s of %s bytes)',
+                 download_dir, installer, completed, expected_size)
+        return None
+
+    size = os.path.getsize(installer)
+    if size == expected_size:
+        log.debug('download_dir %s has installer %s of expected size %s, done',
+                  download_dir, installer, expected_size)
+        # Place a marker for future reference.
+        put_marker_file(download_dir, ".done")
+        return 'done'
 
     # No markers, unfinished download, not currently downloading
     log.debug('download_dir %s has partial installer %s (%s, expecting %s), deleting',
-              download_dir, installer, samples[1], expected_size)
-    shutil.rmtree(download_dir)
+              download_dir, installer, size, expected_size)
+    download_lock.clear(download_dir)
     return None
 
+@pass_logger
+def download_in_progress(log, download_dir):
+    """Is some other process downloading into 'download_dir' right now?"""
+    # A detached downloader says it's on the job: don't second-guess it.
+    status = download_worker.read_status(download_dir)
+    if status and status.get('state') == 'downloading':
+        log.debug('download_dir %s is being downloaded by worker %s (%s of %s bytes)',
+                  download_dir, status.get('pid'), status.get('completed'), status.get('size'))
+        return True
+
+    # Whoever holds the download lock is downloading right now.
+    owner = download_lock.holder(download_dir)
+    if owner is not None:
+        log.debug('download_dir %s is being downloaded by process %s on %s (%s of %s bytes)',
+                  download_dir, owner.get('pid'), owner.get('host'),
+                  owner.get('completed'), owner.get('size'))
+        return True
+    return False
+
 def sleep_between(iterable, message, duration):
     """
     Yield items from the passed iterable, logging (and sleeping) in between
@@ -261,11 +283,33 @@ def get_settings(settings_file):
     return MergedSettings(settings)
 
 def make_VVM_UUID_hash(platform_key):
+    """
+    Return the md5 hash of this machine's unique id. Probing for the id is
+    slow, so it's cached: see machine_id.
+    """
+    return machine_id.get(platform_key, probe_VVM_UUID_hash)
+
+def probe_VVM_UUID_hash(platform_key):
+    """
+    Return the md5 hash of this machine's unique id, or None if we can't
+    get it.
+    """
     log = SL_Logging.getLogger('make_VVM_UUID_hash')
 
     #NOTE: There is no python library support for a persistent machine specific UUID (MUUID)
     #      AND all three platforms do this a different way, so exec'ing out is really the best we can do
     #Lastly, this is a best effort service.  If we fail, we should still carry on with the update 
+    muuid = None
+    try:
+        muuid = _probe_muuid(log, platform_key)
+    except Exception as err:
+        log.warning("Couldn't get system unique id: %s: %s", type(err).__name__, err)
+    if muuid is None:
+        return None
+    # hashlib requires a bytes object, not a str
+    return hashlib.md5(muuid.encode('utf8')).hexdigest()
+
+def _probe_muuid(log, platform_key):
     muuid = None
     #for env without stdin, such as pythonw and pyinstaller, provide a legit empty handle, not the broken
     #thing we get from the env.
@@ -291,32 +335,17 @@ def make_VVM_UUID_hash(platform_key):
         muuid = re.split(":", re.findall(r'Serial Number \(system\): \S*', muuid)[0])[1].lstrip()
         log.debug("result of subprocess call to get mac MUUID: %r" % muuid)
     elif (platform_key == 'win'):
-        try:
-            # pshell csproduct get UUID | grep -v UUID
-            muuid = pshell('-Command', "\"CimCmdlets\\Get-CimInstance -ClassName Win32_ComputerSystemProduct | Select-Object -ExpandProperty UUID\"")
-        except PShellError as err:
-            log.warning(err)
-            muuid = None
-        else:
-            #outputs row:
-            #XXXXXXX-XXXX...
-            # but splitlines() produces a whole lot of empty strings.
-            muuid = [line for line in muuid.splitlines() if line][-1].rstrip()
-            log.debug("result of subprocess call to get win MUUID: %r" % muuid)
-            
-    if muuid is None:
-        #fake it
-        log.info("Unable to get system unique id; constructing a dummy")
-        muuid = str(uuid.uuid1())
-    # hashlib requires a bytes object, not a str
-    hash = hashlib.md5(muuid.encode('utf8')).hexdigest()
-    return hash
+        # one powershell run gets this along with the video card info
+        muuid = WindowsHardware.get().get('uuid') or None
+        log.debug("result of powershell query for win MUUID: %r" % muuid)
+    return muuid
 
 
-def pshell(*args):
+def pshell(*args, timeout=None):
     """
     Run the Windows powershell command with specified arguments, returning its
-    stdout (or raising an exception).
+    stdout (or raising an exception). If it takes longer than 'timeout'
+    seconds, kill it and raise PShellError.
 
     Breaking this out as a separate function improves testability.
     """
@@ -324,8 +353,9 @@ def pshell(*args):
         # MAINT-9014: There are a couple possibilities for finding powershell.
         try:
             # It has a canonical pathname that might or might not be on the PATH.
-            return _pshell("C:/Windows/System32/WindowsPowerShell/v1.0/powershell.exe", *args)
-        except WindowsError as err:
+            return _pshell("C:/Windows/System32/WindowsPowerShell/v1.0/powershell.exe", *args,
+                           timeout=timeout)
+        except OSError as err:
             # Only retry for "not found" -- anything else is a genuine problem.
             if err.errno != errno.ENOENT:
                 raise
@@ -334,25 +364,28 @@ def pshell(*args):
             # Tempting though it is to memoize the knowledge that the usual
             # path doesn't work, the fact is that we only invoke powershell a
             # couple times.
-            return _pshell("powershell", *args)
+            return _pshell("powershell", *args, timeout=timeout)
+    except subprocess.TimeoutExpired as err:
+        raise PShellError("powershell still running after %s seconds; killed it" % err.timeout)
     except subprocess.CalledProcessError as err:
         # https://docs.python.org/2/library/subprocess.html#subprocess.CalledProcessError
         # When check_output() raises CalledProcessError, it stores collected
         # output into err.output.
         raise PShellError("pshell error: %s\n%s" % (err, err.output))
-    except WindowsError as winerr:
+    except OSError as winerr:
         if winerr.errno == errno.ENOENT:
             raise PShellError("No powershell found - bad Windows install?")
-        raise PShellError("powershell failed; error %s %s" % (winerr.winerror, winerr.strerror))
+        raise PShellError("powershell failed; error %s %s" %
+                          (getattr(winerr, 'winerror', winerr.errno), winerr.strerror))
 
-def _pshell(*pshell_cmd):
+def _pshell(*pshell_cmd, timeout=None):
     return subprocess.check_output(
-        pshell_cmd,
+        pshell_cmd, timeout=timeout,
         **subprocess_args(include_stdout=False,
                           log_stream=SL_Logging.stream_from_process(pshell_cmd)))
 
 @pass_logger
-def query_vvm_from_settings(log, platform_data, settings):
+def query_vvm_from_settings(log, platform_data, settings, vvm_id=None):
     channelname = BuildData.get('Channel')
 
     UpdaterWillingToTest = settings.get('UpdaterWillingToTest', 1)
@@ -371,13 +404,15 @@ def query_vvm_from_settings(log, platform_data, settings):
 
     return query_vvm(platform_data=platform_data,
                      channel=channelname,
-                     UpdaterWillingToTest=UpdaterWillingToTest)
+                     UpdaterWillingToTest=UpdaterWillingToTest,
+                     vvm_id=vvm_id)
 
 @pass_logger
-def query_vvm(log, platform_data, channel, UpdaterWillingToTest):
+def query_vvm(log, platform_data, channel, UpdaterWillingToTest, vvm_id=None):
     """
     Ask the viewer version manager what builds are available for me
-    given my platform and version.
+    given my platform and version. Pass vvm_id if you already have
+    make_VVM_UUID_hash() for this platform.
     Returns a map of all responses.
     """
     # URI template /update/v1.2/channelname/version/platform/platformversion/willing-to-test/uniqueid
@@ -403,7 +438,7 @@ def query_vvm(log, platform_data, channel, UpdaterWillingToTest):
     else:
         platform_version = platform.release()
     #this will always return something usable, error handling in method
-    UUID = str(make_VVM_UUID_hash(platform_data.key))
+    UUID = str(vvm_id or make_VVM_UUID_hash(platform_data.key))
 
     # UpdaterWillingToTest is expected to be either 0 or 1, either string or int
     test_ok = 'testok'
@@ -426,7 +461,9 @@ def query_vvm(log, platform_data, channel, UpdaterWillingToTest):
     VVMService = llrest.SimpleRESTService(name='VVM', baseurl=update_service)
     
     try:
-        result_data = VVMService.get(update_urlpath, params=debug_param)
+        # an explanation is only worth asking for fresh
+        result_data = vvm_cache.get(VVMService, update_urlpath, params=debug_param,
+                                    use_fresh=not debug_param)
     except llrest.RESTError as res:
         if res.status == 404: # 404 is how the Viewer Version Manager indicates that the channel is unmanaged
             log.info("Update service returned 'not found'; normally this means the channel is unmanaged (and allowed)")
@@ -437,60 +474,115 @@ def query_vvm(log, platform_data, channel, UpdaterWillingToTest):
     log.debug("received result from VVM: %r" % result_data)
     # logging the explanation above is enough, not needed elsewhere
     result_data.pop('explain', None)
+    # newer rules for WindowsVideo, if any, are for the next run
+    rules = result_data.pop('gpu_rules', None)
+    if rules:
+        gpu_rules.refresh(rules)
     return result_data
 
+class WindowsHardware(object):
+    """
+    What WindowsVideo and make_VVM_UUID_hash() need to know about this
+    machine: its video cards, CPUs and unique id. PowerShell's startup alone
+    costs seconds, so one run collects all three, as JSON; and the result is
+    kept in <userpath>/windows_hardware.json, reused until its invalidation
+    key changes or it's older than MAX_AGE.
+    """
+    VERSION = 1
+    CACHE_FILE = 'windows_hardware.json'
+    # how long (seconds) the powershell run may take
+    TIMEOUT = 30
+    # how long (seconds) to trust saved results: the key can't see a new video card
+    MAX_AGE = 7*24*60*60
+    SCRIPT = ("$gpus = @(CimCmdlets\\Get-CimInstance -ClassName Win32_VideoController"
+              " | ForEach-Object Name); "
+              "$cpus = @(CimCmdlets\\Get-CimInstance -ClassName Win32_Processor"
+              " | ForEach-Object Name); "
+              "$uuid = CimCmdlets\\Get-CimInstance -ClassName Win32_ComputerSystemProduct"
+              " | ForEach-Object UUID; "
+              "ConvertTo-Json -Compress @{gpus=$gpus; cpus=$cpus; uuid=$uuid}")
+
+    # in-process cache: {} means we tried and failed
+    data = None
+    # platdata and vvm_id may both want this at once, as greenthreads
+    # under SLVersionChecker (see task_graph): while one waits on
+    # PowerShell, the other mustn't block the hub
+    lock = HubLock()
+
+    @staticmethod
+    def cache_path():
+        return os.path.join(Application.userpath(), WindowsHardware.CACHE_FILE)
+
+    @staticmethod
+    def invalidation_key():
+        # all cheap to get: no powershell
+        return '/'.join((platform.node(), platform.version(), platform.machine(),
+                         os.getenv('PROCESSOR_IDENTIFIER', '')))
+
+    @staticmethod
+    def get():
+        """
+        Return dict(gpus=[names], cpus=[names], uuid=string), or {} if we
+        couldn't find out.
+        """
+        with WindowsHardware.lock:
+            if WindowsHardware.data is None:
+                WindowsHardware.data = WindowsHardware.load() or WindowsHardware.probe()
+            return WindowsHardware.data
+
+    @staticmethod
+    def load():
+        try:
+            with open(WindowsHardware.cache_path()) as f:
+                record = json.load(f)
+            if record['version'] == WindowsHardware.VERSION and \
+               record['key'] == WindowsHardware.invalidation_key() and \
+               time.time() - record['probed'] < WindowsHardware.MAX_AGE:
+                return record['hardware']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    @staticmethod
+    def probe():
+        log = SL_Logging.getLogger('windows_hardware')
+        try:
+            output = pshell('-NoProfile', '-NonInteractive', '-Command',
+                            '"%s"' % WindowsHardware.SCRIPT, timeout=WindowsHardware.TIMEOUT)
+            found = json.loads(output)
+        except (PShellError, ValueError) as err:
+            log.warning("Couldn't get hardware info: %s: %s", type(err).__name__, err)
+            return {}
+        log.debug("power shell hardware info: %r", found)
+
+        def names(value):
+            # a single name might come back bare rather than in a list
+            if isinstance(value, str):
+                value = [value]
+            return [name.strip() for name in (value or []) if name and name.strip()]
+
+        hardware = dict(gpus=names(found.get('gpus')), cpus=names(found.get('cpus')),
+                        uuid=(found.get('uuid') or '').strip())
+        path = WindowsHardware.cache_path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write-then-rename so a reader never sees half a record
+            with open(path + '.tmp', 'w') as f:
+                json.dump(dict(version=WindowsHardware.VERSION,
+                               key=WindowsHardware.invalidation_key(),
+                               probed=time.time(), hardware=hardware), f)
+            os.replace(path + '.tmp', path)
+        except OSError as err:
+            log.warning("Can't save hardware info in %s: %s: %s", path, type(err).__name__, err)
+        return hardware
+
 class WindowsVideo(object):
     hasOnlyUnsupported = None # so that we only call powershell once
 
     # Empirically, we find that the 64-bit viewer will not run on certain versions
-    # of Windows with certain graphics cards. This module contains logic to detect
-    # those situations and specifically run the 32-bit viewer.
-    # This is an exclusion list created by experimental techniques
-    # and research that is extrinsic to VMP.  64bit viewer does not run on these.
-    Intel_Graphics = "Intel(R) HD Graphics"
-
-    # Also, only some HDs are bad, unfortunately, some of the bad ones have no model number
-    # so instead of 'Intel(R) HD Graphics 530' we just get 'Intel(R) HD Graphics'
-    # hence the strange equality test for 'Graphics' when we pop the last word off the string.
-    NO64_GRAPHICS_LIST = ['Graphics', '2000', '3000']
-
-    # When the GPU is reported as "Intel(R) HD Graphics", we check the CPU for
-    # certain models that we've observed to fail with 64 bits.
-    CPU_MODELS = (
-        # HD 2000/3000
-        ('Intel HD 2000/3000', re.compile(r"(\si[0-9]-2[0-9]{3}[EKLMSTXQ\s])|(E3-1260L)")),
-        # IntelR HD Graphics for Previous Generation IntelR Processors
-        ('Intel HD Graphics',
-         re.compile(r"(\si[0-9]-[0-9]{3}[ELMU\s])|(Processor\sP[46][0-6]0[05]\s)|"
-                    r"(Processor\sU[35][46]0[05]\s)")),
-        ('Intel HD Graphics', re.compile(r"(CPU\sP[46][0-6]0[05]\s)|(CPU\sU[35][46]0[05]\s)")),
-        # IntelR HD Graphics for 2nd Generation IntelR Processors
-        ('Intel 2nd Generation', re.compile(r"(Processor\s[BG]*[0-9]{3}[ET\s])")),
-        ('Intel 2nd Generation', re.compile(r"(CPU\s[BG]*[0-9]{3}[ET\s])")),
-        # IntelR HD Graphics for 3rd Generation IntelR Processors
-        ('3rd Generation', re.compile(r"(Processor\s[G]*[12][016][0-4][05-9][YTUME\s])|"
-                                      r"(Processor\s927UE)|(Processor\sA1018)")),
-        ('3rd Generation', re.compile(r"(CPU\s[G]*[12][016][0-4][05-9][YTUME\s])|"
-                                      r"(CPU\s927UE)|(CPU\sA1018)")),
-        # IntelR HD Graphics for 4th Generation IntelR Processors
-        # Partial overlap with 3rd gen due to Processor 2000E
-        ('Intel HD Graphics for 4th Generation',
-         re.compile(r"(Processor\s[G]*3[2-5][2-9][0168][YTUME\s])|"
-                    r"(Processor\s2[09][05-8][0-9][YTUME\s])|"
-                    r"(Processor\s[G]1[089][0-9]{2}[YTUME\s])|(E3-12[6-9][0-9]L\s)")),
-        ('Intel HD Graphics for 4th Generation',
-         re.compile(r"(CPU\s[G]*3[2-5][2-9][0168][YTUME\s])|"
-                    r"(CPU\s2[09][05-8][0-9][YTUME\s])|"
-                    r"(CPU\s[G]1[089][0-9]{2}[YTUME\s])|(E3-12[6-9][0-9]L\s)")),
-        # Some celeron CPUs might output 'Intel64 Family' as a name
-        ('unrecognized Intel64 Family CPU', re.compile(r"Intel64\sFamily\s")),
-    )
-    # Does not cover, due to supposedly up to date drivers:
-    # IntelR HD Graphics for Intel AtomR Processor Z3700 Series
-    # IntelR HD Graphics for IntelR CeleronR Processor N3000 Series (HD 400)
-    #
-    # IntelR HD Graphics for 4th Generation IntelR also have an up to date
-    # driver, but for now we consider it as 32 bit.
+    # of Windows with certain graphics cards. This class contains logic to detect
+    # those situations and specifically run the 32-bit viewer. Which cards (and
+    # CPUs) are bad is data, not code: see gpu_rules.
 
     @staticmethod
     def onNo64Windows():
@@ -500,7 +592,7 @@ class WindowsVideo(object):
         windowsVersion = platform.win32_ver()[1]
         versionPair = [int(field) for field in windowsVersion.split('.')[:2]]
         # As far as we know, Intel doesn't have (working) drivers for the cards in
-        # NO64_GRAPHICS_LIST specifically on Windows 10 and Windows 8.1. According
+        # gpu_rules.json specifically on Windows 10 and Windows 8.1. According
         # to this page:
         # https://msdn.microsoft.com/en-us/library/windows/desktop/ms724832(v=vs.85).aspx
         # that would be every version >= [6, 3].
@@ -516,80 +608,61 @@ class WindowsVideo(object):
 
             # There are video cards that are not supported for the 64bit build on Windows 10,
             # so find out what the video controller is
-            try:
-                pshell_graphics = pshell('-Command', "\"CimCmdlets\\Get-CimInstance -ClassName Win32_VideoController | Select-Object -ExpandProperty Name\"")
-            except PShellError as err:
-                log.warning(err)
+            hardware = WindowsHardware.get()
+            pshell_list = hardware.get('gpus')
+            if not pshell_list:
                 # MAINT-8200: If we can't get information about the video
                 # card, conservatively assume we'll need the 32-bit viewer.
                 # The downside if we guess wrong is a performance hit, which
                 # can be overridden by the ForceAddressSize parameter. If we
                 # guess the other way, the downside is a viewer crash.
+                log.warning("power shell did not return any video cards")
                 WindowsVideo.hasOnlyUnsupported = True
             else:
-                log.debug("power shell graphics card info: %r", pshell_graphics)
-                # first rstrip() every line, then discard any that are completely blank
-                # the first line of the response is always the string literal 'Name'
-                pshell_list = [line for line in
-                                 (ln.rstrip() for ln in pshell_graphics.splitlines())
-                                 if line]
-                if not pshell_list:
-                    log.warning("power shell did not return any video cards")
-                    # use MAINT-8200 reasoning described above
-                    WindowsVideo.hasOnlyUnsupported = True
-                else:
-                    good_cards = []
-                    # The logic here is a little complicated:
-                    # - If there's no bad card, we're good.
-                    # - If there's a bad card AND some other card, still good.
-                    # - If the only card(s) present are bad cards, not good.
-                    for line in pshell_list:
-                        lastword = line.split()[-1]
-                        if not (WindowsVideo.Intel_Graphics in line and
-                                lastword in WindowsVideo.NO64_GRAPHICS_LIST):
-                            # Card not in the list, pass
-                            good_cards.append(line)
+                cpus = hardware.get('cpus')
+                rules = gpu_rules.load()
+                good_cards = []
+                # The logic here is a little complicated:
+                # - If there's no bad card, we're good.
+                # - If there's a bad card AND some other card, still good.
+                # - If the only card(s) present are bad cards, not good.
+                for line in pshell_list:
+                    verdict = rules.classify(line)
+                    if verdict == gpu_rules.GOOD:
+                        # Card not in the list, pass
+                        good_cards.append(line)
+                        continue
+                    # else
+                    if verdict == gpu_rules.CHECK_CPU:
+                        # No specific model. This is either a generic bad
+                        # card or some mislabeled supported GPU. To
+                        # distinguish them we will have to check CPU model.
+                        if not cpus:
+                            log.warning("power shell did not return any CPUs")
                             continue
-                        # else
-                        if (WindowsVideo.Intel_Graphics in line and lastword == "Graphics"):
-                            # Last word is "Graphics", i.e. no specific model.
-                            # This is either a generic Intel(R) HD Graphics or
-                            # some mislabeled supported GPU. To distinguish them
-                            # we will have to check CPU model.
-                            try:
-                                pshell_cpus = pshell('-Command', "\"CimCmdlets\\Get-CimInstance -ClassName Win32_Processor | Select-Object -ExpandProperty Name\"")
-                            except PShellError as err:
-                                log.warning(err)
-                                continue
-                            else:
-                                cpus = [line1 for line1 in
-                                             (ln.rstrip() for ln in pshell_cpus.splitlines())
-                                              if line1]
-
-                            for description, regexp in WindowsVideo.CPU_MODELS:
-                                if regexp.search(cpus[0]):
-                                    log.debug("cpu corresponds to %s: %r",
-                                              description, cpus)
-                                    break
-                            else:
-                                # No regex matches, assume a good card
-                                log.debug("No known CPU regex matches, assume a good card: %r", cpus)
-                                good_cards.append(line)
-
-                    # There's no order guarantee from power shell, this is to prevent an
-                    # HD card discovered after a good card from overwriting the
-                    # state variable by specification, a machine is bad iff ALL of
-                    # the cards on the machine are bad ones
-                    if good_cards:
-                        WindowsVideo.hasOnlyUnsupported = False
-                        log.debug("Found at least one good graphics card: '%s'",
-                                  "', '".join(good_cards))
-                    else:
-                        # all we found were cards that are not supported in the Windows 64bit build
-                        WindowsVideo.hasOnlyUnsupported = True
-                        log.warning("Found only graphics cards not supported in Windows 8.1 or 10: "
-                                    "'%s'; should switch to the 32 bit build",
-                                    "', '".join(pshell_list))
+
+                        description = rules.match_cpu(cpus[0])
+                        if description:
+                            log.debug("cpu corresponds to %s: %r", description, cpus)
+                        else:
+                            # No regex matches, assume a good card
+                            log.debug("No known CPU regex matches, assume a good card: %r", cpus)
+                            good_cards.append(line)
+
+                # There's no order guarantee from power shell, this is to prevent an
+                # HD card discovered after a good card from overwriting the
+                # state variable by specification, a machine is bad iff ALL of
+                # the cards on the machine are bad ones
+                if good_cards:
+                    WindowsVideo.hasOnlyUnsupported = False
+                    log.debug("Found at least one good graphics card: '%s'",
+                              "', '".join(good_cards))
+                else:
+                    # all we found were cards that are not supported in the Windows 64bit build
+                    WindowsVideo.hasOnlyUnsupported = True
+                    log.warning("Found only graphics cards not supported in Windows 8.1 or 10: "
+                                "'%s'; should switch to the 32 bit build",
+                                "', '".join(pshell_list))
 
         return WindowsVideo.hasOnlyUnsupported
 
@@ -683,15 +756,52 @@ def pick_target_platform(log, ForceAddressSize):
     return platdata
 
 @pass_logger
-def download(log, url, version, download_dir, size, hash, ui):
+def repair(log, url, filename, manifest):
+    """
+    Re-fetch just the chunks of 'filename' that don't match 'manifest'.
+    Return the file's new md5, or None if that wasn't possible.
+    """
+    bad = manifest.verify_file(filename)
+    if not bad:
+        # the manifest is happy but the hash isn't: nothing to fix piecemeal
+        return None
+    log.warning("Re-fetching %s of %s chunks that failed verification: %s",
+                len(bad), len(manifest.chunks), bad)
+    try:
+        download_update.refetch_chunks(url, filename, manifest, bad)
+    except Exception as e:
+        log.error("Failed to re-fetch chunks: %s: %s", type(e).__name__, e)
+        return None
+    return md5file(filename)
+
+@pass_logger
+def download(log, url, version, download_dir, size, hash, ui, segments=None, manifest=None,
+             delta=None, rate_limit=None, mirror_urls=None, status=None):
     ground = "foreground" if ui else "background"
 
     log.info("Preparing to download new version %s to %s in %s",
              version, download_dir, ground)
+    # the site may have pre-seeded the installer...
+    installer = offline_bundle.fetch(hash, size, download_dir, url.split('/')[-1])
+    if installer:
+        return installer
+    # ...or another viewer on this host may already have fetched it
+    installer = installer_store.fetch(hash, download_dir, url.split('/')[-1])
+    if installer:
+        return installer
+    if delta:
+        installer = delta_update.try_delta(delta, url, download_dir, hash, ui,
+                                           rate_limit=rate_limit)
+        if installer:
+            installer_store.add(installer, hash)
+            return installer
     #three strikes and you're out
+    #each retry resumes from whatever the previous attempt left on disk
     for download_tries in range(3):
         download_args = dict(url = url, download_dir = download_dir, size = size,
-                             progressbar=ui)
+                             progressbar=ui, segments=segments, manifest=manifest,
+                             rate_limit=rate_limit, mirror_urls=mirror_urls, status=status,
+                             extract=(platform.system() == 'Linux'))
         log.debug("%s%s downloader args: %r",
                   ("trying again -- " if download_tries else ""),
                   ground, download_args)
@@ -699,24 +809,54 @@ def download(log, url, version, download_dir, size, hash, ui):
         # progress bar. Don't also put up a status message; it would only
         # flicker briefly before the progress bar frame is displayed.
         try:
-            filename = download_update.download_update(**download_args)
-        except download_update.FileInUseExcption:
-            raise UpdateError("Download file is locked")
+            filename, down_hash = download_update.download_update(**download_args)
+        except download_update.FileInUseExcption as e:
+            # Another process is already downloading it: rather than fight
+            # over the file, follow along until it's done.
+            log.info("Waiting for other download: %s", e)
+            wait_for_other_download(download_dir, size, ui)
+            filename = apply_update.get_filename(download_dir)
+            if filename and glob.glob(os.path.join(download_dir, "*.done")) \
+               and md5file(filename) == hash:
+                log.info("Other process finished downloading %s", filename)
+                return filename
+            # it failed: take over, resuming whatever it left
+        except download_update.InsufficientSpaceError as e:
+            # retrying won't conjure up disk space
+            message = str(e)
+            log.error(message)
+            if ui:
+                with InstallerUserMessage.intercept_close(UpdateError):
+                    InstallerUserMessage.basic_message(message)
+            raise UpdateError(message)
         except Exception as e:
             # Might be caused by user closing manager
             log.error("Failed to download new version %s in %s downloader: %s: %s",
                       version, ground, type(e).__name__, e)
         else:
+            # Anything unpacked during the download came from the very bytes
+            # download_update() hashed; it's good only if they were.
+            streamed = down_hash is not None and down_hash == hash
             #check to make sure the downloaded file is correct
-            down_hash = md5file(filename)
+            if down_hash is None:
+                # download_update() couldn't hash it on the fly (segmented or
+                # resumed download), so read it back
+                down_hash = md5file(filename)
+            if down_hash != hash and manifest is not None:
+                down_hash = repair(url, filename, manifest) or down_hash
+            if streamed:
+                stream_extract.commit(filename)
+            else:
+                stream_extract.discard(filename)
             if down_hash == hash:
+                installer_store.add(filename, hash)
                 # once we succeed, stop (re)trying
                 return filename
             #try again
             log.warning("Hash mismatch: Expected: %s Received: %s" % (hash, down_hash))
-            # on hash mismatch download folder at minimum contains *.done and installer
-            # download_update creates new directory, so safe to remove whole tree
-            shutil.rmtree(download_dir)
+            # on hash mismatch download folder at minimum contains *.done and installer:
+            # start over, but leave the lock file for whoever else is waiting on it
+            download_lock.clear(download_dir)
 
     else:
         # we got through the whole for loop without once succeeding
@@ -729,6 +869,31 @@ def download(log, url, version, download_dir, size, hash, ui):
 
         raise UpdateError(message)
 
+@pass_logger
+def wait_for_other_download(log, download_dir, size, ui):
+    """
+    Wait for the process holding the download lock on 'download_dir' to
+    finish, following its progress on a progress bar if 'ui'.
+    """
+    message = "Another viewer is downloading this update"
+    if ui:
+        progress = InstallerUserMessage.root()
+        progress.progress_bar(message=message, size=size)
+    else:
+        progress = download_update.DummyProgressBar()
+    shown = 0
+    def report(owner):
+        nonlocal shown
+        completed = owner.get('completed') or 0
+        if size and completed > shown:
+            progress.step(completed - shown,
+                          message="%s: %s%%" % (message, int(100 * completed / size)))
+            shown = completed
+    try:
+        download_lock.wait(download_dir, report)
+    finally:
+        progress.progress_done()
+
 @pass_logger
 def install(log, runner, platform_key, installer):
     InstallerUserMessage.safe_status_message("New version downloaded.\n"
@@ -739,6 +904,8 @@ def install(log, runner, platform_key, installer):
     # 'version' for informational messages anyway.
     download_dir = os.path.dirname(installer)
     version = os.path.basename(download_dir)
+    # keep this installer around to patch the next update against
+    delta_update.retain(installer, version)
     try:
         runner = apply_update.apply_update(runner, installer, platform_key)
     except apply_update.ApplyError as err:    
@@ -859,21 +1026,6 @@ def update_manager(log, existing_viewer, cli_overrides = {}):
 
     # cli_overrides is a dict where the keys are specific parameters of interest and the values are the arguments
 
-    #setup and getting initial parameters
-    settings = get_settings(cli_overrides.get('settings') or Application.user_settings_path())
-
-    # 'settings' is from the settings file. Now apply command-line overrides.
-    settings.override_with(cli_overrides.get('set', {}))
-
-    ForceAddressSize = settings.get('ForceAddressSize')
-    platdata = pick_target_platform(ForceAddressSize)
-
-    # If cli_overrides['set']['UpdaterServiceSetting'], use that; else if
-    # settings['UpdaterServiceSetting']['Value'], use that; if none of the
-    # above, or if value is not valid, use default from decode_install_mode().
-    install_key = settings.get('UpdaterServiceSetting')
-    install_mode = decode_install_mode(install_key)
-
     # get channel
     default_channel = BuildData.get('Channel')
     channel = cli_overrides.get('channel')
@@ -882,14 +1034,42 @@ def update_manager(log, existing_viewer, cli_overrides = {}):
                  (default_channel, channel))
         BuildData.override('Channel', channel)
 
-    #log.debug("Pre query settings:\n%s", pformat(settings)) # too big to leave this in all the time
-    
-    # Clean previous download of current version before starting next update
-    # This only deletes installer that was marked as 'winstall' (was already installed)
-    cleanup_previous_download(platdata.key)
-
-    #  On launch, the Viewer Manager should query the Viewer Version Manager update api.
-    result_data = query_vvm_from_settings(platform_data=platdata, settings=settings)
+    def read_settings():
+        settings = get_settings(cli_overrides.get('settings') or Application.user_settings_path())
+        # 'settings' is from the settings file. Now apply command-line overrides.
+        settings.override_with(cli_overrides.get('set', {}))
+        return settings
+
+    # The independent steps of the update check run concurrently: see task_graph.
+    platform_key = Application.platform_key()
+    steps = task_graph.run(dict(
+        #setup and getting initial parameters
+        settings=(read_settings, ()),
+        platdata=(lambda settings: pick_target_platform(settings.get('ForceAddressSize')),
+                  ('settings',)),
+        # If cli_overrides['set']['UpdaterServiceSetting'], use that; else if
+        # settings['UpdaterServiceSetting']['Value'], use that; if none of the
+        # above, or if value is not valid, use default from decode_install_mode().
+        install_mode=(lambda settings: decode_install_mode(settings.get('UpdaterServiceSetting')),
+                      ('settings',)),
+        vvm_id=(lambda: make_VVM_UUID_hash(platform_key), ()),
+        # Clean previous download of current version before starting next update
+        # This only deletes installer that was marked as 'winstall' (was already installed)
+        cleanup=(lambda: cleanup_previous_download(platform_key), ()),
+        #  On launch, the Viewer Manager should query the Viewer Version Manager update api.
+        result_data=(lambda settings, platdata, vvm_id:
+                     query_vvm_from_settings(platform_data=platdata, settings=settings,
+                                             vvm_id=vvm_id),
+                     ('settings', 'platdata', 'vvm_id')),
+    ))
+    settings, platdata, install_mode, result_data = \
+        (steps[name] for name in ('settings', 'platdata', 'install_mode', 'result_data'))
+
+    # None unless the user wants to override SL_DOWNLOAD_SEGMENTS
+    segments = settings.get('UpdaterDownloadSegments')
+    # e.g. '500K' or '25%': how much bandwidth a background download may take
+    # from the viewer; None defers to SL_DOWNLOAD_RATE_LIMIT
+    rate_limit = settings.get('UpdaterDownloadRateLimit')
 
     #nothing to do or error
     if not result_data:
@@ -918,20 +1098,31 @@ def update_manager(log, existing_viewer, cli_overrides = {}):
 
     # determine if we've tried this download before
     downloaded = check_for_completed_download(download_dir, chosen_result['size'])
+    # other places to fetch the same installer from
+    mirror_urls = mirrors.from_result(chosen_result, settings.get('UpdaterMirrors'))
 
     #  If the response indicates that there is a required update: 
     if chosen_result['required']:
         log.info("Required update to %s version %s" % (chosen_result['platform'], chosen_result['version']))
         #  Check for a completed download of the required update; if found, display an alert, install the required update, and launch the newly installed viewer.
         #  If [optional download and] Install Automatically: display an alert, install the update and launch updated viewer.
-        if downloaded is None:
-            # start the download, exception if we fail
-            installer = download(url = chosen_result['url'],
-                                 version = chosen_result['version'],
-                                 download_dir = download_dir,
-                                 hash = chosen_result['hash'],
-                                 size = chosen_result['size'],
-                                 ui = True)
+        if downloaded is None or \
+           (downloaded == 'skip' and download_in_progress(download_dir)):
+            # start the download, exception if we fail -- or if another
+            # process is already downloading it, wait for that and make sure
+            # it's finished and intact: see download()
+            installer = download_scheduler.run(download_scheduler.REQUIRED, download_dir, download,
+                                               url = chosen_result['url'],
+                                               version = chosen_result['version'],
+                                               hash = chosen_result['hash'],
+                                               size = chosen_result['size'],
+                                               ui = True,
+                                               segments = segments,
+                                               # per-chunk digests, if the VVM offers
+                                               # them, let us repair a bad download
+                                               manifest = chunk_manifest.from_result(chosen_result),
+                                               delta = chosen_result.get('delta'),
+                                               mirror_urls = mirror_urls)
         else:
             installer = apply_update.get_filename(download_dir)
         # Do the install
@@ -957,19 +1148,32 @@ def update_manager(log, existing_viewer, cli_overrides = {}):
         if downloaded is None:
             # start a background download
             log.info("Found optional update. Downloading in background to: " + download_dir)
-            # Create and launch a background thread. Because we do NOT set
-            # this thread as daemon, the process won't terminate until the
-            # thread completes.
-            background = threading.Thread(
-                name="downloader",
-                target=download,
-                kwargs=dict(url = chosen_result['url'],
-                            version = chosen_result['version'],
-                            download_dir = download_dir,
-                            hash = chosen_result['hash'],
-                            size = chosen_result['size'],
-                            ui=False))
-            background.start()
+            try:
+                # A detached process, so this one can exit once the viewer
+                # is running.
+                download_worker.spawn(chosen_result, download_dir, segments=segments,
+                                      rate_limit=rate_limit, mirror_urls=mirror_urls)
+            except Exception as e:
+                log.warning("Can't spawn background downloader (%s: %s); using a thread",
+                            type(e).__name__, e)
+                # Create and launch a background thread. Because we do NOT set
+                # this thread as daemon, the process won't terminate until the
+                # thread completes.
+                def background_download():
+                    # fetching the manifest can take a while: not on our time
+                    download_scheduler.run(download_scheduler.OPTIONAL, download_dir, download,
+                                           url = chosen_result['url'],
+                                           version = chosen_result['version'],
+                                           hash = chosen_result['hash'],
+                                           size = chosen_result['size'],
+                                           ui=False,
+                                           segments=segments,
+                                           manifest=chunk_manifest.from_result(chosen_result),
+                                           delta=chosen_result.get('delta'),
+                                           rate_limit=rate_limit,
+                                           mirror_urls=mirror_urls)
+                background = threading.Thread(name="downloader", target=background_download)
+                background.start()
             # run the previously-installed viewer
             return existing_viewer
         elif downloaded == 'done' or downloaded == 'next':
@@ -23,9 +23,11 @@ import os.path
 from pathlib import Path
 import platform
 from io import StringIO
+import queue
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
 # Because of the evolution over time of the specification of VMP, some methods
@@ -127,6 +129,102 @@ def log_calls(func):
 
     return wrapper
 
+# ****************************************************************************
+#   parse_size()
+# ****************************************************************************
+def parse_size(text):
+    """'64K', '1M', '1G' or a plain byte count"""
+    units = dict(K=1024, M=1024**2, G=1024**3)
+    text = text.strip().upper()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+# ****************************************************************************
+#   config_int()
+# ****************************************************************************
+def config_int(value, envname, default):
+    """
+    Return 'value' as an int if the caller passed one (possibly as a string,
+    e.g. from a settings file), else the int value of environment variable
+    'envname', else 'default'. Garbage in either place is logged and ignored.
+    """
+    log=SL_Logging.getLogger('config_int')
+    for source, candidate in (('argument', value), (envname, os.getenv(envname))):
+        if candidate is None or candidate == '':
+            continue
+        try:
+            return int(candidate)
+        except (TypeError, ValueError):
+            log.warning("Ignoring invalid %s value %r", source, candidate)
+    return default
+
+# ****************************************************************************
+#   on_hub(), hub_threading(), hub_queue(), HubLock
+# ****************************************************************************
+# SLVersionChecker monkeypatches sockets, time, subprocess and the like, but
+# not threads: its eventlet hub, and with it every greenthread, lives on the
+# main thread. There, a real lock that has to wait stops every greenthread at
+# once -- including whichever one holds it. Real threads may block all they
+# like.
+def on_hub():
+    """Is the caller on the thread where SLVersionChecker's eventlet hub runs?"""
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched('socket') and \
+           threading.current_thread() is threading.main_thread()
+
+def hub_threading():
+    """
+    The threading module for a caller and the threads it starts to share: on
+    the hub, eventlet.green.threading, whose Threads are greenthreads and
+    whose waits yield; anywhere else, plain threading. (Green primitives are
+    no use to real threads, nor real ones to greenthreads: see HubLock for
+    something both may take.)
+    """
+    if on_hub():
+        from eventlet.green import threading as green_threading
+        return green_threading
+    return threading
+
+def hub_queue():
+    """the queue module to go with hub_threading()"""
+    if on_hub():
+        from eventlet.green import Queue as green_queue
+        return green_queue
+    return queue
+
+class HubLock(object):
+    """
+    A lock that greenthreads on the hub and real threads may share: on the
+    hub, acquire() polls for it, yielding in between, instead of blocking.
+    """
+    # how often (seconds) a greenthread retries
+    POLL = 0.05
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not on_hub():
+            return self.lock.acquire()
+        import eventlet
+        while not self.lock.acquire(blocking=False):
+            eventlet.sleep(self.POLL)
+        return True
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
 # ****************************************************************************
 #   SL_Logging
 # ****************************************************************************
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""\
+@file   vvm_cache.py
+@brief  Remember update service responses on disk, so that launching the
+        viewer several times in a row asks the Viewer Version Manager once.
+
+Each response is kept in <userpath>/vvm_cache/<sha1 of the query URL>, which
+includes channel, version, platform, willing-to-test and machine id. That
+includes 404 -- the VVM's usual answer for an unmanaged channel.
+
+A response is fresh for SL_VVM_CACHE_TTL seconds (default TTL; 0 turns the
+cache off), or for whatever max-age the service sends in Cache-Control. A
+stale response that came with an ETag is revalidated with If-None-Match, so
+an unchanged answer costs a round trip but no body. Cache-Control no-store
+is honored, and no-cache means always revalidate.
+
+$LicenseInfo:firstyear=2024&license=viewerlgpl$
+Copyright (c) 2024, Linden Research, Inc.
+$/LicenseInfo$
+"""
+
+from contextlib import suppress
+import hashlib
+from llbase import llrest
+import llsd
+import os
+import re
+import time
+from util import Application, config_int, pass_logger
+
+TTL = 15*60
+# entries not written for this long (seconds) are for versions long gone
+PRUNE_AGE = 30*24*60*60
+
+def cache_dir():
+    return os.path.join(Application.userpath(), "vvm_cache")
+
+def ttl():
+    return config_int(None, 'SL_VVM_CACHE_TTL', TTL)
+
+def _path(url):
+    return os.path.join(cache_dir(), hashlib.sha1(url.encode('utf8')).hexdigest())
+
+def load(url):
+    """the cached record for 'url', or None"""
+    try:
+        with open(_path(url), 'rb') as f:
+            record = llsd.parse(f.read())
+    except Exception:
+        return None
+    # a hash collision is vanishingly unlikely, but cheap to rule out
+    return record if isinstance(record, dict) and record.get('url') == url else None
+
+def lifetime(headers, default):
+    """
+    How long (seconds) a response with 'headers' stays fresh: None means
+    don't store it at all.
+    """
+    control = headers.get('Cache-Control', '').lower()
+    if 'no-store' in control:
+        return None
+    if 'no-cache' in control:
+        return 0
+    match = re.search(r'max-age\s*=\s*(\d+)', control)
+    return int(match.group(1)) if match else default
+
+@pass_logger
+def store(log, url, status, result, headers, default=None):
+    """cache 'result' (None for a 404) as the response to 'url'"""
+    seconds = lifetime(headers, ttl() if default is None else default)
+    path = _path(url)
+    if seconds is None:
+        with suppress(OSError):
+            os.remove(path)
+        return
+    now = time.time()
+    record = dict(url=url, status=status, result=result, etag=headers.get('ETag'),
+                  expires=now + seconds)
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        # write-then-rename so a reader never sees half a record
+        with open(path + '.tmp', 'wb') as f:
+            f.write(llsd.format_xml(record))
+        os.replace(path + '.tmp', path)
+        _prune(now)
+    except OSError as err:
+        log.warning("Can't cache update service response in %s: %s: %s",
+                    path, type(err).__name__, err)
+
+def _prune(now):
+    with os.scandir(cache_dir()) as it:
+        for entry in it:
+            if now - entry.stat().st_mtime > PRUNE_AGE:
+                with suppress(OSError):
+                    os.remove(entry.path)
+
+def _replay(service, record):
+    if record['status'] == 404:
+        # just as the service itself would have said it
+        raise llrest.RESTError(service.name, record['url'], 404,
+                               "URL ({url}) Not found (cached)")
+    return record['result']
+
+@pass_logger
+def get(log, service, path, params={}, use_fresh=True):
+    """
+    Like service.get(path, params=params), but through the cache. Pass
+    use_fresh=False to go to the service even if we have a fresh response
+    (though it may still tell us ours is current).
+    """
+    seconds = ttl()
+    if not seconds:
+        return service.get(path, params=params)
+    url = '/'.join((service.baseurl.rstrip('/'), path))
+    cached = load(url)
+    if cached is not None and use_fresh and time.time() < cached['expires']:
+        log.info("Using update service response cached until %s",
+                 time.strftime("%H:%M:%S", time.localtime(cached['expires'])))
+        return _replay(service, cached)
+
+    headers = {}
+    if cached is not None and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    # llrest only hands back the decoded body: catch the response on its way
+    responses = []
+    def capture(response, *args, **kwds):
+        responses.append(response)
+    try:
+        result = service.get(path, params=params, headers=headers,
+                             hooks=dict(response=capture))
+    except llrest.RESTError as err:
+        if err.status == 404 and responses:
+            store(url, 404, None, responses[-1].headers, seconds)
+        raise
+    response = responses[-1] if responses else None
+    if response is None:
+        return result
+    if response.status_code == 304 and cached is not None:
+        log.info("Update service says our cached response is current")
+        headers = response.headers.copy()
+        headers.setdefault('ETag', cached['etag'])
+        store(url, cached['status'], cached['result'], headers, seconds)
+        return _replay(service, cached)
+    store(url, response.status_code, result, response.headers, seconds)
+    return result